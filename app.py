@@ -2,18 +2,22 @@
 import dash
 import dash_bootstrap_components as dbc
 from dash import html, dcc
-from dash.dependencies import Input, Output, State
-from pymongo import MongoClient
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
 from tabs.scraper_tab import scraper_layout, register_scraper_callbacks
 from tabs.community_tab import community_layout, settings_layout, register_twitter_callbacks
 from util.layout import sidebar, content, details_modal, overview_modal, ai_recommendation_modal
 from tabs.ipo_tab import ipo_layout, register_ipo_callbacks
 from tabs.overview_tab import register_overview_callbacks, overview_layout
 from tabs.portfolio_tab import register_portfolio_callback, portfolio_layout
+from tabs.screener_tab import screener_layout, register_screener_callbacks
 from tabs.stock_details_tab import stock_details_layout, register_stock_details_callbacks
 from tabs.settings_tab import settings_layout, register_settings_callbacks
 from tabs.notifications_tab import notifications_layout, register_notifications_callbacks
-from util.database import DatabaseConnection as db
+from util.indexes import ensure_indexes
+from util.quarterly_metrics import start_recommendation_recompute
+from util.search_index import get_search_index, search_stocks
+from util.callback_metrics import instrument_callbacks
 import diskcache
 import threading
 import schedule
@@ -21,20 +25,37 @@ import time
 
 # Initialize Diskcache
 cache = diskcache.Cache("./cache")
-long_callback_manager = dash.long_callback.DiskcacheLongCallbackManager(cache)
+# Runs background=True callbacks (e.g. the overview frame build) in worker processes
+background_callback_manager = dash.DiskcacheManager(cache)
 
 # Initialize Dash app
 app = dash.Dash(__name__, external_stylesheets=[
     dbc.themes.FLATLY,
     'https://use.fontawesome.com/releases/v5.8.1/css/all.css',
     '/assets/styles/index.css'  # Updated path
-], suppress_callback_exceptions=True, long_callback_manager=long_callback_manager)
+], suppress_callback_exceptions=True, background_callback_manager=background_callback_manager)
 
 server = app.server  # For deploying on platforms like Heroku
 
+# Create any missing indexes before the first request hits the hot paths
+try:
+    ensure_indexes()
+except Exception as e:
+    print(f"Error ensuring MongoDB indexes: {str(e)}")
+
+# Rescore stored recommendations in the background if the model version changed
+try:
+    start_recommendation_recompute()
+except Exception as e:
+    print(f"Error starting recommendation recompute: {str(e)}")
+
+# Time every callback registered below and serve the numbers on /metrics
+instrument_callbacks(app)
+
 # Register callbacks from other files
 register_overview_callbacks(app)
 register_portfolio_callback(app)
+register_screener_callbacks(app)
 register_twitter_callbacks(app)
 register_scraper_callbacks(app)
 register_ipo_callbacks(app)
@@ -69,6 +90,8 @@ def display_page(pathname):
             return stock_details_layout(company_name)
         elif pathname == "/portfolio":
             return portfolio_layout()
+        elif pathname == "/screener":
+            return screener_layout()
         elif pathname == "/scraper":
             return scraper_layout()
         elif pathname == "/community":
@@ -85,6 +108,20 @@ def display_page(pathname):
         print(f"Error loading page: {str(e)}")
         return dbc.Container(html.Div(["An error occurred while loading the page."], className="text-danger"), fluid=True)
 
+@app.callback(
+    Output('stock-search-sidebar', 'options'),
+    Input('stock-search-sidebar', 'search_value'),
+    State('stock-search-sidebar', 'value')
+)
+def update_search_options(search_value, current_value):
+    if not search_value:
+        raise PreventUpdate
+    options = search_stocks(search_value)
+    # Keep the current selection in the options, otherwise the dropdown clears it
+    if current_value and all(option['value'] != current_value for option in options):
+        options.append({'label': current_value, 'value': current_value})
+    return options
+
 @app.callback(
     [Output('url', 'pathname'),
      Output('search-feedback', 'children')],
@@ -94,10 +131,10 @@ def display_page(pathname):
 def search_stock(value, current_pathname):
     if value:
         try:
-            # Validate that the stock exists in your database
-            stock = db.get_collection('detailed_financials').find_one({"company_name": {'$regex': f'^{value}$', '$options': 'i'}})
-            if stock:
-                return f"/stock/{stock['company_name']}", ""
+            # Validate against the in-memory index instead of an unindexable $regex
+            company_name = get_search_index().lookup(value)
+            if company_name:
+                return f"/stock/{company_name}", ""
             else:
                 return current_pathname, f"Stock '{value}' not found."
         except Exception as e:
@@ -105,15 +142,12 @@ def search_stock(value, current_pathname):
             return current_pathname, f"An error occurred during search: {str(e)}"
     return dash.no_update, dash.no_update
 
-@app.callback(
+# Pure class flip: runs in the browser (assets/clientside.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='ui', function_name='toggleDarkMode'),
     Output('main-container', 'className'),
     Input('dark-mode-switch', 'value')
 )
-def toggle_dark_mode(dark_mode):
-    if dark_mode:
-        return "h-100 dark-mode"
-    else:
-        return "h-100"
 
 # Run the app
 if __name__ == '__main__':
@@ -0,0 +1,78 @@
+// assets/clientside.js
+// Pure-UI callbacks that run in the browser instead of costing a server round trip.
+// Wired up with ClientsideFunction(namespace='ui', function_name=...).
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    ui: {
+        toggleDarkMode: function(darkMode) {
+            return darkMode ? 'h-100 dark-mode' : 'h-100';
+        },
+
+        closeModal: function(nClicks) {
+            return false;
+        },
+
+        firstPage: function(value) {
+            return 0;
+        },
+
+        // Only clicks on an AI cell go on to the server (which loads the analysis history)
+        requestAnalysis: function(stocksCell, topCell, worstCell, latestCell,
+                                  stocksRows, topRows, worstRows, latestRows) {
+            const ctx = window.dash_clientside.callback_context;
+            if (!ctx.triggered.length) {
+                return window.dash_clientside.no_update;
+            }
+            const tables = {
+                'stocks-table': [stocksCell, stocksRows],
+                'top-performers-table': [topCell, topRows],
+                'worst-performers-table': [worstCell, worstRows],
+                'latest-results-table': [latestCell, latestRows]
+            };
+            const [cell, rows] = tables[ctx.triggered[0].prop_id.split('.')[0]] || [];
+            if (!cell || !rows || cell.column_id !== 'ai_indicator' || !rows[cell.row]) {
+                return window.dash_clientside.no_update;
+            }
+            const row = rows[cell.row];
+            return {symbol: row.symbol, name: row.company_name, requested_at: Date.now()};
+        },
+
+        // The history store holds {analysis id: text}, so switching entries needs no server call
+        showAnalysis: function(analysisId, history) {
+            if (!analysisId) {
+                return 'No previous analysis available.';
+            }
+            return (history && history[analysisId]) || 'Analysis not found.';
+        },
+
+        generateIpoPrompt: function(nClicks, combinedData) {
+            const noUpdate = window.dash_clientside.no_update;
+            if (!nClicks || !combinedData) {
+                return [noUpdate, noUpdate, noUpdate, noUpdate];
+            }
+            // Limit to 5 current IPOs for a more focused analysis
+            const currentIpos = (combinedData.current || []).slice(0, 5);
+            if (!currentIpos.length) {
+                return ['', {display: 'none'}, {display: 'block'}, ''];
+            }
+
+            const numberedIpos = currentIpos
+                .map((ipo, i) => `${i + 1}. ${ipo['Company Name'].split('(')[0].trim()} `)
+                .join('\n');
+            const prompt = `Analyze the following current IPOs:
+    ${numberedIpos}
+
+    For each IPO, provide:
+        1. Investment Recommendation: Brief summary based on market sentiment.
+        2. Ranking for Investment Potential: Compared to other IPOs.
+        3. Financial Health: Key growth metrics and profitability.
+        4. Valuation and Pricing: Is it overvalued or fairly priced?
+        5. GMP (Grey Market Premium): Indication of market interest.
+        6. Risk Factors: Major risks to consider.
+
+        Keep each analysis concise. Include relevant hashtags like #stockname #stockanalysis #Valuation #Financials #Metrics. In the end provide recommendation based on data about which IPO to invest in and which IPO to avoid`;
+
+            return [prompt, {display: 'block'}, {display: 'none'}, prompt];
+        }
+    }
+});
@@ -5,19 +5,19 @@ from selenium import webdriver
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from bs4 import BeautifulSoup
-import os
-from pymongo import MongoClient
 import datetime
+from pymongo import UpdateOne
+from util.bulk_writer import BulkWriter
+from util.quarterly_metrics import quarter_upsert_op, quarter_fields_op, load_known_quarters, QUARTERLY_COLLECTION
+from util.general_util import add_typed_metrics, parse_estimate
+from util.data_version import bump_data_generation
+from util.database import DatabaseConnection
 from scraper_login import login_to_moneycontrol, setup_webdriver
 import time
 logger = logging.getLogger(__name__)
 
 
-client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = client['stock_data']
-collection = db['detailed_financials']
-
-def process_estimate_card(card):
+def process_estimate_card(card, writer, known_quarters):
     try:
         company_name = card.find_element(By.CSS_SELECTOR, 'h3 a').text.strip()
         quarter = card.find_element(By.CSS_SELECTOR, 'tr th:nth-child(1)').text.strip()
@@ -56,43 +56,57 @@ def process_estimate_card(card):
             "fundamental_insights": "NA",
             "fundamental_insights_description": "NA"
         }
-        update_or_insert_company_data(company_name, quarter, default_financial_data)
+        add_typed_metrics(default_financial_data)
+        update_or_insert_company_data(company_name, quarter, default_financial_data, writer, known_quarters)
 
     except StaleElementReferenceException:
         logger.warning("Stale element encountered. Skipping this card.")
     except Exception as e:
         logger.error(f"Error processing estimates for {company_name}: {e}")
 
-def update_or_insert_company_data(company_name, quarter, financial_data):
-    existing_company = collection.find_one({"company_name": company_name})
+def update_or_insert_company_data(company_name, quarter, financial_data, writer, known_quarters):
+    existing_company = known_quarters.get(company_name)
+    if existing_company and quarter in existing_company['quarters']:
+        estimates = financial_data['estimates']
+        typed_estimates = parse_estimate(estimates)
+        writer.add('detailed_financials', UpdateOne(
+            {"company_name": company_name},
+            {"$set": {
+                "financial_metrics.$[m].estimates": estimates,
+                "financial_metrics.$[m].typed.estimates": typed_estimates
+            }},
+            array_filters=[{"m.quarter": quarter}]
+        ))
+        writer.add(QUARTERLY_COLLECTION, quarter_fields_op(company_name, quarter, {
+            "estimates": estimates,
+            "typed.estimates": typed_estimates
+        }, financial_data.get('result_date')))
+        logger.info(f"Queued estimates update for {company_name} - {quarter}")
+        return
+
     if existing_company:
-        existing_quarters = [metric['quarter'] for metric in existing_company['financial_metrics']]
-        if quarter in existing_quarters:
-            collection.update_one(
-                {"company_name": company_name, "financial_metrics.quarter": quarter},
-                {"$set": {"financial_metrics.$.estimates": financial_data['estimates']}}
-            )
-            logger.info(f"Updated estimates for {company_name} - {quarter}")
-        else:
-            collection.update_one(
-                {"company_name": company_name},
-                {"$push": {"financial_metrics": financial_data}}
-            )
-            logger.info(f"Added new quarter data for {company_name} - {quarter}")
+        logger.info(f"Adding new quarter data for {company_name} - {quarter}")
     else:
-        new_company = {
-            "company_name": company_name,
-            "symbol": "NA",
-            "financial_metrics": [financial_data],
-            "timestamp": datetime.datetime.utcnow()
-        }
-        collection.insert_one(new_company)
-        logger.info(f"Created new entry for {company_name}")
+        existing_company = known_quarters[company_name] = {'symbol': 'NA', 'quarters': set()}
+        logger.info(f"Creating new entry for {company_name}")
+    writer.add('detailed_financials', UpdateOne(
+        {"company_name": company_name},
+        {
+            "$push": {"financial_metrics": financial_data},
+            "$setOnInsert": {"symbol": "NA", "timestamp": datetime.datetime.utcnow()}
+        },
+        upsert=True
+    ))
+    existing_company['quarters'].add(quarter)
+    writer.add(QUARTERLY_COLLECTION, quarter_upsert_op(company_name, existing_company['symbol'], financial_data))
 
 def scrape_estimates_vs_actuals(url):
     driver = setup_webdriver()
     last_card_count = 0  # Initialize here to avoid referencing before assignment
+    writer = BulkWriter(on_flush=lambda report: bump_data_generation(*report['collections']))
     try:
+        with DatabaseConnection.query_scope('scraper:load_known_quarters'):
+            known_quarters = load_known_quarters()
         login_to_moneycontrol(driver, url)
         logger.info(f"Opening page: {url}")
         driver.get(url)
@@ -117,7 +131,8 @@ def scrape_estimates_vs_actuals(url):
                 no_new_content_count = 0
        
             for card in estimate_cards[last_card_count:]:
-                process_estimate_card(card)
+                with DatabaseConnection.query_scope('scraper:estimate_card'):
+                    process_estimate_card(card, writer, known_quarters)
 
             last_card_count = len(estimate_cards)
             driver.execute_script("arguments[0].scrollIntoView();", estimate_cards[-1])
@@ -128,5 +143,7 @@ def scrape_estimates_vs_actuals(url):
     except Exception as e:
         logger.error(f"Error during estimates scraping: {e}")
     finally:
-        logger.info(f"Processed a total of {last_card_count} cards.")
+        with DatabaseConnection.query_scope('scraper:flush'):
+            writer.flush()
+        logger.info(f"Processed a total of {last_card_count} cards in {len(writer.reports)} flushes.")
         driver.quit()
\ No newline at end of file
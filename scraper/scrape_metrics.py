@@ -4,18 +4,18 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from bs4 import BeautifulSoup
 import logging
-import os
-from pymongo import MongoClient
 import datetime
+from pymongo import UpdateOne
+from util.quarterly_metrics import quarter_upsert_op, QUARTERLY_COLLECTION
+from util.general_util import add_typed_metrics
 
 logger = logging.getLogger(__name__)
 
-# MongoDB setup
-client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = client['stock_data']
-collection = db['detailed_financials']
-
-def process_result_card(card, driver):
+def process_result_card(card, driver, writer, known_quarters):
+    """
+    Buffers the writes for one result card on writer. known_quarters is the
+    load_known_quarters() map for this scrape; it is updated as cards are queued.
+    """
     try:
         company_name = card.select_one('h3 a').text.strip() if card.select_one('h3 a') else None
         if not company_name:
@@ -31,36 +31,40 @@ def process_result_card(card, driver):
 
         # Check if the company already has financial data for the current quarter
         financial_data = extract_financial_data(card)
-        existing_company = collection.find_one({"company_name": company_name})
-        if existing_company:
-            existing_quarters = [metric['quarter'] for metric in existing_company['financial_metrics']]
-            if financial_data['quarter'] in existing_quarters:
-                logger.info(f"{company_name} already has data for {financial_data['quarter']}. Skipping.")
-                return  # Skip processing if data for the quarter already exists
+        existing_company = known_quarters.get(company_name)
+        if existing_company and financial_data['quarter'] in existing_company['quarters']:
+            logger.info(f"{company_name} already has data for {financial_data['quarter']}. Skipping.")
+            return  # Skip processing if data for the quarter already exists
 
         additional_metrics, symbol = scrape_financial_metrics(driver, stock_link)
         
         if additional_metrics:
             financial_data.update(additional_metrics)
 
-        # Insert or update the financial data in the database
+        # Store canonical typed values next to the scraped strings
+        add_typed_metrics(financial_data)
+
+        # Push the quarter, creating the company document on first sight
         if existing_company:
             logger.info(f"Adding new data for {company_name} - {financial_data['quarter']}")
-            collection.update_one(
-                {"company_name": company_name},
-                {"$push": {"financial_metrics": financial_data}}
-            )
+            symbol = existing_company['symbol']
         else:
             logger.info(f"Creating new entry for {company_name}")
-            stock_data = {
-                "company_name": company_name,
-                "symbol": symbol,
-                "financial_metrics": [financial_data],
-                "timestamp": datetime.datetime.utcnow()
-            }
-            collection.insert_one(stock_data)
-
-        logger.info(f"Data for {company_name} (quarter {financial_data['quarter']}) processed successfully.")
+            existing_company = known_quarters[company_name] = {'symbol': symbol, 'quarters': set()}
+        writer.add('detailed_financials', UpdateOne(
+            {"company_name": company_name},
+            {
+                "$push": {"financial_metrics": financial_data},
+                "$setOnInsert": {"symbol": symbol, "timestamp": datetime.datetime.utcnow()}
+            },
+            upsert=True
+        ))
+        existing_company['quarters'].add(financial_data['quarter'])
+
+        # Keep the flattened per-quarter store in sync
+        writer.add(QUARTERLY_COLLECTION, quarter_upsert_op(company_name, symbol, financial_data))
+
+        logger.info(f"Data for {company_name} (quarter {financial_data['quarter']}) queued.")
 
     except Exception as e:
         logger.error(f"Error processing {company_name}: {str(e)}")
@@ -7,14 +7,21 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException, WebDriverException
 from bs4 import BeautifulSoup
-from pymongo import MongoClient, UpdateOne
 import datetime
 import time
 import logging
 from dotenv import load_dotenv
+
+# Make the project root importable so the scrapers can share util/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from scraper_login import setup_webdriver, login_to_moneycontrol
 from scrape_estimates import process_estimate_card, update_or_insert_company_data, scrape_estimates_vs_actuals
 from scrape_metrics import extract_financial_data, scrape_financial_metrics, process_result_card
+from util.bulk_writer import BulkWriter
+from util.quarterly_metrics import load_known_quarters
+from util.data_version import bump_data_generation
+from util.database import DatabaseConnection
 
 
 # Load environment variables
@@ -24,14 +31,9 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# MongoDB setup
-client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = client['stock_data']
-collection = db['detailed_financials']
-
-
 def scrape_moneycontrol_earnings(url):
     driver = setup_webdriver()
+    writer = BulkWriter(on_flush=lambda report: bump_data_generation(*report['collections']))
     try:
         login_to_moneycontrol(driver, url)
         logger.info(f"Opening page: {url}")
@@ -49,8 +51,11 @@ def scrape_moneycontrol_earnings(url):
         result_cards = soup.select('li.rapidResCardWeb_gryCard__hQigs')
         logger.info(f"Found {len(result_cards)} result cards to process")
 
+        with DatabaseConnection.query_scope('scraper:load_known_quarters'):
+            known_quarters = load_known_quarters()
         for card in result_cards:
-            process_result_card(card, driver)
+            with DatabaseConnection.query_scope('scraper:result_card'):
+                process_result_card(card, driver, writer, known_quarters)
 
     except TimeoutException:
         logger.error("Timeout waiting for page to load")
@@ -59,6 +64,8 @@ def scrape_moneycontrol_earnings(url):
     except Exception as e:
         logger.error(f"Unexpected error during scraping: {str(e)}")
     finally:
+        with DatabaseConnection.query_scope('scraper:flush'):
+            writer.flush()
         driver.quit()
 
 
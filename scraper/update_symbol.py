@@ -1,14 +1,19 @@
+import os
+import sys
 import json
-from pymongo import MongoClient
+
+# Make the project root importable so the scrapers can share util/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util.database import DatabaseConnection
+from util.quarterly_metrics import get_quarterly_collection
+from util.data_version import bump_data_generation
 
 # Load JSON data from file
 with open('symbol.json', 'r') as f:
     company_symbols = json.load(f)
 
-# Connect to MongoDB
-client = MongoClient('mongodb://localhost:27017/')  # Adjust the URI if necessary
-db = client['stock_data']
-collection = db['detailed_financials']
+# Connect to MongoDB through the shared pooled client
+collection = DatabaseConnection.get_collection('detailed_financials')
 
 # Iterate over the JSON data and update the database
 for company_name, symbol in company_symbols.items():
@@ -20,9 +25,15 @@ for company_name, symbol in company_symbols.items():
         if result.matched_count == 0:
             print(f"No document found for company: {company_name}")
         else:
+            get_quarterly_collection().update_many(
+                {'company_name': company_name},
+                {'$set': {'symbol': symbol}}
+            )
             print(f"Updated symbol for company: {company_name}")
     else:
         print(f"Symbol for company '{company_name}' is 'Not listed'. Skipping update.")
 
+bump_data_generation('detailed_financials')
+
 # Close the MongoDB connection
-client.close()
+DatabaseConnection.close_connection()
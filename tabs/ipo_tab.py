@@ -1,7 +1,7 @@
 #tabs/ipo_tab.py
 import dash_bootstrap_components as dbc
 from dash import html, dcc, dash_table, callback_context
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
 from util.ipo_utils import get_combined_ipo_data, fetch_ipo_details
 import pandas as pd
@@ -23,7 +23,16 @@ def ipo_layout():
         ),
         html.Div(id="ipo-details-container"),
         dbc.Button("Generate Groq Prompt", id="generate-groq-prompt", color="success", className="mt-3"),
-        html.Div(id="groq-prompt-container", className="mt-3"),
+        html.Div([
+            html.Div("No current IPOs available for analysis.", id="groq-prompt-empty",
+                     className="text-warning", style={"display": "none"}),
+            dbc.Card([
+                dbc.CardHeader("Current IPO Analysis Prompt", className="bg-primary text-white"),
+                dbc.CardBody([
+                    html.Pre(id="groq-prompt-pre", style={"white-space": "pre-wrap", "word-break": "keep-all", "font-size": "0.9rem"}),
+                ]),
+            ], id="groq-prompt-card", className="shadow", style={"display": "none"}),
+        ], id="groq-prompt-container", className="mt-3"),
         html.Div(id="groq-prompt-text", style={"display": "none"}),  # Hidden div to store the text
         dcc.Clipboard(
             target_id="groq-prompt-text",
@@ -232,46 +241,13 @@ def register_ipo_callbacks(app):
 
         return dbc.Card(dbc.CardBody(analysis), className="mt-4")
     
-    @app.callback(
-    [Output("groq-prompt-container", "children"),
-     Output("groq-prompt-text", "children")],
-    Input("generate-groq-prompt", "n_clicks"),
-    State("combined-ipo-store", "data")
-)
-    def generate_groq_prompt(n_clicks, combined_data):
-        if not n_clicks or not combined_data:
-            raise PreventUpdate
-
-        current_ipos = combined_data.get('current', [])
-
-        if not current_ipos:
-            return html.Div("No current IPOs available for analysis.", className="text-warning"), ""
-
-        # Limit to 5 current IPOs for a more focused analysis
-        current_ipos = current_ipos[:5]
-
-        numbered_ipos = "\n".join(f"{i+1}. {ipo['Company Name'].split('(')[0].strip()} " for i, ipo in enumerate(current_ipos))
-
-        prompt = f"""Analyze the following current IPOs:
-    {numbered_ipos}
-
-    For each IPO, provide:
-        1. Investment Recommendation: Brief summary based on market sentiment.
-        2. Ranking for Investment Potential: Compared to other IPOs.
-        3. Financial Health: Key growth metrics and profitability.
-        4. Valuation and Pricing: Is it overvalued or fairly priced?
-        5. GMP (Grey Market Premium): Indication of market interest.
-        6. Risk Factors: Major risks to consider.
-
-        Keep each analysis concise. Include relevant hashtags like #stockname #stockanalysis #Valuation #Financials #Metrics. In the end provide recommendation based on data about which IPO to invest in and which IPO to avoid"""
-
-
-        prompt_display = dbc.Card([
-            dbc.CardHeader("Current IPO Analysis Prompt", className="bg-primary text-white"),
-            dbc.CardBody([
-                html.Pre(prompt, style={"white-space": "pre-wrap", "word-break": "keep-all", "font-size": "0.9rem"}),
-            ]),
-            
-        ], className="shadow")
-
-        return prompt_display, prompt
\ No newline at end of file
+    # The prompt only formats data already in the browser's IPO store, so it is built clientside
+    app.clientside_callback(
+        ClientsideFunction(namespace='ui', function_name='generateIpoPrompt'),
+        [Output("groq-prompt-pre", "children"),
+         Output("groq-prompt-card", "style"),
+         Output("groq-prompt-empty", "style"),
+         Output("groq-prompt-text", "children")],
+        Input("generate-groq-prompt", "n_clicks"),
+        State("combined-ipo-store", "data")
+    )
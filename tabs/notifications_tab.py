@@ -3,13 +3,9 @@
 import dash_bootstrap_components as dbc
 from dash import html, dcc
 from dash.dependencies import Input, Output
-from pymongo import MongoClient
 import threading
 import time
-
-# MongoDB connection
-mongo_client = MongoClient('mongodb://localhost:27017/')
-db = mongo_client['stock_data']
+from util.database import DatabaseConnection
 
 def notifications_layout():
     return dbc.Container([
@@ -29,7 +25,7 @@ def register_notifications_callbacks(app):
     )
     def update_notifications(n):
         # Fetch notifications from the database
-        notifications = list(db['notifications'].find().sort("timestamp", -1).limit(10))
+        notifications = list(DatabaseConnection.get_collection('notifications').find().sort("timestamp", -1).limit(10))
         if not notifications:
             return html.Div("No notifications at this time.", className="text-muted")
 
@@ -49,6 +45,7 @@ def register_notifications_callbacks(app):
     # Background thread to generate notifications (example implementation)
     def notification_generator():
         while True:
+            db = DatabaseConnection.get_db()
             settings = db['settings'].find_one({'_id': 'notifications'})
             if settings and settings.get('enabled'):
                 # Example: Check for new IPOs and create a notification
@@ -3,52 +3,173 @@
 import threading
 import time
 from datetime import datetime, timedelta
-from functools import lru_cache
-from bson import ObjectId
 import dash
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
-from dash import html, dash_table, dcc
+from dash import html, dash_table, dcc, Patch
 import dash_bootstrap_components as dbc
-import pandas as pd
 from dash.dash_table.Format import Format, Scheme
 from util.utils import (
     fetch_latest_quarter_data
 )
 from util.analysis import fetch_stock_analysis
-from util.recommendation import generate_stock_recommendation
 from tabs.stock_details_tab import stock_details_layout
 from util.layout import ai_recommendation_modal
-from util.general_util import process_estimates
-from util.ai_recommendation import  get_previous_analyses
+from util.ai_recommendation import get_previous_analyses, store_analysis, get_ai_indicator_asset
+from util.quarterly_metrics import fetch_available_quarters
 from util.database import DatabaseConnection as db
-
-# Cache the processed data
-@lru_cache(maxsize=1)
-def get_cached_data():
-    df = fetch_latest_quarter_data()
+from util.data_version import get_data_generation, TRACKED_COLLECTIONS
+from util.frame_cache import get_or_build_frame, store_frame
+from util.table_query import query_frame, FilterQueryError
+from util.callback_metrics import publish_query_report
+
+# Processed frames per quarter key (None = each company's latest quarter), each stamped
+# with the data generations it is valid for (more than one after an in-place patch)
+_frame_cache = {}
+_frame_cache_lock = threading.Lock()
+
+# Bump when build_overview_frame's columns change so shared-cache entries from older builds are ignored
+OVERVIEW_FRAME_VERSION = 3
+
+# Fields shipped to the browser: the table columns plus what the click handlers and styles read
+ROW_FIELDS = [
+    'company_name', 'symbol', 'in_portfolio', 'cmp', 'net_profit_growth', 'strengths', 'weaknesses',
+    'piotroski_score', 'processed_estimates', 'result_date_display', 'recommendation', 'ai_indicator'
+]
+STOCKS_PAGE_SIZE = 25
+
+# Ten-row tabs in output order; each table's id is '<tab id>-table'
+TOP_TABLE_TABS = ['top-performers', 'worst-performers', 'latest-results']
+
+
+def build_overview_frame(quarter_key=None):
+    df = fetch_latest_quarter_data(quarter_key)
+    if df.empty:
+        return df
+    # Rows carry the recommendation stored at ingestion (stale ones rescored in process_stock_batch)
     df['result_date_display'] = df['result_date'].dt.strftime('%d %b %Y')
-    df['processed_estimates'] = df['estimates'].apply(process_estimates)
-    df['recommendation'] = df.apply(generate_stock_recommendation, axis=1)
     return df
 
+
+def get_cached_data(quarter_key=None, generation=None):
+    """
+    Returns the processed frame, rebuilding it only when a writer has bumped the data generation.
+    Misses fall through to the shared disk cache, so only one worker does the rebuild.
+    """
+    if generation is None:
+        generation = get_data_generation()
+    generation = tuple(generation)
+
+    cached = _frame_cache.get(quarter_key)
+    if cached and generation in cached[0]:
+        return cached[1]
+
+    with _frame_cache_lock:
+        cached = _frame_cache.get(quarter_key)
+        if cached and generation in cached[0]:
+            return cached[1]
+        df = get_or_build_frame(f'overview-v{OVERVIEW_FRAME_VERSION}', quarter_key, generation,
+                                lambda: build_overview_frame(quarter_key))
+        # An empty frame is usually a failed fetch; don't pin it for the whole generation
+        if not df.empty:
+            _frame_cache[quarter_key] = ({generation}, df)
+        return df
+
+
+def peek_cached_data(quarter_key=None, generation=None):
+    """The processed frame if this process already holds it for generation, else None. Never builds."""
+    if generation is None:
+        generation = get_data_generation()
+    cached = _frame_cache.get(quarter_key)
+    if cached and tuple(generation) in cached[0]:
+        return cached[1]
+    return None
+
+
+def patch_cached_analysis(symbol, recommendation, previous_generation, generation):
+    """
+    Applies one newly stored analysis to the cached frames in place. When that write is the
+    only change between the two generations, the patched frames stay valid for the new one
+    (and are shared with the other workers) instead of being rebuilt.
+    """
+    previous_generation, generation = tuple(previous_generation), tuple(generation)
+    ai_index = TRACKED_COLLECTIONS.index('ai_analysis')
+    only_this_write = all(
+        new - old == (1 if i == ai_index else 0)
+        for i, (old, new) in enumerate(zip(previous_generation, generation))
+    )
+
+    with _frame_cache_lock:
+        for quarter_key, (generations, df) in _frame_cache.items():
+            if previous_generation not in generations or df.empty:
+                continue
+            rows = df['symbol'] == symbol
+            df.loc[rows, 'ai_indicator'] = recommendation or ''
+            df.loc[rows, 'ai_recommendation'] = recommendation or 'N/A'
+            if only_this_write:
+                generations.add(generation)
+                try:
+                    store_frame(f'overview-v{OVERVIEW_FRAME_VERSION}', quarter_key, generation, df)
+                except Exception as e:
+                    print(f"Error sharing patched frame: {str(e)}")
+
+
+def patch_table_rows(rows, symbol, recommendation):
+    """A Patch touching only the AI cell of the rows for symbol, or no_update if the table doesn't show it."""
+    indices = [i for i, row in enumerate(rows or []) if row.get('symbol') == symbol]
+    if not indices:
+        return dash.no_update
+    patch = Patch()
+    for i in indices:
+        patch[i]['ai_indicator'] = recommendation or ''
+    return patch
+
+
+def top_table(df, tab_id):
+    """Records for one of the ten-row tabs. Never mutates df, which is shared by the cache."""
+    if df.empty:
+        return []
+    rows = df[ROW_FIELDS + ['result_date']]
+    if tab_id == 'top-performers':
+        rows = rows.nlargest(10, 'net_profit_growth')
+    elif tab_id == 'worst-performers':
+        rows = rows.nsmallest(10, 'net_profit_growth')
+    else:
+        rows = rows.sort_values('result_date', ascending=False).head(10)
+    return rows[ROW_FIELDS].to_dict('records')
+
+
+def stocks_page(df, page_current=0, page_size=STOCKS_PAGE_SIZE, sort_by=None, filter_query=None):
+    """One page of the All Stocks table, filtered and sorted server-side. Returns (records, page_count)."""
+    if df.empty:
+        return [], 1
+    page, page_count = query_frame(df[ROW_FIELDS], filter_query, sort_by, page_current, page_size)
+    return page.to_dict('records'), page_count
+
 def overview_layout():
-    # Initial loading with cached data
-    df = get_cached_data()
-    unique_quarters = sorted(df['quarter'].unique(), reverse=True)
-    latest_quarter = unique_quarters[0] if unique_quarters else None
+    """
+    Renders the page shell only. The frame is built by a background callback and each tab
+    fills its table when it is activated, so first paint doesn't wait on the data.
+    """
+    # Quarter keys sort chronologically, so the first option is the latest quarter
+    quarter_options = fetch_available_quarters()
+    latest_quarter = quarter_options[0]['value'] if quarter_options else None
+    ai_icon = get_ai_indicator_asset()
 
     return dbc.Container([
-        dcc.Store(id='overview-data-store'),
+        # Data generation the tables were built from; polled cheaply, tables rebuild only when it moves
+        dcc.Store(id='overview-generation-store', data=list(get_data_generation())),
+        # Quarter and generation of the last frame the background build finished
+        dcc.Store(id='overview-frame-ready'),
         dcc.Interval(
             id='overview-refresh-interval',
-            interval=300_000,  # Refresh every 5 minutes
+            interval=30_000,  # Check for new writes every 30 seconds
             n_intervals=0
         ),
         html.H2("Market Overview", className="text-center mb-4"),
         dcc.Dropdown(
             id='quarter-dropdown',
-            options=[{'label': quarter, 'value': quarter} for quarter in unique_quarters],
+            options=quarter_options,
             value=latest_quarter,  # Set the default value to the latest quarter
             placeholder="Select a quarter",
             className="mb-4"
@@ -57,20 +178,26 @@ def overview_layout():
         html.Div(id='batch-ai-feedback', className="mb-4"),
         # Add the new Store component
         dcc.Store(id='batch-data-update-timestamp'),
+        html.Div(
+            dbc.Spinner(html.Span("Loading market data...", className="ms-2"), size="sm", color="primary"),
+            id='overview-loading', className="text-center mb-3"
+        ),
+        # Empty table shells; update_tables/update_stocks_page fill the active one
         dbc.Tabs([
-            dbc.Tab(label="Top Performers", children=[
-                create_data_card("Top 10 Performers", 'top-performers-table', df)
+            dbc.Tab(label="Top Performers", tab_id='top-performers', children=[
+                create_data_card("Top 10 Performers", 'top-performers-table', [], ai_icon)
             ]),
-            dbc.Tab(label="Worst Performers", children=[
-                create_data_card("Worst 10 Performers", 'worst-performers-table', df)
+            dbc.Tab(label="Worst Performers", tab_id='worst-performers', children=[
+                create_data_card("Worst 10 Performers", 'worst-performers-table', [], ai_icon)
             ]),
-            dbc.Tab(label="Latest Results", children=[
-                create_data_card("Latest 10 Results", 'latest-results-table', df)
+            dbc.Tab(label="Latest Results", tab_id='latest-results', children=[
+                create_data_card("Latest 10 Results", 'latest-results-table', [], ai_icon)
             ]),
-            dbc.Tab(label="All Stocks", children=[
-                create_data_card("Stocks Overview", 'stocks-table', df)
+            dbc.Tab(label="All Stocks", tab_id='all-stocks', children=[
+                html.Div(id='stocks-table-feedback'),
+                create_data_card("Stocks Overview", 'stocks-table', [], ai_icon, page_count=1)
             ]),
-        ], className="mb-4"),
+        ], id='overview-tabs', active_tab='top-performers', className="mb-4"),
         
         # Include the AI Recommendation Modal
         ai_recommendation_modal,
@@ -80,24 +207,34 @@ def overview_layout():
             dbc.ModalBody(id="overview-details-body"),
         ], id="overview-details-modal", size="lg", scrollable=True),
 
-        # Add this line to include the store
-        dcc.Store(id='data-update-timestamp'),
+        # Generation already applied through row patches, so the poller doesn't reload for it
+        dcc.Store(id='overview-patched-generation'),
+        # Stock whose AI cell was clicked, set clientside
+        dcc.Store(id='ai-requested-stock'),
 
     ], fluid=True)
 
-def create_data_card(title, table_id, data):
+def create_data_card(title, table_id, data, ai_icon, page_count=None):
     return dbc.Card([
         dbc.CardHeader(html.H4(title, className="mb-0")),
         dbc.CardBody([
-            create_data_table(table_id, data)
+            create_data_table(table_id, data, ai_icon, page_count)
         ])
     ], className="mb-4 shadow")
 
-def create_data_table(id, data):
+def create_data_table(id, data, ai_icon, page_count=None):
+    """data is a list of records. Passing page_count switches the table to server-side paging, sorting and filtering."""
+    if page_count is None:
+        table_actions = dict(filter_action="native", sort_action="native", page_action='native')
+    else:
+        table_actions = dict(filter_action="custom", sort_action="custom", page_action='custom',
+                             page_count=page_count, filter_query='', sort_by=[],
+                             filter_options={'case': 'insensitive'})
+
     return dash_table.DataTable(
         id=id,
         columns=[
-            {"name": "Company Name", "id": "company_name_with_indicator", "presentation": "markdown"},
+            {"name": "Company Name", "id": "company_name"},
             {"name": "CMP", "id": "cmp", "type": "numeric", "format": Format(precision=2, scheme=Scheme.fixed)},    
             {"name": "Net Profit Growth(%)", "id": "net_profit_growth", "type": "numeric", "format": Format(precision=2, scheme=Scheme.fixed)},
             {"name": "Strengths", "id": "strengths", "type": "numeric", "format": Format(precision=0, scheme=Scheme.fixed)},
@@ -106,10 +243,9 @@ def create_data_table(id, data):
             {"name": "Estimates (%)", "id": "processed_estimates", "type": "numeric", "format": Format(precision=2, scheme=Scheme.fixed)},
             {"name": "Result Date", "id": "result_date_display"},
             {"name": "Recommendation", "id": "recommendation"},
-            {"name": "AI", "id": "ai_indicator", "presentation": "markdown"},
+            {"name": "AI", "id": "ai_indicator"},
         ],
-        data=data.to_dict('records'),
-        markdown_options={"html": True},
+        data=data,
         style_table={
             'overflowX': 'auto',
             'overflowY': 'hidden',
@@ -137,7 +273,7 @@ def create_data_table(id, data):
             # Removed 'border', 'color', and 'backgroundColor' properties
         },
         style_cell_conditional=[
-            {'if': {'column_id': 'company_name_with_indicator'}, 'minWidth': '150px', 'maxWidth': '200px'},
+            {'if': {'column_id': 'company_name'}, 'minWidth': '150px', 'maxWidth': '200px'},
             {'if': {'column_id': 'cmp'}, 'minWidth': '80px', 'maxWidth': '100px'},
             {'if': {'column_id': 'net_profit_growth'}, 'minWidth': '100px', 'maxWidth': '150px'},
             {'if': {'column_id': 'strengths'}, 'minWidth': '70px', 'maxWidth': '90px'},
@@ -146,13 +282,24 @@ def create_data_table(id, data):
             {'if': {'column_id': 'processed_estimates'}, 'minWidth': '80px', 'maxWidth': '100px'},
             {'if': {'column_id': 'piotroski_score'}, 'minWidth': '80px', 'maxWidth': '120px'},
             {'if': {'column_id': 'recommendation'}, 'minWidth': '130px', 'maxWidth': '150px'},
-            {'if': {'column_id': 'ai_indicator'}, 'textAlign': 'center', 'minWidth': '100px', 'maxWidth': '150px'},
+            # Icons are static assets referenced once by the table, not embedded in every row
+            {'if': {'column_id': 'ai_indicator'}, 'minWidth': '100px', 'maxWidth': '150px',
+             'cursor': 'pointer', 'paddingLeft': '40px', 'backgroundImage': f"url('{ai_icon}')",
+             'backgroundRepeat': 'no-repeat', 'backgroundPosition': '10px center', 'backgroundSize': '24px 24px'},
         ],
         style_data_conditional=[
             {
                 'if': {'row_index': 'odd'},
                 # Removed 'backgroundColor'
             },
+            {
+                'if': {'filter_query': '{in_portfolio} = 1', 'column_id': 'company_name'},
+                'paddingLeft': '40px',
+                'backgroundImage': "url('/assets/portfolio_indicator.svg')",
+                'backgroundRepeat': 'no-repeat',
+                'backgroundPosition': '10px center',
+                'backgroundSize': '24px 24px',
+            },
             {
                 'if': {
                     'filter_query': '{processed_estimates} < 0',
@@ -193,16 +340,14 @@ def create_data_table(id, data):
             },
             # ...other conditional styles without hardcoded colors...
         ],
-        filter_action="native",
-        sort_action="native",
         sort_mode="single",
         style_as_list_view=True,
         row_selectable='single',
         selected_rows=[],
-        page_action='native',
-        page_size=25,
+        page_size=STOCKS_PAGE_SIZE,
         page_current=0,
         cell_selectable=True,  # Enable cell selection
+        **table_actions
     )
 
 def register_overview_callbacks(app):
@@ -242,172 +387,163 @@ def register_overview_callbacks(app):
         stock_details = stock_details_layout(company_name, show_full_layout=False)
         return True, stock_details, f"Stock Details: {company_name}"
     
+    # Builds (or loads from the shared cache) the quarter's frame off the request thread;
+    # the tables below only read it once it's ready
     @app.callback(
-        [Output('top-performers-table', 'data'),
-         Output('worst-performers-table', 'data'),
-         Output('latest-results-table', 'data'),
-         Output('stocks-table', 'data')],
+        Output('overview-frame-ready', 'data'),
         [Input('quarter-dropdown', 'value'),
-         Input('data-update-timestamp', 'data'),
          Input('batch-data-update-timestamp', 'data'),
-         Input('overview-data-store', 'data')]
+         Input('overview-generation-store', 'data')],
+        background=True,
+        running=[(Output('overview-loading', 'style'), {'display': 'block'}, {'display': 'none'})]
+    )
+    def build_overview_data(selected_quarter, batch_data_update_timestamp, generation):
+        generation = list(generation or get_data_generation())
+        # Runs in the callback manager's process; its queries reach /debug/queries through the shared report
+        scope = 'background:build_overview_data'
+        try:
+            with db.query_scope(scope):
+                get_cached_data(selected_quarter, generation)
+        except Exception as e:
+            print(f"Error building overview data: {str(e)}")
+        finally:
+            publish_query_report(scope)
+        return {'quarter': selected_quarter, 'generation': generation, 'updated': batch_data_update_timestamp}
+
+    # Only the active ten-row tab is filled; the others fill when they're opened
+    @app.callback(
+        [Output(f'{tab_id}-table', 'data') for tab_id in TOP_TABLE_TABS],
+        [Input('overview-frame-ready', 'data'),
+         Input('overview-tabs', 'active_tab')]
     )
-    def update_tables(selected_quarter, data_update_timestamp, 
-                     batch_data_update_timestamp, overview_data):
+    def update_tables(frame, active_tab):
+        if not frame or active_tab not in TOP_TABLE_TABS:
+            raise PreventUpdate
         try:
-            ctx = dash.callback_context
-            triggered_id = ctx.triggered[0]['prop_id'].split('.')[0]
-
-            # If triggered by overview data store, use that data
-            if triggered_id == 'overview-data-store' and overview_data:
-                df = pd.DataFrame(overview_data)
-            else:
-                # Otherwise fetch and process new data
-                df = get_cached_data()
-                if selected_quarter:
-                    df = df[df['quarter'] == selected_quarter]
-
-            # Ensure result_date is datetime and handle any conversion errors
-            df['result_date'] = pd.to_datetime(df['result_date'], errors='coerce')
-            
-            # Handle any missing values
-            df['net_profit_growth'] = pd.to_numeric(df['net_profit_growth'], errors='coerce').fillna(0)
-            
-            # Calculate tables
-            top_performers = df.nlargest(10, 'net_profit_growth')
-            worst_performers = df.nsmallest(10, 'net_profit_growth')
-            latest_results = df.sort_values('result_date', ascending=False).head(10)
-            
-            return (
-                top_performers.to_dict('records'),
-                worst_performers.to_dict('records'),
-                latest_results.to_dict('records'),
-                df.to_dict('records')
-            )
+            # Served from the per-process frame cache unless the data generation moved
+            df = get_cached_data(frame['quarter'], frame['generation'])
+            rows = top_table(df, active_tab)
         except Exception as e:
             print(f"Error updating tables: {str(e)}")
             # Return empty data if there's an error
-            empty_data = {'records': []}
-            return empty_data, empty_data, empty_data, empty_data
+            rows = []
+        return [rows if tab_id == active_tab else dash.no_update for tab_id in TOP_TABLE_TABS]
+
+    # A new quarter starts the All Stocks table again from the first page
+    app.clientside_callback(
+        ClientsideFunction(namespace='ui', function_name='firstPage'),
+        Output('stocks-table', 'page_current', allow_duplicate=True),
+        Input('quarter-dropdown', 'value'),
+        prevent_initial_call=True
+    )
 
-    # Combined callback for opening and closing the AI Recommendation Modal
+    # All Stocks ships one page per interaction; paging, sorting and filtering run on the cached frame
     @app.callback(
-        [
-            Output('ai-recommendation-modal', 'is_open'),
-            Output('selected-stock-symbol', 'data'),
-            Output('selected-stock-name', 'data'),
-            Output('analysis-history-dropdown', 'options'),
-            Output('analysis-history-dropdown', 'value'),
-            Output('ai-recommendation-content', 'children'),
-            Output('data-update-timestamp', 'data')
-        ],
-        [
-            Input('stocks-table', 'active_cell'),
-            Input('top-performers-table', 'active_cell'),
-            Input('worst-performers-table', 'active_cell'),
-            Input('latest-results-table', 'active_cell'),
-            Input('close-ai-modal', 'n_clicks'),
-            Input('analysis-history-dropdown', 'value'),
-            Input('refresh-analysis-button', 'n_clicks')
-        ],
-        [
-            State('ai-recommendation-modal', 'is_open'),
-            State('stocks-table', 'derived_viewport_data'),
-            State('top-performers-table', 'derived_viewport_data'),
-            State('worst-performers-table', 'derived_viewport_data'),
-            State('latest-results-table', 'derived_viewport_data'),
-            State('selected-stock-name', 'data'),
-            State('selected-stock-symbol', 'data'),
-            State('analysis-history-dropdown', 'options')
-        ],
-        prevent_initial_call=True
+        [Output('stocks-table', 'data'),
+         Output('stocks-table', 'page_count'),
+         Output('stocks-table', 'page_current'),
+         Output('stocks-table-feedback', 'children')],
+        [Input('overview-frame-ready', 'data'),
+         Input('overview-tabs', 'active_tab'),
+         Input('stocks-table', 'page_current'),
+         Input('stocks-table', 'page_size'),
+         Input('stocks-table', 'sort_by'),
+         Input('stocks-table', 'filter_query')]
     )
-    def handle_ai_recommendation(
-        stocks_active_cell, top_active_cell, worst_active_cell,
-        latest_active_cell, close_n_clicks, selected_analysis_id,
-        refresh_n_clicks, is_open, stocks_data, top_data, worst_data,
-        latest_data, stock_name, stock_symbol, existing_options
-    ):
-        ctx = dash.callback_context
-        if not ctx.triggered:
+    def update_stocks_page(frame, active_tab, page_current, page_size, sort_by, filter_query):
+        if not frame or active_tab != 'all-stocks':
             raise PreventUpdate
+        # A new filter or sort starts again from the first page
+        triggered = {trigger['prop_id'] for trigger in dash.callback_context.triggered}
+        if triggered & {'stocks-table.sort_by', 'stocks-table.filter_query'}:
+            page_current = 0
+        try:
+            df = get_cached_data(frame['quarter'], frame['generation'])
+            page_size = page_size or STOCKS_PAGE_SIZE
+            page_current = page_current or 0
+            data, page_count = stocks_page(df, page_current, page_size, sort_by, filter_query)
+            if page_current >= page_count:
+                # The universe shrank under the current page
+                page_current = page_count - 1
+                data, page_count = stocks_page(df, page_current, page_size, sort_by, filter_query)
+            return data, page_count, page_current, None
+        except FilterQueryError as e:
+            return [], 1, 0, dbc.Alert(str(e), color="warning", className="py-2")
+        except Exception as e:
+            print(f"Error updating stocks table: {str(e)}")
+            return [], 1, 0, None
+
+    # Cell clicks are filtered in the browser; only clicks on an AI cell reach the server
+    app.clientside_callback(
+        ClientsideFunction(namespace='ui', function_name='requestAnalysis'),
+        Output('ai-requested-stock', 'data'),
+        [Input('stocks-table', 'active_cell'),
+         Input('top-performers-table', 'active_cell'),
+         Input('worst-performers-table', 'active_cell'),
+         Input('latest-results-table', 'active_cell')],
+        [State('stocks-table', 'derived_viewport_data'),
+         State('top-performers-table', 'derived_viewport_data'),
+         State('worst-performers-table', 'derived_viewport_data'),
+         State('latest-results-table', 'derived_viewport_data')],
+        prevent_initial_call=True
+    )
 
-        triggered_id = ctx.triggered[0]['prop_id'].split('.')[0]
+    app.clientside_callback(
+        ClientsideFunction(namespace='ui', function_name='closeModal'),
+        Output('ai-recommendation-modal', 'is_open', allow_duplicate=True),
+        Input('close-ai-modal', 'n_clicks'),
+        prevent_initial_call=True
+    )
 
-        # Handle close button
-        if triggered_id == 'close-ai-modal':
-            return handle_close_modal()
-
-        # Handle analysis history selection
-        if triggered_id == 'analysis-history-dropdown' and selected_analysis_id:
-            return handle_analysis_history_selection(is_open, stock_symbol, stock_name, existing_options, selected_analysis_id)
-
-        # Handle refresh analysis
-        if triggered_id == 'refresh-analysis-button' and refresh_n_clicks:
-            return handle_refresh_analysis(stock_name, stock_symbol, existing_options)
-
-            # Store new analysis
-            analysis_doc = {
-                'company_name': stock_name,
-                'symbol': stock_symbol,
-                'analysis': new_analysis_text,
-                'timestamp': datetime.now(),
-            }
-            get_collection('ai_analysis').insert_one(analysis_doc)
-
-            # Update options with the new analysis
-            analyses = get_previous_analyses(stock_symbol)
-            options = [{'label': format_label(a['timestamp']), 'value': str(a['_id'])} for a in analyses]
-
-            # Update data-update-timestamp to trigger table refresh
-            timestamp = datetime.now().timestamp()  # Use current timestamp as a trigger
-
-            return (
-                is_open, stock_symbol, stock_name, options, str(analysis_doc['_id']),
-                new_analysis_text, timestamp
-            )
-
-        # Handle cell selection
-        active_cell = None
-        data = None
-
-        if triggered_id == 'stocks-table':
-            active_cell, data = stocks_active_cell, stocks_data
-        elif triggered_id == 'top-performers-table':
-            active_cell, data = top_active_cell, top_data
-        elif triggered_id == 'worst-performers-table':
-            active_cell, data = worst_active_cell, worst_data
-        elif triggered_id == 'latest-results-table':
-            active_cell, data = latest_active_cell, latest_data
-
-        # *** This is where your code snippet goes ***
-        # When handling cell selection:
-        if active_cell and data and active_cell['column_id'] == 'ai_indicator':
-            # Use 'data' from 'derived_viewport_data'
-            row = data[active_cell['row']]
-            stock_name = row['company_name']
-            stock_symbol = row['symbol']
-            analyses = get_previous_analyses(stock_symbol)
-
-            if analyses:
-                options = [{'label': format_label(a['timestamp']), 'value': str(a['_id'])} for a in analyses]
-                latest_analysis = analyses[-1]
-                default_value = str(latest_analysis['_id'])
-                content = latest_analysis['analysis']
-            else:
-                options = []
-                default_value = None
-                content = 'No previous analysis available.'
-
-            return (
-                True, stock_symbol, stock_name, options, default_value,
-                content, dash.no_update
-            )
+    # Switching between stored analyses reads the history store loaded with the modal
+    app.clientside_callback(
+        ClientsideFunction(namespace='ui', function_name='showAnalysis'),
+        Output('ai-recommendation-content', 'children'),
+        [Input('analysis-history-dropdown', 'value'),
+         Input('analysis-history-store', 'data')]
+    )
 
-        return (
-            is_open, dash.no_update, dash.no_update, dash.no_update,
-            dash.no_update, dash.no_update, dash.no_update
-        )
+    @app.callback(
+        [Output('ai-recommendation-modal', 'is_open'),
+         Output('selected-stock-symbol', 'data'),
+         Output('selected-stock-name', 'data'),
+         Output('analysis-history-dropdown', 'options'),
+         Output('analysis-history-dropdown', 'value'),
+         Output('analysis-history-store', 'data')],
+        Input('ai-requested-stock', 'data'),
+        prevent_initial_call=True
+    )
+    def open_ai_recommendation(requested):
+        if not requested:
+            raise PreventUpdate
+        stock_symbol = requested['symbol']
+        analyses = get_previous_analyses(stock_symbol)
+        return (True, stock_symbol, requested['name'], *analysis_history(analyses))
+
+    @app.callback(
+        [Output('analysis-history-dropdown', 'options', allow_duplicate=True),
+         Output('analysis-history-dropdown', 'value', allow_duplicate=True),
+         Output('analysis-history-store', 'data', allow_duplicate=True),
+         Output('ai-recommendation-content', 'children', allow_duplicate=True),
+         Output('top-performers-table', 'data', allow_duplicate=True),
+         Output('worst-performers-table', 'data', allow_duplicate=True),
+         Output('latest-results-table', 'data', allow_duplicate=True),
+         Output('stocks-table', 'data', allow_duplicate=True),
+         Output('overview-patched-generation', 'data')],
+        Input('refresh-analysis-button', 'n_clicks'),
+        [State('selected-stock-name', 'data'),
+         State('selected-stock-symbol', 'data'),
+         State('overview-generation-store', 'data'),
+         State('top-performers-table', 'data'),
+         State('worst-performers-table', 'data'),
+         State('latest-results-table', 'data'),
+         State('stocks-table', 'data')],
+        prevent_initial_call=True
+    )
+    def refresh_ai_recommendation(n_clicks, stock_name, stock_symbol, client_generation, *table_rows):
+        if not n_clicks or not stock_symbol:
+            raise PreventUpdate
+        return handle_refresh_analysis(stock_name, stock_symbol, client_generation, table_rows)
 
     @app.callback(
         [Output('batch-data-update-timestamp', 'data'),
@@ -420,9 +556,11 @@ def register_overview_callbacks(app):
             raise dash.exceptions.PreventUpdate
 
         def process_batch():
-            df = fetch_latest_quarter_data()
-            latest_quarter = df['quarter'].max()
-            latest_stocks = df[df['quarter'] == latest_quarter]
+            # Each company's latest quarter, not only the companies in the newest quarter
+            latest_stocks = fetch_latest_quarter_data(None)
+            if latest_stocks.empty:
+                print("No stocks available for batch AI analysis.")
+                return
 
             symbols = latest_stocks['symbol'].unique().tolist()
 
@@ -443,13 +581,8 @@ def register_overview_callbacks(app):
                     print(f"Failed to fetch analysis for {company_name}")
                     continue
 
-                analysis_doc = {
-                    'company_name': company_name,
-                    'symbol': symbol,
-                    'analysis': analysis_text,
-                    'timestamp': datetime.now(),
-                }
-                db.get_collection('ai_analysis').insert_one(analysis_doc)
+                # The recommendation label is extracted once here and stored with the text
+                store_analysis(company_name, symbol, analysis_text)
 
                 # Optional: Add a delay to respect API rate limits
                 time.sleep(1)
@@ -462,22 +595,19 @@ def register_overview_callbacks(app):
         timestamp = datetime.now().timestamp()
         return timestamp, "Batch AI analysis started. This may take several minutes."
     
-    # Add new callback for data refresh
+    # Poll the write generation; the tables only refresh when a writer has bumped it
     @app.callback(
-        Output('overview-data-store', 'data'),
-        [Input('overview-refresh-interval', 'n_intervals'),
-         Input('quarter-dropdown', 'value')],
-        background=True  # Use background callback for non-blocking updates
+        Output('overview-generation-store', 'data'),
+        Input('overview-refresh-interval', 'n_intervals'),
+        [State('overview-generation-store', 'data'),
+         State('overview-patched-generation', 'data')],
+        prevent_initial_call=True
     )
-    def refresh_data(n_intervals, selected_quarter):
-        # Clear the cache to force refresh
-        get_cached_data.cache_clear()
-        df = get_cached_data()
-        
-        if selected_quarter:
-            df = df[df['quarter'] == selected_quarter]
-        
-        return df.to_dict('records')
+    def refresh_data(n_intervals, current_generation, patched_generation):
+        generation = list(get_data_generation())
+        if generation in (current_generation, patched_generation):
+            raise PreventUpdate
+        return generation
 
 
 def format_label(timestamp):
@@ -489,50 +619,43 @@ def format_label(timestamp):
     else:
         return timestamp.strftime('%d %B %Y')
 
-def handle_close_modal():
-    return (
-        False, dash.no_update, dash.no_update, dash.no_update,
-        dash.no_update, dash.no_update, dash.no_update
-    )
+def analysis_history(analyses):
+    """Dropdown options, the latest analysis id and the {id: text} store for a stock's analyses."""
+    options = [{'label': format_label(a['timestamp']), 'value': str(a['_id'])} for a in analyses]
+    history = {str(a['_id']): a['analysis'] for a in analyses}
+    latest_id = str(analyses[-1]['_id']) if analyses else None
+    return options, latest_id, history
 
-def handle_analysis_history_selection(is_open, stock_symbol, stock_name, existing_options, selected_analysis_id):
-    analysis_doc = db.get_collection('ai_analysis').find_one({'_id': ObjectId(selected_analysis_id)})
-    content = analysis_doc['analysis'] if analysis_doc else 'Analysis not found.'
-    return (
-        is_open, stock_symbol, stock_name, existing_options,
-        selected_analysis_id, content, dash.no_update
-    )
+# Four table outputs plus the patched-generation store
+NO_TABLE_UPDATES = (dash.no_update,) * 5
 
-def handle_refresh_analysis(stock_name, stock_symbol, existing_options):
+def handle_refresh_analysis(stock_name, stock_symbol, client_generation, table_rows):
     new_analysis_text = fetch_stock_analysis(stock_name)
     if new_analysis_text is None:
         return (
-            True, stock_symbol, stock_name, existing_options,
-            dash.no_update, 'Error fetching new analysis.', dash.no_update
+            dash.no_update, dash.no_update, dash.no_update,
+            'Error fetching new analysis.', *NO_TABLE_UPDATES
         )
 
-    # Store new analysis
-    analysis_doc = {
-        'company_name': stock_name,
-        'symbol': stock_symbol,
-        'analysis': new_analysis_text,
-        'timestamp': datetime.now(),
-    }
-    db.get_collection('ai_analysis').insert_one(analysis_doc)
-
-    # Update options with the new analysis
+    # A cached answer is the analysis we already stored; don't add it to the history twice
     analyses = get_previous_analyses(stock_symbol)
+    if analyses and analyses[-1]['analysis'] == new_analysis_text:
+        return (*analysis_history(analyses), new_analysis_text, *NO_TABLE_UPDATES)
 
-    options = [{'label': format_label(a['timestamp']), 'value': str(a['_id'])} for a in analyses]
-
-    # Update data-update-timestamp to trigger table refresh
-    timestamp = datetime.now().timestamp()
-
-    return (
-        True, stock_symbol, stock_name, options, str(analysis_doc['_id']),
-        new_analysis_text, timestamp
-    )
+    # Store new analysis along with its extracted recommendation
+    previous_generation = get_data_generation()
+    analysis_doc = store_analysis(stock_name, stock_symbol, new_analysis_text)
+    generation = get_data_generation()
 
+    # Update options with the new analysis
+    analyses = get_previous_analyses(stock_symbol)
 
+    # Only the AI cell of this stock's rows changes: patch the cached frames and the tables in place
+    recommendation = analysis_doc.get('recommendation')
+    patch_cached_analysis(stock_symbol, recommendation, previous_generation, generation)
+    table_patches = [patch_table_rows(rows, stock_symbol, recommendation) for rows in table_rows]
 
+    # Tell the poller this generation is already on screen, unless the tables were stale anyway
+    patched_generation = list(generation) if list(previous_generation) == client_generation else dash.no_update
 
+    return (*analysis_history(analyses), new_analysis_text, *table_patches, patched_generation)
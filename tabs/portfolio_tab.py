@@ -1,16 +1,16 @@
 import base64
 import io
 import pandas as pd
-from pymongo import MongoClient
 import dash_bootstrap_components as dbc
 from dash import html, dcc, dash_table
 from dash.dependencies import Input, Output, State
 from dash.dash_table.Format import Format, Scheme
-from util.recommendation import generate_stock_recommendation
+from util.recommendation import generate_stock_recommendations
 from util.stock_utils import create_info_card
 from util.database import DatabaseConnection as db
 from util.stock_utils import fetch_latest_metrics
-from util.general_util import extract_numeric
+from util.general_util import estimate_surprise
+from util.data_version import bump_data_generation
 
 
 
@@ -220,91 +220,26 @@ def register_portfolio_callback(app):
             metrics = fetch_latest_metrics(instrument)
             metrics_list.append(metrics)
         
-        # Convert metrics list to DataFrame
-        metrics = pd.DataFrame(metrics_list)
+        # Build the frame from the typed fields stored at ingestion; no string cleaning needed
+        metrics = pd.DataFrame([m['typed'] for m in metrics_list])
 
-        # Rest of the function remains the same...
-        # Define placeholders to replace
-        placeholders = ['NA', '--', 'N/A', '']
-
-        # List of required fields
-        required_fields = [
-            'strengths', 'weaknesses', 'net_profit_growth',
-            'net_profit_growth_3yr_cagr', 'revenue_growth',
-            'revenue_growth_3yr_cagr', 'piotroski_score',
-            'ttm_pe', 'dividend_yield', 'estimates', 'technicals_trend', 'fundamental_insights'
+        # Missing numbers count as zero, as the placeholder cleaning did before
+        zero_filled = [
+            'strengths', 'weaknesses', 'net_profit_growth', 'net_profit_growth_3yr_cagr',
+            'revenue_growth', 'revenue_growth_3yr_cagr', 'piotroski_score', 'ttm_pe', 'dividend_yield'
         ]
+        for field in zero_filled:
+            metrics[field] = metrics[field].astype(float).fillna(0)
+        metrics['strengths'] = metrics['strengths'].astype(int)
+        metrics['weaknesses'] = metrics['weaknesses'].astype(int)
+        metrics['piotroski_score'] = metrics['piotroski_score'].astype(int)
 
-        # Ensure all required fields are present
-        for field in required_fields:
-            if field not in metrics.columns:
-                if field == 'dividend_yield':
-                    metrics[field] = '0%'
-                elif field in ['technicals_trend', 'fundamental_insights']:
-                    metrics[field] = 'Neutral'
-                else:
-                    metrics[field] = '0'
-
-        # Process and clean data
-
-        # Clean 'strengths' and 'weaknesses'
-        metrics['strengths'] = metrics['strengths'].apply(extract_numeric)
-        metrics['weaknesses'] = metrics['weaknesses'].apply(extract_numeric)
-
-        # Clean 'net_profit_growth'
-        metrics['net_profit_growth'] = metrics['net_profit_growth'].replace(placeholders, '0') \
-                                                                .str.replace('%', '', regex=False) \
-                                                                .str.replace(',', '', regex=False) \
-                                                                .astype(float)
-
-        # Clean 'net_profit_growth_3yr_cagr'
-        metrics['net_profit_growth_3yr_cagr'] = metrics['net_profit_growth_3yr_cagr'].replace(placeholders, '0') \
-                                                                            .str.replace('%', '', regex=False) \
-                                                                            .str.replace(',', '', regex=False) \
-                                                                            .astype(float)
-
-        # Clean 'revenue_growth'
-        metrics['revenue_growth'] = metrics['revenue_growth'].replace(placeholders, '0') \
-                                                    .str.replace('%', '', regex=False) \
-                                                    .str.replace(',', '', regex=False) \
-                                                    .astype(float)
-
-        # Clean 'revenue_growth_3yr_cagr'
-        metrics['revenue_growth_3yr_cagr'] = metrics['revenue_growth_3yr_cagr'].replace(placeholders, '0') \
-                                                            .str.replace('%', '', regex=False) \
-                                                            .str.replace(',', '', regex=False) \
-                                                            .astype(float)
-
-        # Clean 'piotroski_score' and ensure it's integer
-        metrics['piotroski_score'] = metrics['piotroski_score'].replace(placeholders, '0') \
-                                                            .fillna('0') \
-                                                            .astype(int)
-
-        # Clean 'ttm_pe'
-        metrics['ttm_pe'] = metrics['ttm_pe'].replace(placeholders, '0') \
-                                            .str.replace(',', '', regex=False) \
-                                            .astype(float)
-
-        # Clean 'dividend_yield'
-        metrics['dividend_yield'] = metrics['dividend_yield'].replace(placeholders, '0') \
-                                                            .str.replace('%', '', regex=False) \
-                                                            .str.replace(',', '', regex=False) \
-                                                            .astype(float)
-
-        # Clean 'technicals_trend'
-        metrics['technicals_trend'] = metrics['technicals_trend'].replace(placeholders, 'Neutral') \
-                                                              .fillna('Neutral') \
-                                                              .astype(str)
-
-        # Clean 'fundamental_insights'
-        metrics['fundamental_insights'] = metrics['fundamental_insights'].replace(placeholders, 'Neutral') \
-                                                                  .fillna('Neutral') \
-                                                                  .astype(str)
+        for field in ['technicals_trend', 'fundamental_insights']:
+            metrics[field] = metrics[field].fillna('Neutral').astype(str)
 
-        # Clean 'estimates' - Keep as string for pattern matching
-        metrics['estimates'] = metrics['estimates'].replace(placeholders, '0') \
-                                            .str.extract(r'([-+]?\d*\.?\d+)', expand=False) \
-                                            .astype(float)
+        metrics['estimates'] = pd.Series(
+            [estimate_surprise(m['typed']) for m in metrics_list], dtype=float
+        ).fillna(0)
 
         # Concatenate df and metrics
         df = pd.concat([df, metrics], axis=1)
@@ -323,8 +258,14 @@ def register_portfolio_callback(app):
                           'dividend_yield', 'pb_ratio', 'sector_pe', 'revenue_growth',
                           'face_value', 'book_value', 'ttm_eps']]
 
-        # Apply the consolidated recommendation function
-        filtered_df = filtered_df.assign(Recommendation=filtered_df.apply(generate_stock_recommendation, axis=1))
+        # Use the recommendation stored with each latest quarter; score only the stale ones here,
+        # from the typed metrics (object dtype keeps None) rather than the zero-filled columns above
+        recommendations = pd.Series([m.get('recommendation') for m in metrics_list], index=filtered_df.index, dtype=object)
+        stale = recommendations.isna()
+        if stale.any():
+            typed = pd.DataFrame([m['typed'] for m in metrics_list], index=filtered_df.index, dtype=object)
+            recommendations[stale] = generate_stock_recommendations(typed[stale])
+        filtered_df = filtered_df.assign(Recommendation=recommendations)
 
         # Drop 'TTM P/E' 'dividend_yield', 'pb_ratio', 'sector_pe', 'revenue_growth','face_value', 'book_value', 'ttm_eps' from the display DataFrame
         display_df = filtered_df.drop(columns=['TTM P/E', 'dividend_yield', 'pb_ratio', 'sector_pe', 'revenue_growth', 'face_value', 'book_value', 'ttm_eps'])
@@ -344,6 +285,7 @@ def register_portfolio_callback(app):
 
         # Clear existing holdings in the collection
         db.get_collection('holdings').delete_many({})
+        bump_data_generation('holdings')
 
         # Split the contents to separate the content type from the actual data
         content_type, content_string = contents.split(',')
@@ -368,6 +310,7 @@ def register_portfolio_callback(app):
 
             # Convert DataFrame to dictionary records and insert into MongoDB
             db.get_collection('holdings').insert_many(df.to_dict("records"))
+            bump_data_generation('holdings')
             return html.Div("Portfolio uploaded successfully!", className="text-success")
         except Exception as e:
             # Handle exceptions and provide feedback
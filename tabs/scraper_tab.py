@@ -4,6 +4,8 @@ import logging
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output
 from dash import html, callback_context
+from util.stock_utils import invalidate_latest_metrics
+from util.search_index import refresh_search_index
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -76,6 +78,9 @@ def register_scraper_callbacks(app):
                 result = subprocess.run(['python3', './scraper/scrapedata.py', url, scrape_type], check=True, capture_output=True, text=True)
                 logger.info(result.stdout)  # Log the standard output
                 logger.error(result.stderr)
+                # The scraper bumped the data generation; drop our cached metrics right away
+                invalidate_latest_metrics()
+                refresh_search_index()
                 result_message = f"Scraping of {scrape_type} data completed successfully!"
                 result_color = "success"
                 result_open = True
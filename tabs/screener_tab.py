@@ -0,0 +1,191 @@
+# tabs/screener_tab.py
+
+import dash
+import dash_bootstrap_components as dbc
+from dash import html, dcc, dash_table
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+from dash.dash_table.Format import Format, Scheme
+from pymongo.errors import PyMongoError
+from util.screener import (
+    parse_screen, run_screen, save_screen, delete_screen, list_saved_screens,
+    ScreenError, NUMERIC_FIELDS, TEXT_FIELDS, SCREEN_PAGE_SIZE
+)
+from util.general_util import INTEGER_METRIC_FIELDS
+from util.quarterly_metrics import fetch_available_quarters
+from util.data_version import get_data_generation
+from tabs.overview_tab import peek_cached_data
+
+EXAMPLE_SCREEN = 'ttm_pe < sector_pe and piotroski_score >= 7 and net_profit_growth > 20'
+
+COLUMN_LABELS = {
+    'cmp': 'CMP',
+    'ttm_pe': 'TTM P/E',
+    'sector_pe': 'Sector P/E',
+    'pb_ratio': 'P/B',
+    'ttm_eps': 'TTM EPS',
+    'net_profit_growth': 'Net Profit Growth(%)',
+    'revenue_growth': 'Revenue Growth(%)',
+    'gross_profit_growth': 'Gross Profit Growth(%)',
+    'dividend_yield': 'Dividend Yield(%)',
+    'estimate_surprise': 'Estimates (%)',
+}
+
+
+def screener_layout():
+    quarter_options = fetch_available_quarters()
+    latest_quarter = quarter_options[0]['value'] if quarter_options else None
+
+    return dbc.Container([
+        html.H3("Screener", className="mb-4"),
+        dbc.Row([
+            dbc.Col(dbc.Input(id='screen-expression', value=EXAMPLE_SCREEN, debounce=True,
+                              placeholder=EXAMPLE_SCREEN), md=7),
+            dbc.Col(dcc.Dropdown(id='screen-quarter', options=quarter_options, value=latest_quarter,
+                                 clearable=False, placeholder="Select a quarter"), md=3),
+            dbc.Col(dbc.Button("Run", id='screen-run', color="primary", className="w-100"), md=2),
+        ], className="mb-2 g-2"),
+        html.Small([
+            "Compare fields with <, <=, >, >=, ==, != and join them with and / or / not. "
+            "Text fields take quoted values or in [...]. Fields: ",
+            html.Code(", ".join(sorted(NUMERIC_FIELDS) + sorted(TEXT_FIELDS))),
+        ], className="text-muted d-block mb-3"),
+        dbc.Row([
+            dbc.Col(dcc.Dropdown(id='saved-screens', options=saved_screen_options(),
+                                 placeholder="Load a saved screen"), md=5),
+            dbc.Col(dbc.Input(id='screen-name', placeholder="Screen name"), md=3),
+            dbc.Col(dbc.ButtonGroup([
+                dbc.Button("Save", id='screen-save', color="secondary", outline=True),
+                dbc.Button("Delete", id='screen-delete', color="danger", outline=True),
+            ], className="w-100"), md=2),
+            dbc.Col(html.Div(id='screen-save-feedback', className="small pt-2"), md=2),
+        ], className="mb-3 g-2"),
+        html.Div(id='screen-feedback', className="mb-2"),
+        dash_table.DataTable(
+            id='screen-results',
+            columns=result_columns([]),
+            data=[],
+            page_action='custom',
+            sort_action='custom',
+            page_current=0,
+            page_size=SCREEN_PAGE_SIZE,
+            page_count=1,
+            sort_by=[],
+            style_table={'overflowX': 'auto', 'minWidth': '100%'},
+            style_cell={
+                'textAlign': 'left',
+                'padding': '10px',
+                'fontSize': '14px',
+                'whiteSpace': 'nowrap',
+                'fontFamily': '"Segoe UI", Arial, sans-serif',
+            },
+            style_header={'fontWeight': 'bold', 'fontSize': '15px', 'border': '1px solid #dee2e6'},
+            style_cell_conditional=[
+                {'if': {'column_id': 'company_name'}, 'minWidth': '150px', 'maxWidth': '200px'},
+            ],
+        ),
+    ], className="py-3")
+
+
+def saved_screen_options():
+    return [{'label': doc['_id'], 'value': doc['_id'], 'title': doc.get('expression', '')}
+            for doc in list_saved_screens()]
+
+
+def result_columns(fields):
+    columns = [{"name": "Company Name", "id": "company_name"}]
+    for field in fields:
+        label = COLUMN_LABELS.get(field, field.replace('_', ' ').title())
+        if field in TEXT_FIELDS:
+            columns.append({"name": label, "id": field})
+        else:
+            precision = 0 if field in INTEGER_METRIC_FIELDS else 2
+            columns.append({"name": label, "id": field, "type": "numeric",
+                            "format": Format(precision=precision, scheme=Scheme.fixed)})
+    return columns
+
+
+def register_screener_callbacks(app):
+    @app.callback(
+        [Output('screen-results', 'data'),
+         Output('screen-results', 'columns'),
+         Output('screen-results', 'page_count'),
+         Output('screen-results', 'page_current'),
+         Output('screen-feedback', 'children')],
+        [Input('screen-run', 'n_clicks'),
+         Input('screen-expression', 'n_submit'),
+         Input('screen-results', 'page_current'),
+         Input('screen-results', 'sort_by')],
+        [State('screen-expression', 'value'),
+         State('screen-quarter', 'value'),
+         State('screen-results', 'page_size')]
+    )
+    def update_screen(n_clicks, n_submit, page_current, sort_by, expression, quarter_key, page_size):
+        if not quarter_key:
+            raise PreventUpdate
+        # A new run, or a new sort order, starts again from the first page
+        triggered = dash.callback_context.triggered[0]['prop_id'] if dash.callback_context.triggered else ''
+        if not triggered.startswith('screen-results.page_current'):
+            page_current = 0
+
+        try:
+            screen = parse_screen(expression)
+        except ScreenError as e:
+            return [], dash.no_update, 1, 0, dbc.Alert(str(e), color="warning", className="py-2")
+
+        try:
+            # The overview frame is used only if this worker already holds it for the current data
+            frame = peek_cached_data(quarter_key, get_data_generation())
+            result = run_screen(screen, quarter_key, page_current, page_size or SCREEN_PAGE_SIZE, sort_by, frame)
+        except ScreenError as e:
+            return [], dash.no_update, 1, 0, dbc.Alert(str(e), color="warning", className="py-2")
+        except PyMongoError as e:
+            print(f"Error running screen: {str(e)}")
+            return [], dash.no_update, 1, 0, dbc.Alert("The screen could not be run.", color="danger", className="py-2")
+
+        summary = html.Small(
+            f"{result['matched']} matches in {result['elapsed_ms']:.0f} ms ({result['engine']})",
+            className="text-muted"
+        )
+        return result['rows'], result_columns(result['fields']), result['page_count'], page_current, summary
+
+    @app.callback(
+        [Output('screen-expression', 'value'),
+         Output('screen-name', 'value')],
+        Input('saved-screens', 'value'),
+        prevent_initial_call=True
+    )
+    def load_saved_screen(name):
+        if not name:
+            raise PreventUpdate
+        for doc in list_saved_screens():
+            if doc['_id'] == name:
+                return doc['expression'], name
+        raise PreventUpdate
+
+    @app.callback(
+        [Output('saved-screens', 'options'),
+         Output('screen-save-feedback', 'children')],
+        [Input('screen-save', 'n_clicks'),
+         Input('screen-delete', 'n_clicks')],
+        [State('screen-name', 'value'),
+         State('screen-expression', 'value')],
+        prevent_initial_call=True
+    )
+    def manage_saved_screens(save_clicks, delete_clicks, name, expression):
+        triggered = dash.callback_context.triggered[0]['prop_id']
+        try:
+            if triggered.startswith('screen-save'):
+                save_screen(name, expression)
+                message = html.Span("Saved.", className="text-success")
+            else:
+                if not name:
+                    raise ScreenError("Pick the screen to delete.")
+                delete_screen(name.strip())
+                message = html.Span("Deleted.", className="text-success")
+        except ScreenError as e:
+            return dash.no_update, html.Span(str(e), className="text-danger")
+        except PyMongoError as e:
+            print(f"Error updating saved screens: {str(e)}")
+            return dash.no_update, html.Span("Could not update saved screens.", className="text-danger")
+        return saved_screen_options(), message
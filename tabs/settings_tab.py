@@ -4,16 +4,15 @@ import dash
 import dash_bootstrap_components as dbc
 from dash import html, dcc
 from dash.dependencies import Input, Output, State
-from pymongo import MongoClient
 from bson import ObjectId
-
-# MongoDB connection
-mongo_client = MongoClient('mongodb://localhost:27017/')
-db = mongo_client['stock_data']
+from util.database import DatabaseConnection
+from util.data_version import bump_data_generation
+from util.stock_utils import invalidate_latest_metrics
+from util.quarterly_metrics import rebuild_quarterly_metrics
 
 def settings_layout():
     # Retrieve the current AI API selection from the database
-    settings_doc = db['settings'].find_one({'_id': 'ai_api_selection'})
+    settings_doc = DatabaseConnection.get_collection('settings').find_one({'_id': 'ai_api_selection'})
     selected_api = settings_doc.get('selected_api', 'perplexity') if settings_doc else 'perplexity'
 
     return dbc.Container([
@@ -57,7 +56,7 @@ def register_settings_callbacks(app):
     )
     def update_api_selection(selected_api):
         # Store the selected API in the database
-        db['settings'].update_one(
+        DatabaseConnection.get_collection('settings').update_one(
             {'_id': 'ai_api_selection'},
             {'$set': {'selected_api': selected_api}},
             upsert=True
@@ -108,6 +107,7 @@ def backup_collection(collection_name):
     """
     Backup a MongoDB collection by copying it to a backup collection.
     """
+    db = DatabaseConnection.get_db()
     original_collection = db[collection_name]
     backup_collection_name = f"{collection_name}_copy"
     backup_collection = db[backup_collection_name]
@@ -125,6 +125,7 @@ def restore_collection(collection_name):
     """
     Restore a MongoDB collection from its backup collection.
     """
+    db = DatabaseConnection.get_db()
     backup_collection_name = f"{collection_name}_copy"
     original_collection = db[collection_name]
     backup_collection = db[backup_collection_name]
@@ -141,3 +142,8 @@ def restore_collection(collection_name):
         {'$match': {}},
         {'$out': collection_name}
     ])
+    if collection_name == 'detailed_financials':
+        # Every reader goes through the flattened quarterly_metrics copy, so rebuild it too
+        rebuild_quarterly_metrics()
+        invalidate_latest_metrics()
+    bump_data_generation(collection_name)
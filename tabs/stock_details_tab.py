@@ -2,11 +2,11 @@ import dash_bootstrap_components as dbc
 from dash import html, dcc
 import pandas as pd
 from util.charting import create_financial_metrics_chart, create_stock_price_chart
-from util.general_util import parse_numeric_value
-from util.recommendation import generate_stock_recommendation
+from util.general_util import get_typed_metrics
+from util.recommendation import generate_stock_recommendation, stored_recommendation
 from util.stock_utils import create_info_card
 from dash.dependencies import Input, Output, State
-from util.database import DatabaseConnection as db
+from util.company_cache import get_company_quarters, get_company_quarter
 
 def prepare_data_sections(selected_data):
     
@@ -49,25 +49,21 @@ def prepare_data_sections(selected_data):
     return basic_info, valuation_metrics, financial_performance, insights
 
 def stock_details_layout(company_name, show_full_layout=True):
-    stock = db.get_collection('detailed_financials').find_one({"company_name": company_name})
+    # One read per page view, shared with the charts and the quarter dropdown callback
+    quarters = get_company_quarters(company_name)
 
-    if not stock or not stock.get('financial_metrics'):
+    if not quarters:
         return html.Div(["Stock not found or no data available."], className="text-danger")
 
     # Generate dropdown options from available quarters
     dropdown_options = [
-        {'label': metric.get('quarter', 'N/A'), 'value': idx}
-        for idx, metric in enumerate(stock['financial_metrics'])
+        {'label': metric.get('quarter', 'N/A'), 'value': metric['quarter_key']}
+        for metric in quarters
     ]
 
-    # Set default value to the last quarter
-    default_value = len(stock['financial_metrics']) - 1
-
-    # Fetch data for the default quarter
-    selected_data = stock['financial_metrics'][default_value]
-    # Fetch symbol from stock and set in selected_data
-    selected_data['symbol'] = stock.get('symbol', 'N/A')
-    print(stock.get('symbol', 'N/A'))
+    # Set default value to the latest quarter
+    selected_data = quarters[-1]
+    default_value = selected_data['quarter_key']
     # Prepare data for display using the helper function
     basic_info, valuation_metrics, financial_performance, insights = prepare_data_sections(selected_data)
 
@@ -80,7 +76,7 @@ def stock_details_layout(company_name, show_full_layout=True):
     ]
 
     # Recommendation
-    recommendation = generate_stock_recommendation(selected_data)
+    recommendation = stored_recommendation(selected_data) or generate_stock_recommendation(get_typed_metrics(selected_data))
 
     # Layout with quarter dropdown and info cards container
     layout = dbc.Container([
@@ -108,7 +104,7 @@ def stock_details_layout(company_name, show_full_layout=True):
         html.H4("Stock Price Chart", className="text-center"),
         dcc.Graph(figure=create_stock_price_chart(company_name), className="mb-4"),
         html.H4("Financial Metrics Chart", className="text-center"),
-        dcc.Graph(figure=create_financial_metrics_chart(fetch_stock_data(company_name))),
+        dcc.Graph(figure=create_financial_metrics_chart(fetch_stock_data(company_name, quarters))),
         dbc.Button("Share to Twitter", id="twitter-share-button", color="primary", className="mt-3 rounded-pill"),
         html.Div(id='twitter-share-response', className="mt-3")
     ], fluid=True, className="py-2")
@@ -121,27 +117,24 @@ def stock_details_layout(company_name, show_full_layout=True):
     ], fluid=True, className="py-2")
 
 
-def fetch_stock_data(company_name):
-    stock = db.get_collection('detailed_financials').find_one({"company_name": company_name}, {"financial_metrics": 1, "_id": 0})
-    if not stock:
+def fetch_stock_data(company_name, quarters=None):
+    if quarters is None:
+        quarters = get_company_quarters(company_name)
+    if not quarters:
         print(f"Stock not found in MongoDB: {company_name}")
         return pd.DataFrame()
     
-    stock_data = [{
-        "quarter": metric.get("quarter", "N/A"),
-        "market_cap": parse_numeric_value(metric.get("market_cap")),
-        "ttm_pe": parse_numeric_value(metric.get("ttm_pe")),
-        "revenue": parse_numeric_value(metric.get("revenue")),
-        "gross_profit": parse_numeric_value(metric.get("gross_profit")),
-        "net_profit": parse_numeric_value(metric.get("net_profit")),
-        "revenue_growth": parse_numeric_value(metric.get("revenue_growth"), '%'),
-        "gross_profit_growth": parse_numeric_value(metric.get("gross_profit_growth"), '%'),
-        "net_profit_growth": parse_numeric_value(metric.get("net_profit_growth"), '%'),
-        "dividend_yield": parse_numeric_value(metric.get("dividend_yield"), '%'),
-        "debt_to_equity": parse_numeric_value(metric.get("debt_to_equity"))
-    } for metric in stock['financial_metrics']]
-    
-    return pd.DataFrame(stock_data)
+    chart_fields = ["market_cap", "ttm_pe", "revenue", "gross_profit", "net_profit", "revenue_growth",
+                    "gross_profit_growth", "net_profit_growth", "dividend_yield"]
+    stock_data = []
+    for metric in quarters:
+        typed = get_typed_metrics(metric)
+        row = {"quarter": metric.get("quarter", "N/A")}
+        row.update({field: typed.get(field) for field in chart_fields})
+        stock_data.append(row)
+
+    # None becomes NaN so plotly leaves gaps for missing quarters
+    return pd.DataFrame(stock_data).astype({field: float for field in chart_fields})
 
 
 
@@ -153,11 +146,9 @@ def register_stock_details_callbacks(app):
         [Input('quarter-dropdown', 'value')],
         [State('company-name-store', 'children')]
     )
-    def update_info_cards(selected_quarter_idx, company_name):
-        stock = db.get_collection('detailed_financials').find_one({"company_name": company_name})
-        if stock and stock.get('financial_metrics'):
-            selected_data = stock['financial_metrics'][int(selected_quarter_idx)]
-            selected_data['symbol'] = stock.get('symbol', 'N/A')
+    def update_info_cards(selected_quarter_key, company_name):
+        selected_data = get_company_quarter(company_name, selected_quarter_key)
+        if selected_data:
             # Prepare data for display using the helper function
             basic_info, valuation_metrics, financial_performance, insights = prepare_data_sections(selected_data)
 
@@ -170,7 +161,7 @@ def register_stock_details_callbacks(app):
             ]
 
             # Generate recommendation
-            recommendation = generate_stock_recommendation(selected_data)
+            recommendation = stored_recommendation(selected_data) or generate_stock_recommendation(get_typed_metrics(selected_data))
 
             return cards, recommendation
 
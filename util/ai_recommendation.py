@@ -1,88 +1,144 @@
 
 import re
-import base64
+import logging
+from datetime import datetime
 import pandas as pd
 import numpy as np
 from util.database import DatabaseConnection
-from util.general_util import parse_numeric_value, extract_numeric, load_svg_indicator
+from util.data_version import bump_data_generation
+from util.general_util import get_typed_metrics, typed_value, estimate_surprise
+from util.recommendation import stored_recommendation, generate_stock_recommendations
 
 
 
 
     
 
-def process_stock_data(stock, latest_metric, portfolio_stocks, portfolio_indicator, ai_indicator, ai_recommendation):
+def process_stock_data(stock, latest_metric, portfolio_stocks, ai_recommendation):
     company_name = stock['company_name']
     symbol = stock.get('symbol', 'N/A')
-    in_portfolio = symbol in portfolio_stocks
-    indicator = f'<img src="{portfolio_indicator}" width="24" height="24">' if in_portfolio else ''
-    company_name_with_indicator = f'{indicator} {company_name}'
-
-    # Fetch the latest AI analysis
-    analysis_doc = DatabaseConnection.get_collection('ai_analysis').find_one({'symbol': symbol}, sort=[('timestamp', -1)])
-    if analysis_doc:
-        analysis_text = analysis_doc['analysis'] 
-        ai_recommendation = extract_recommendation(analysis_text)
-    else:
-        ai_recommendation = None
-
-    # Create the AI indicator HTML
-    ai_indicator_html = f'<img src="{ai_indicator}" width="24" height="24" style="cursor: pointer;" />'
 
-    # Combine AI indicator and recommendation
-    if ai_recommendation:
-        ai_indicator_html += f' {ai_recommendation}'
+    # Typed fields are parsed once at ingestion; only unmigrated documents are parsed here
+    typed = get_typed_metrics(latest_metric)
 
     return {
         "company_name": company_name,
         "symbol": symbol,
-        "company_name_with_indicator": company_name_with_indicator,
-        "ai_indicator": ai_indicator_html,
-        "result_date": pd.to_datetime(latest_metric.get("result_date", "N/A")),
-        "net_profit_growth": parse_numeric_value(latest_metric.get("net_profit_growth", "0%")),
-        "cmp": parse_numeric_value(latest_metric.get("cmp", "0").split()[0]),
+        # The icons are static assets drawn by the table styles; rows only carry the flags
+        "in_portfolio": int(symbol in portfolio_stocks),
+        "ai_indicator": ai_recommendation or "",
+        "result_date": pd.to_datetime(typed.get("result_date"), format='%Y-%m-%d', errors='coerce'),
+        "net_profit_growth": typed_value(typed, "net_profit_growth", 0.0),
+        "cmp": typed_value(typed, "cmp", 0.0),
         "quarter": latest_metric.get("quarter", "N/A"),
-        "ttm_pe": parse_numeric_value(latest_metric.get("ttm_pe", "N/A")),
-        "net_profit": parse_numeric_value(latest_metric.get("net_profit", "0")),
+        "quarter_key": latest_metric.get("quarter_key"),
+        "ttm_pe": typed_value(typed, "ttm_pe"),
+        "net_profit": typed_value(typed, "net_profit", 0.0),
         "estimates": latest_metric.get("estimates", "N/A"),
-        "strengths": extract_numeric(latest_metric.get("strengths", "0")),
-        "weaknesses": extract_numeric(latest_metric.get("weaknesses", "0")),
-        "pb_ratio": parse_numeric_value(latest_metric.get("pb_ratio", "N/A")),
-        "sector_pe": parse_numeric_value(latest_metric.get("sector_pe", "N/A")),
-        "ttm_eps": parse_numeric_value(latest_metric.get("ttm_eps", "N/A")),
-        "dividend_yield": parse_numeric_value(latest_metric.get("dividend_yield", "N/A")),
-        "book_value": parse_numeric_value(latest_metric.get("book_value", "N/A")),
-        "face_value": parse_numeric_value(latest_metric.get("face_value", "N/A")),
-        "piotroski_score": parse_numeric_value(latest_metric.get("piotroski_score", "0")),
-        "technicals_trend": latest_metric.get("technicals_trend", "NA"),
-        "revenue_growth": parse_numeric_value(latest_metric.get("revenue_growth", "0%")),
-        "fundamental_insights": latest_metric.get("fundamental_insights", "N/A"),
+        "processed_estimates": estimate_surprise(typed),
+        "strengths": typed_value(typed, "strengths", 0),
+        "weaknesses": typed_value(typed, "weaknesses", 0),
+        "pb_ratio": typed_value(typed, "pb_ratio"),
+        "sector_pe": typed_value(typed, "sector_pe"),
+        "ttm_eps": typed_value(typed, "ttm_eps"),
+        "dividend_yield": typed_value(typed, "dividend_yield"),
+        "book_value": typed_value(typed, "book_value"),
+        "face_value": typed_value(typed, "face_value"),
+        "piotroski_score": typed_value(typed, "piotroski_score", 0.0),
+        "technicals_trend": typed_value(typed, "technicals_trend", "NA"),
+        "revenue_growth": typed_value(typed, "revenue_growth", 0.0),
+        "fundamental_insights": typed_value(typed, "fundamental_insights", "N/A"),
         # Add the AI recommendation to the data
         "ai_recommendation": ai_recommendation if ai_recommendation else "N/A",
+        # Scored at ingestion; None when it was scored by an older model and needs recomputing
+        "recommendation": stored_recommendation(latest_metric),
     }
 
 
-def load_ai_indicator():
-    # Get the selected AI API from the settings
+AI_INDICATOR_ASSETS = {
+    'xai': '/assets/xAI_indicator.svg',
+    'perplexity': '/assets/ai_indicator.svg',
+}
+
+
+def get_ai_indicator_asset():
+    """URL of the AI indicator icon for the API selected in settings."""
     settings_doc = DatabaseConnection.get_collection('settings').find_one({'_id': 'ai_api_selection'})
     selected_api = settings_doc.get('selected_api', 'perplexity') if settings_doc else 'perplexity'
+    return AI_INDICATOR_ASSETS.get(selected_api, AI_INDICATOR_ASSETS['perplexity'])
 
-    # Determine the SVG file based on the selected API
-    if selected_api == 'xai':
-        svg_filename = 'xAI_indicator.svg'
-    else:
-        svg_filename = 'ai_indicator.svg'
 
-    # Load the SVG content
-    try:
-        with open(f'assets/{svg_filename}', 'r') as f:
-            svg_content = f.read()
-        # Encode the SVG content
-        encoded_svg = base64.b64encode(svg_content.encode('utf-8')).decode('utf-8')
-        return f'data:image/svg+xml;base64,{encoded_svg}'
-    except FileNotFoundError:
-        print(f"Error: SVG file '{svg_filename}' not found in the 'assets' directory.")
-        return ''
+# Bump when extract_recommendation changes so stored labels get re-parsed
+RECOMMENDATION_PARSER_VERSION = 1
+
+RECOMMENDATION_SECTION_PATTERN = re.compile(
+    r'(Recommendation|Stock Recommendation):\s*(.*?)(?:\n\n|$)', re.DOTALL | re.IGNORECASE)
+
+RECOMMENDATION_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE | re.MULTILINE) for pattern in [
+        r'it is recommended to (buy|hold|sell|strong buy|strong sell)',
+        r'recommended to (buy|hold|sell|strong buy|strong sell)',
+        r'we recommend (buying|holding|selling)',
+        r'^(Buy|Hold|Sell|Strong Buy|Strong Sell)[\.:]',  # Line starts with 'Buy', possibly followed by '.' or ':'
+        r'\b(Buy|Hold|Sell|Strong Buy|Strong Sell)\b',    # Matches standalone words
+    ]
+]
+
+
+def fetch_latest_analyses(symbols):
+    """
+    Returns {symbol: latest analysis doc} in a single aggregation over the (symbol, timestamp) index.
+    The analysis text is only shipped for documents without a current stored recommendation.
+    """
+    pipeline = [
+        {'$match': {'symbol': {'$in': list(symbols)}}},
+        {'$sort': {'symbol': 1, 'timestamp': -1}},
+        {'$group': {
+            '_id': '$symbol',
+            'analysis_id': {'$first': '$_id'},
+            'timestamp': {'$first': '$timestamp'},
+            'recommendation': {'$first': '$recommendation'},
+            'recommendation_parser_version': {'$first': '$recommendation_parser_version'},
+            'analysis': {'$first': {'$cond': [
+                {'$eq': ['$recommendation_parser_version', RECOMMENDATION_PARSER_VERSION]},
+                None,
+                '$analysis'
+            ]}},
+        }},
+    ]
+    analyses = {}
+    for doc in DatabaseConnection.get_collection('ai_analysis').aggregate(pipeline):
+        symbol = doc.pop('_id')
+        doc['_id'] = doc.pop('analysis_id')
+        doc['symbol'] = symbol
+        analyses[symbol] = doc
+    return analyses
+
+
+def get_analysis_recommendation(analysis_doc):
+    """Returns the stored recommendation label, re-parsing only documents from an older parser."""
+    if analysis_doc.get('recommendation_parser_version') == RECOMMENDATION_PARSER_VERSION:
+        return analysis_doc.get('recommendation')
+    return extract_recommendation(analysis_doc.get('analysis') or '')
+
+
+def build_analysis_document(company_name, symbol, analysis_text, timestamp=None):
+    return {
+        'company_name': company_name,
+        'symbol': symbol,
+        'analysis': analysis_text,
+        'recommendation': extract_recommendation(analysis_text),
+        'recommendation_parser_version': RECOMMENDATION_PARSER_VERSION,
+        'timestamp': timestamp or datetime.now(),
+    }
+
+
+def store_analysis(company_name, symbol, analysis_text):
+    """Inserts a new analysis with its recommendation extracted once, at write time."""
+    analysis_doc = build_analysis_document(company_name, symbol, analysis_text)
+    DatabaseConnection.get_collection('ai_analysis').insert_one(analysis_doc)
+    bump_data_generation('ai_analysis')
+    return analysis_doc
 
 
 # Implement get_previous_analyses function
@@ -91,87 +147,74 @@ def get_previous_analyses(symbol):
     return analyses
 
 
+def _normalize_recommendation(recommendation):
+    recommendation = recommendation.lower()
+    if recommendation in ['buying']:
+        return 'Buy'
+    elif recommendation in ['holding']:
+        return 'Hold'
+    elif recommendation in ['selling']:
+        return 'Sell'
+    return recommendation.title()
+
+
 def extract_recommendation(analysis_text):
     """
     Extracts the recommendation from the AI analysis text.
     """
     # Attempt to extract the 'Recommendation:' or 'Stock Recommendation:' section
-    recommendation_section = None
-    match = re.search(r'(Recommendation|Stock Recommendation):\s*(.*?)(?:\n\n|$)', analysis_text, re.DOTALL | re.IGNORECASE)
+    match = RECOMMENDATION_SECTION_PATTERN.search(analysis_text)
     if match:
         recommendation_section = match.group(2).strip()
     else:
         recommendation_section = analysis_text  # Search the entire text if no specific section is found
 
-    # Define patterns to search for the recommendation
-    patterns = [
-        r'it is recommended to (buy|hold|sell|strong buy|strong sell)',
-        r'recommended to (buy|hold|sell|strong buy|strong sell)',
-        r'we recommend (buying|holding|selling)',
-        r'^(Buy|Hold|Sell|Strong Buy|Strong Sell)[\.:]',  # Line starts with 'Buy', possibly followed by '.' or ':'
-        r'\b(Buy|Hold|Sell|Strong Buy|Strong Sell)\b',    # Matches standalone words
-    ]
-
-    for pattern in patterns:
+    for pattern in RECOMMENDATION_PATTERNS:
         # Search within the recommendation section first
-        rec_match = re.search(pattern, recommendation_section, re.IGNORECASE | re.MULTILINE)
+        rec_match = pattern.search(recommendation_section)
         if rec_match:
-            recommendation = rec_match.group(1).lower()
-            # Normalize the recommendation word
-            if recommendation in ['buying']:
-                return 'Buy'
-            elif recommendation in ['holding']:
-                return 'Hold'
-            elif recommendation in ['selling']:
-                return 'Sell'
-            else:
-                return recommendation.title()
+            return _normalize_recommendation(rec_match.group(1))
 
     # If not found in the section, search the entire analysis text
-    for pattern in patterns:
-        rec_match = re.search(pattern, analysis_text, re.IGNORECASE | re.MULTILINE)
-        if rec_match:
-            recommendation = rec_match.group(1).lower()
-            if recommendation in ['buying']:
-                return 'Buy'
-            elif recommendation in ['holding']:
-                return 'Hold'
-            elif recommendation in ['selling']:
-                return 'Sell'
-            else:
-                return recommendation.title()
-
-    # If not found, log a warning
-    print(f"Warning: No recommendation found in analysis text")
+    if recommendation_section is not analysis_text:
+        for pattern in RECOMMENDATION_PATTERNS:
+            rec_match = pattern.search(analysis_text)
+            if rec_match:
+                return _normalize_recommendation(rec_match.group(1))
+
+    logging.debug("No recommendation found in analysis text")
     return None
 
 def process_stock_batch(stocks, portfolio_stocks, ai_analyses):
-    """Process a batch of stocks efficiently"""
+    """
+    Process a batch of stocks efficiently. ai_analyses must hold the latest
+    analysis per symbol (see fetch_latest_analyses); nothing is queried per stock.
+    """
     processed_data = []
     
-    # Load indicators once per batch
-    portfolio_indicator = load_svg_indicator('portfolio_indicator.svg')
-    ai_indicator = load_ai_indicator()
-    
+    # Each stock is a flattened quarterly_metrics document, so it doubles as its own metric
     for stock in stocks:
-        if not stock.get('financial_metrics'):
-            continue
-            
-        latest_metric = stock['financial_metrics'][0]
+        latest_metric = stock
         
         # Get AI analysis from prefetched data
-        ai_analysis = ai_analyses.get(stock['symbol'])
+        ai_analysis = ai_analyses.get(stock.get('symbol'))
         ai_recommendation = None
         if ai_analysis:
-            ai_recommendation = extract_recommendation(ai_analysis['analysis'])
+            ai_recommendation = get_analysis_recommendation(ai_analysis)
         
         processed_data.append(process_stock_data(
             stock, 
             latest_metric, 
             portfolio_stocks,
-            portfolio_indicator,
-            ai_indicator,
             ai_recommendation
         ))
-    
+
+    # Stale stored recommendations are rescored from the typed metrics in one columnar pass;
+    # the display columns above replace missing values with zeros, which would score as data
+    stale = [i for i, row in enumerate(processed_data) if row['recommendation'] is None]
+    if stale:
+        typed = pd.DataFrame([get_typed_metrics(stocks[i]) for i in stale], dtype=object)
+        for i, label in zip(stale, generate_stock_recommendations(typed)):
+            processed_data[i]['recommendation'] = label
+
     return processed_data
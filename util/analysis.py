@@ -5,46 +5,48 @@ import os
 from typing import Union, List, Optional
 from openai import OpenAI
 from util.database import DatabaseConnection
+from util.analysis_cache import get_or_fetch_analysis
 import logging
 
-# Use database singleton
-db = DatabaseConnection.get_db()
-
 class APIError(Exception):
     pass
 
 def get_api_selection() -> str:
-    settings_doc = db['settings'].find_one({'_id': 'ai_api_selection'})
+    settings_doc = DatabaseConnection.get_collection('settings').find_one({'_id': 'ai_api_selection'})
     return settings_doc.get('selected_api', 'perplexity') if settings_doc else 'perplexity'
 
 def fetch_stock_analysis(stock_input: Union[str, List[str]]) -> Optional[str]:
+    """
+    Fetches an analysis from the selected API. Identical requests within the cache's
+    freshness window are served from ai_analysis_cache and concurrent ones share one call.
+    """
     try:
         api_map = {
-            'perplexity': fetch_stock_analysis_perplexity,
-            'xai': fetch_stock_analysis_xai
+            'perplexity': (build_perplexity_request, call_perplexity),
+            'xai': (build_xai_request, call_xai)
         }
         selected_api = get_api_selection()
-        api_function = api_map.get(selected_api)
-        
-        if not api_function:
+        if selected_api not in api_map:
             raise APIError(f"Unknown AI API selected: {selected_api}")
-            
-        return api_function(stock_input)
+
+        build_request, call_api = api_map[selected_api]
+        request = build_request(stock_input)
+        if request is None:
+            return None
+
+        return get_or_fetch_analysis(selected_api, request, lambda: call_api(request))
     except Exception as e:
         logging.error(f"Error in fetch_stock_analysis: {e}")
         return None
 
 def fetch_stock_analysis_perplexity(stock_input: Union[str, List[str]]) -> Optional[str]:
     """
-    Fetches stock analysis from Perplexity API.
+    Fetches stock analysis from Perplexity API, bypassing the cache.
     """
-    api_url = 'https://api.perplexity.ai/chat/completions'
-    api_key = os.getenv('PERPLEXITY_API_KEY')  # Ensure your API key is stored securely
-    headers = {
-        'Authorization': f'Bearer {api_key}',
-        'Content-Type': 'application/json'
-    }
+    request = build_perplexity_request(stock_input)
+    return call_perplexity(request) if request else None
 
+def build_perplexity_request(stock_input: Union[str, List[str]]) -> Optional[dict]:
     # Determine if input is a single stock or a list of stocks
     if isinstance(stock_input, str):
         # Single Stock Analysis
@@ -68,13 +70,21 @@ Stocks:
         return None
 
     # Configure the payload
-    payload = {
+    return {
         'model': 'llama-3.1-sonar-small-128k-online',
         'messages': [{'role': 'user', 'content': prompt}],
         'max_tokens': max_tokens,
         'temperature': 0.3
     }
 
+def call_perplexity(payload: dict) -> Optional[str]:
+    api_url = 'https://api.perplexity.ai/chat/completions'
+    api_key = os.getenv('PERPLEXITY_API_KEY')  # Ensure your API key is stored securely
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+
     try:
         response = requests.post(api_url, json=payload, headers=headers)
         response.raise_for_status()  # Raises HTTPError if the status is 4xx, 5xx
@@ -96,14 +106,12 @@ Stocks:
 
 def fetch_stock_analysis_xai(stock_input: Union[str, List[str]]) -> Optional[str]:
     """
-    Fetches stock analysis from xAI API.
+    Fetches stock analysis from xAI API, bypassing the cache.
     """
-    XAI_API_KEY = os.getenv("XAI_API_KEY")
-    client = OpenAI(
-        api_key=XAI_API_KEY,
-        base_url="https://api.x.ai/v1",
-    )
+    request = build_xai_request(stock_input)
+    return call_xai(request) if request else None
 
+def build_xai_request(stock_input: Union[str, List[str]]) -> Optional[dict]:
     if isinstance(stock_input, str):
         stock_list = [stock_input]
     elif isinstance(stock_input, list):
@@ -128,16 +136,25 @@ def fetch_stock_analysis_xai(stock_input: Union[str, List[str]]) -> Optional[str
         Provide the recommendations in a table format with the following columns: Stock Symbol, Recommendation, and Reason.
         Be concise and ensure accuracy.\n\nStocks:\n{stocks_str}"""
 
+    return {
+        "model": "grok-beta",
+        "messages": [
+            {"role": "system", "content": "You are Grok, an AI assistant providing stock analysis."},
+            {"role": "user", "content": prompt},
+        ],
+        "max_tokens": 500,
+        "temperature": 0.3,
+    }
+
+def call_xai(request: dict) -> Optional[str]:
+    XAI_API_KEY = os.getenv("XAI_API_KEY")
+    client = OpenAI(
+        api_key=XAI_API_KEY,
+        base_url="https://api.x.ai/v1",
+    )
+
     try:
-        response = client.chat.completions.create(
-            model="grok-beta",
-            messages=[
-                {"role": "system", "content": "You are Grok, an AI assistant providing stock analysis."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=500,
-            temperature=0.3,
-        )
+        response = client.chat.completions.create(**request)
 
         # Corrected access to content
         analysis_content = response.choices[0].message.content.strip()
@@ -0,0 +1,129 @@
+# util/analysis_cache.py
+"""
+Cache for AI analysis calls.
+
+Entries are keyed on (provider, model, hash of the full request, freshness window), so
+the same prompt sent within one window is answered from MongoDB and a new window asks
+the provider again. Concurrent identical requests in a worker share one upstream call.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from pymongo.errors import PyMongoError
+from util.database import DatabaseConnection
+
+ANALYSIS_CACHE_COLLECTION = 'ai_analysis_cache'
+ANALYSIS_CACHE_WINDOW = int(os.getenv('ANALYSIS_CACHE_WINDOW', 6 * 60 * 60))  # seconds
+SINGLE_FLIGHT_TIMEOUT = 120  # seconds a follower waits for the leader's call
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'coalesced': 0,
+    'upstream_calls': 0,
+    'upstream_errors': 0,
+    'upstream_ms': 0.0,
+    'saved_ms': 0.0,
+}
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.latency_ms = 0.0
+
+
+def _count(**increments):
+    with _stats_lock:
+        for name, value in increments.items():
+            _stats[name] += value
+
+
+def get_cache_collection():
+    return DatabaseConnection.get_collection(ANALYSIS_CACHE_COLLECTION)
+
+
+def analysis_cache_key(provider, request, now=None):
+    window = int((now or time.time()) // ANALYSIS_CACHE_WINDOW)
+    request_hash = hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+    return f"{provider}:{request.get('model')}:{request_hash}:{window}"
+
+
+def _load(key):
+    try:
+        return get_cache_collection().find_one({'_id': key})
+    except PyMongoError as e:
+        logging.error(f"Error reading analysis cache: {str(e)}")
+        return None
+
+
+def _store(key, provider, request, analysis, latency_ms):
+    now = datetime.datetime.utcnow()
+    try:
+        get_cache_collection().replace_one({'_id': key}, {
+            '_id': key,
+            'provider': provider,
+            'model': request.get('model'),
+            'analysis': analysis,
+            'latency_ms': latency_ms,
+            'created_at': now,
+            # TTL index removes the entry once its window is over
+            'expires_at': now + datetime.timedelta(seconds=ANALYSIS_CACHE_WINDOW),
+        }, upsert=True)
+    except PyMongoError as e:
+        logging.error(f"Error writing analysis cache: {str(e)}")
+
+
+def get_or_fetch_analysis(provider, request, fetch):
+    """Returns the cached analysis for this request, or calls fetch() once and caches a non-empty result."""
+    key = analysis_cache_key(provider, request)
+    cached = _load(key)
+    if cached and cached.get('analysis'):
+        _count(hits=1, saved_ms=cached.get('latency_ms', 0.0))
+        return cached['analysis']
+
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+
+    if not leader:
+        flight.done.wait(SINGLE_FLIGHT_TIMEOUT)
+        _count(coalesced=1, saved_ms=flight.latency_ms if flight.result else 0.0)
+        return flight.result
+
+    _count(misses=1)
+    started = time.perf_counter()
+    try:
+        flight.result = fetch()
+    finally:
+        flight.latency_ms = (time.perf_counter() - started) * 1000
+        _count(upstream_calls=1, upstream_ms=flight.latency_ms, upstream_errors=0 if flight.result else 1)
+        # Stored before the flight ends, so a request arriving in between reads it instead of
+        # going upstream again. Failed calls aren't cached, so a retry goes upstream again.
+        if flight.result:
+            _store(key, provider, request, flight.result, flight.latency_ms)
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        flight.done.set()
+    return flight.result
+
+
+def get_analysis_cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    requests = stats['hits'] + stats['misses'] + stats['coalesced']
+    stats['hit_rate'] = (stats['hits'] + stats['coalesced']) / requests if requests else 0.0
+    stats['avg_upstream_ms'] = stats['upstream_ms'] / stats['upstream_calls'] if stats['upstream_calls'] else 0.0
+    return stats
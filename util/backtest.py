@@ -0,0 +1,216 @@
+# util/backtest.py
+"""
+Backtest of the recommendation model against the local price store.
+
+Every company-quarter is scored as of its result_date and followed over each horizon
+(in trading days) using the cached daily closes. Forward returns are looked up once for
+the whole company x quarter grid with array indexing; scoring is the columnar
+score_stock_recommendations, so a weight sweep only rescores and regroups. Sweeps fan
+out over a process pool. Run from the project root, e.g.
+
+    python -m util.backtest
+    python -m util.backtest --horizons 21 63 --sync --years 5
+    python -m util.backtest --sweep 200 --workers 8
+"""
+
+import time
+import logging
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from util.general_util import get_typed_metrics
+from util.quarterly_metrics import get_quarterly_collection
+from util.price_store import get_close_matrix, backfill_prices
+from util.recommendation import score_stock_recommendations, RECOMMENDATION_WEIGHTS
+
+DEFAULT_HORIZONS = (21, 63, 126, 252)  # ~1, 3, 6 and 12 months of trading days
+LABELS = ['Strong Buy', 'Buy', 'Hold', 'Sell', 'Strong Sell', 'NR']
+BUY_LABELS = ['Strong Buy', 'Buy']
+SELL_LABELS = ['Sell', 'Strong Sell']
+
+logger = logging.getLogger(__name__)
+
+
+def price_symbol(symbol):
+    """The price store / yfinance symbol for a stored NSE symbol, as get_stock_symbol builds it."""
+    if not symbol or symbol in ('NA', 'N/A'):
+        return None
+    return f"{symbol}.NS"
+
+
+def load_quarters():
+    """
+    Every company-quarter from quarterly_metrics (the flattened, typed copy of
+    detailed_financials.financial_metrics). Returns (grid, metrics): grid holds
+    company_name, symbol, quarter_key and result_date; metrics holds the typed fields
+    the scorer reads, as an object frame so None stays None.
+    """
+    docs = list(get_quarterly_collection().find({}, {'_id': 0}))
+    typed = [get_typed_metrics(doc) for doc in docs]
+    grid = pd.DataFrame({
+        'company_name': [doc.get('company_name') for doc in docs],
+        'symbol': [price_symbol(doc.get('symbol')) for doc in docs],
+        'quarter_key': [doc.get('quarter_key') for doc in docs],
+        'result_date': pd.to_datetime([t.get('result_date') for t in typed], format='%Y-%m-%d', errors='coerce'),
+    })
+    return grid, pd.DataFrame(typed, dtype=object)
+
+
+def forward_returns(result_dates, symbols, closes, horizons=DEFAULT_HORIZONS):
+    """
+    Returns an (n, len(horizons)) array of close-to-close returns on adjusted closes, so splits
+    and bonuses don't show up as losses. Entry is the first trading day after the result date
+    (results usually land after the close); exit is `horizon` trading days later. NaN where
+    the symbol, the entry or the exit isn't in the store, including exits past the end of a
+    symbol's stored series (get_close_matrix leaves those NaN).
+    """
+    returns = np.full((len(symbols), len(horizons)), np.nan)
+    if closes.empty:
+        return returns
+
+    dates = closes.index.values
+    prices = closes.to_numpy(dtype=float)
+    column = closes.columns.get_indexer(pd.Index(symbols))
+    result_dates = pd.DatetimeIndex(result_dates)
+    entry = np.searchsorted(dates, result_dates.values, side='right')
+    valid = (column >= 0) & ~result_dates.isna() & (entry < len(dates))
+
+    for j, horizon in enumerate(horizons):
+        exit_ = entry + horizon
+        rows = np.flatnonzero(valid & (exit_ < len(dates)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns[rows, j] = prices[exit_[rows], column[rows]] / prices[entry[rows], column[rows]] - 1
+    return returns
+
+
+def summarize(labels, returns, horizons=DEFAULT_HORIZONS):
+    """
+    Per horizon and label: quarters with a return, mean and median return, hit rate (share
+    positive) and mean excess over every scored quarter at that horizon.
+    """
+    labels = np.asarray(labels, dtype=object)
+    tables = []
+    for j, horizon in enumerate(horizons):
+        observed = ~np.isnan(returns[:, j])
+        if not observed.any():
+            continue
+        frame = pd.DataFrame({'label': labels[observed], 'forward_return': returns[observed, j]})
+        table = frame.groupby('label')['forward_return'].agg(
+            quarters='size', mean='mean', median='median', hit_rate=lambda r: (r > 0).mean()
+        )
+        table['excess'] = table['mean'] - frame['forward_return'].mean()
+        table = table.reindex([label for label in LABELS if label in table.index])
+        tables.append(table.assign(horizon=horizon).set_index('horizon', append=True).swaplevel())
+    return pd.concat(tables) if tables else pd.DataFrame()
+
+
+def buy_sell_spread(labels, returns, horizon_index=0):
+    """Mean forward return of Buy/Strong Buy quarters minus that of Sell/Strong Sell ones."""
+    horizon_returns = returns[:, horizon_index]
+    observed = ~np.isnan(horizon_returns)
+    buys = observed & np.isin(labels, BUY_LABELS)
+    sells = observed & np.isin(labels, SELL_LABELS)
+    if not buys.any() or not sells.any():
+        return np.nan
+    return horizon_returns[buys].mean() - horizon_returns[sells].mean()
+
+
+def run_backtest(horizons=DEFAULT_HORIZONS, weights=None, sync=False, years=5):
+    """
+    Scores and follows every company-quarter. Returns (summary, grid, metrics, returns);
+    pass grid/metrics/returns on to sweep_weights to reuse them.
+    """
+    started = time.perf_counter()
+    grid, metrics = load_quarters()
+    symbols = sorted(grid['symbol'].dropna().unique())
+
+    if sync:
+        start = datetime.date.today() - datetime.timedelta(days=int(years * 365))
+        for symbol in symbols:
+            try:
+                backfill_prices(symbol, start)
+            except Exception as e:
+                logger.error(f"Error backfilling prices for {symbol}: {str(e)}")
+
+    closes = get_close_matrix(symbols)
+    loaded = time.perf_counter()
+
+    returns = forward_returns(grid['result_date'], grid['symbol'], closes, horizons)
+    grid['recommendation'] = score_stock_recommendations(metrics, weights)['recommendation'].to_numpy()
+    summary = summarize(grid['recommendation'].to_numpy(), returns, horizons)
+    logger.info(f"Backtested {len(grid)} company-quarters over {closes.shape[1]} price series: "
+                f"load {loaded - started:.2f}s, compute {time.perf_counter() - loaded:.2f}s")
+    return summary, grid, metrics, returns
+
+
+# Sweep workers get the grid once through the pool initializer, not with every task
+_worker_state = {}
+
+
+def _init_worker(metrics, returns, horizons):
+    _worker_state.update(metrics=metrics, returns=returns, horizons=horizons)
+
+
+def evaluate_weights(weights, metrics, returns, horizons):
+    labels = score_stock_recommendations(metrics, weights)['recommendation'].to_numpy()
+    result = {'weights': weights}
+    for j, horizon in enumerate(horizons):
+        result[f'spread_{horizon}d'] = buy_sell_spread(labels, returns, j)
+    result['buy_quarters'] = int(np.isin(labels, BUY_LABELS).sum())
+    result['sell_quarters'] = int(np.isin(labels, SELL_LABELS).sum())
+    return result
+
+
+def _evaluate_in_worker(weights):
+    return evaluate_weights(weights, _worker_state['metrics'], _worker_state['returns'], _worker_state['horizons'])
+
+
+def random_weight_sets(count, seed=0, low=0.0, high=2.0):
+    """The current weights followed by count - 1 sets with each weight scaled by a random factor."""
+    rng = np.random.default_rng(seed)
+    sets = [dict(RECOMMENDATION_WEIGHTS)]
+    for _ in range(count - 1):
+        factors = rng.uniform(low, high, len(RECOMMENDATION_WEIGHTS))
+        sets.append({name: round(weight * factor, 3)
+                     for (name, weight), factor in zip(RECOMMENDATION_WEIGHTS.items(), factors)})
+    return sets
+
+
+def sweep_weights(weight_sets, metrics, returns, horizons=DEFAULT_HORIZONS, workers=None):
+    """Evaluates each weights dict on a process pool. Returns a frame ranked by the first horizon's spread."""
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(metrics, returns, tuple(horizons))) as pool:
+        results = list(pool.map(_evaluate_in_worker, weight_sets, chunksize=max(1, len(weight_sets) // 64)))
+    return pd.DataFrame(results).sort_values(f'spread_{horizons[0]}d', ascending=False, na_position='last')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest the recommendation model on cached prices.")
+    parser.add_argument('--horizons', type=int, nargs='+', default=list(DEFAULT_HORIZONS),
+                        help="forward horizons in trading days")
+    parser.add_argument('--sync', action='store_true', help="backfill missing price history from yfinance first")
+    parser.add_argument('--years', type=float, default=5, help="history to backfill with --sync")
+    parser.add_argument('--sweep', type=int, default=0, help="number of random weight sets to evaluate")
+    parser.add_argument('--workers', type=int, default=None, help="processes for the sweep")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    summary, grid, metrics, returns = run_backtest(args.horizons, sync=args.sync, years=args.years)
+    with pd.option_context('display.float_format', '{:.4f}'.format, 'display.width', 120):
+        print(summary)
+
+    if args.sweep:
+        started = time.perf_counter()
+        results = sweep_weights(random_weight_sets(args.sweep, args.seed), metrics, returns,
+                                args.horizons, args.workers)
+        logger.info(f"Evaluated {len(results)} weight sets in {time.perf_counter() - started:.2f}s")
+        with pd.option_context('display.float_format', '{:.4f}'.format, 'display.width', 160,
+                               'display.max_colwidth', 200):
+            print(results.head(10).to_string(index=False))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
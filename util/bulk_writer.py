@@ -0,0 +1,75 @@
+# util/bulk_writer.py
+
+import time
+import logging
+from pymongo.errors import BulkWriteError
+from util.database import DatabaseConnection
+
+logger = logging.getLogger(__name__)
+
+
+class BulkWriter:
+    """
+    Buffers write operations per collection and flushes them as ordered bulk_write
+    batches, either when max_ops operations are pending or max_interval seconds have
+    passed since the last flush. Use as a context manager so the tail gets flushed.
+    """
+
+    def __init__(self, max_ops=500, max_interval=10.0, on_flush=None):
+        self.max_ops = max_ops
+        self.max_interval = max_interval
+        self.on_flush = on_flush
+        self._pending = {}
+        self._pending_count = 0
+        self._last_flush = time.monotonic()
+        self.reports = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+    def add(self, collection_name, op):
+        if op is None:
+            return
+        self._pending.setdefault(collection_name, []).append(op)
+        self._pending_count += 1
+        if self._pending_count >= self.max_ops or time.monotonic() - self._last_flush >= self.max_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes every pending batch (collections in the order they were first touched) and returns a report."""
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return None
+
+        pending, self._pending, self._pending_count = self._pending, {}, 0
+        started = time.perf_counter()
+        report = {'ops': 0, 'collections': {}, 'errors': []}
+        for collection_name, ops in pending.items():
+            entry = {'ops': len(ops), 'inserted': 0, 'upserted': 0, 'matched': 0, 'modified': 0}
+            try:
+                result = DatabaseConnection.get_collection(collection_name).bulk_write(ops, ordered=True)
+            except BulkWriteError as e:
+                details = e.details
+                entry.update(inserted=details.get('nInserted', 0), upserted=details.get('nUpserted', 0),
+                             matched=details.get('nMatched', 0), modified=details.get('nModified', 0))
+                report['errors'].extend(err.get('errmsg', '') for err in details.get('writeErrors', []))
+                logger.error(f"Bulk write to {collection_name} stopped after an error: {report['errors'][-1:]}")
+            else:
+                entry.update(inserted=result.inserted_count, upserted=result.upserted_count,
+                             matched=result.matched_count, modified=result.modified_count)
+            report['ops'] += len(ops)
+            report['collections'][collection_name] = entry
+
+        report['duration_ms'] = (time.perf_counter() - started) * 1000
+        self.reports.append(report)
+        logger.info(
+            f"Flushed {report['ops']} ops in {len(report['collections'])} round trips "
+            f"({report['duration_ms']:.0f} ms): {report['collections']}"
+        )
+        if self.on_flush:
+            self.on_flush(report)
+        return report
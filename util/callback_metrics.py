@@ -0,0 +1,294 @@
+# util/callback_metrics.py
+"""
+Per-callback instrumentation for the Dash app.
+
+instrument_callbacks(app) wraps app.callback, so every callback registered after it
+records wall time, response payload size, triggering input, MongoDB command count and
+exceptions. Timings are taken for a CALLBACK_METRICS_SAMPLE_RATE share of calls; call and
+error counts cover every call. The numbers are served in Prometheus text format on /metrics,
+together with the AI analysis cache, latest-metrics cache and MongoDB pool counters.
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+import functools
+import dash
+from dash.exceptions import PreventUpdate
+from flask import Response, jsonify, request
+from plotly.utils import PlotlyJSONEncoder
+from util.database import DatabaseConnection
+from util.frame_cache import get_shared_cache
+from util.analysis_cache import get_analysis_cache_stats
+from util.stock_utils import get_latest_metrics_stats
+
+CALLBACK_METRICS_SAMPLE_RATE = float(os.getenv('CALLBACK_METRICS_SAMPLE_RATE', '1.0'))
+METRICS_ROUTE = '/metrics'
+QUERY_REPORT_ROUTE = '/debug/queries'
+# Reports published by other processes (background callbacks) are kept this long
+SHARED_QUERY_REPORT_TTL = 60 * 60
+SHARED_QUERY_REPORT_PREFIX = 'query-report:'
+
+# Histogram upper bounds in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_callbacks = {}
+
+
+def _metrics(name):
+    if name not in _callbacks:
+        _callbacks[name] = {
+            'calls': 0,
+            'prevented': 0,
+            'errors': {},
+            'triggers': {},
+            'sampled': 0,
+            'duration_seconds': 0.0,
+            'duration_buckets': [0] * len(DURATION_BUCKETS),
+            'response_bytes': 0,
+            'db_commands': 0,
+        }
+    return _callbacks[name]
+
+
+def _payload_bytes(result):
+    try:
+        return len(json.dumps(result, cls=PlotlyJSONEncoder))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _trigger():
+    triggered = dash.callback_context.triggered
+    return triggered[0]['prop_id'] if triggered else 'initial'
+
+
+def record_call(name, trigger, duration, payload_bytes, db_commands, error=None, prevented=False):
+    with _lock:
+        metrics = _metrics(name)
+        metrics['calls'] += 1
+        metrics['triggers'][trigger] = metrics['triggers'].get(trigger, 0) + 1
+        if prevented:
+            metrics['prevented'] += 1
+        if error is not None:
+            metrics['errors'][error] = metrics['errors'].get(error, 0) + 1
+        if duration is None:
+            return
+        metrics['sampled'] += 1
+        metrics['duration_seconds'] += duration
+        metrics['response_bytes'] += payload_bytes
+        metrics['db_commands'] += db_commands
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                metrics['duration_buckets'][i] += 1
+
+
+def instrument(func, name=None):
+    """Wraps a callback function so each call is recorded under name (default: the function name)."""
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # MongoDB commands issued inside are attributed to this callback (see QueryMonitor)
+        with DatabaseConnection.query_scope(f"callback:{name}"):
+            return _call(*args, **kwargs)
+
+    def _call(*args, **kwargs):
+        trigger = _trigger()
+        if random.random() >= CALLBACK_METRICS_SAMPLE_RATE:
+            error, prevented = None, False
+            try:
+                return func(*args, **kwargs)
+            except PreventUpdate:
+                prevented = True
+                raise
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                record_call(name, trigger, None, 0, 0, error, prevented)
+
+        error, prevented, result = None, False, None
+        started = time.perf_counter()
+        with DatabaseConnection.track_commands() as commands:
+            try:
+                result = func(*args, **kwargs)
+                return result
+            except PreventUpdate:
+                prevented = True
+                raise
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                duration = time.perf_counter() - started
+                payload_bytes = _payload_bytes(result) if error is None and not prevented else 0
+                record_call(name, trigger, duration, payload_bytes, len(commands), error, prevented)
+
+    return wrapper
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus():
+    """All callback metrics in Prometheus text exposition format."""
+    with _lock:
+        snapshot = {name: dict(m, errors=dict(m['errors']), triggers=dict(m['triggers']),
+                               duration_buckets=list(m['duration_buckets']))
+                    for name, m in _callbacks.items()}
+
+    lines = []
+
+    def family(metric, kind, help_text):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+
+    family('dash_callback_calls_total', 'counter', 'Callback invocations.')
+    for name, m in sorted(snapshot.items()):
+        lines.append(f'dash_callback_calls_total{{callback="{_label(name)}"}} {m["calls"]}')
+
+    family('dash_callback_prevented_total', 'counter', 'Invocations that raised PreventUpdate.')
+    for name, m in sorted(snapshot.items()):
+        lines.append(f'dash_callback_prevented_total{{callback="{_label(name)}"}} {m["prevented"]}')
+
+    family('dash_callback_errors_total', 'counter', 'Invocations that raised, by exception type.')
+    for name, m in sorted(snapshot.items()):
+        for exception, count in sorted(m['errors'].items()):
+            lines.append(f'dash_callback_errors_total{{callback="{_label(name)}",exception="{_label(exception)}"}} {count}')
+
+    family('dash_callback_triggers_total', 'counter', 'Invocations by triggering input.')
+    for name, m in sorted(snapshot.items()):
+        for trigger, count in sorted(m['triggers'].items()):
+            lines.append(f'dash_callback_triggers_total{{callback="{_label(name)}",trigger="{_label(trigger)}"}} {count}')
+
+    family('dash_callback_duration_seconds', 'histogram', 'Wall time of sampled invocations.')
+    for name, m in sorted(snapshot.items()):
+        label = _label(name)
+        for bound, count in zip(DURATION_BUCKETS, m['duration_buckets']):
+            lines.append(f'dash_callback_duration_seconds_bucket{{callback="{label}",le="{bound}"}} {count}')
+        lines.append(f'dash_callback_duration_seconds_bucket{{callback="{label}",le="+Inf"}} {m["sampled"]}')
+        lines.append(f'dash_callback_duration_seconds_sum{{callback="{label}"}} {m["duration_seconds"]:.6f}')
+        lines.append(f'dash_callback_duration_seconds_count{{callback="{label}"}} {m["sampled"]}')
+
+    family('dash_callback_response_bytes', 'summary', 'JSON payload size of sampled responses.')
+    for name, m in sorted(snapshot.items()):
+        lines.append(f'dash_callback_response_bytes_sum{{callback="{_label(name)}"}} {m["response_bytes"]}')
+        lines.append(f'dash_callback_response_bytes_count{{callback="{_label(name)}"}} {m["sampled"]}')
+
+    family('dash_callback_db_commands', 'summary', 'MongoDB commands issued by sampled invocations.')
+    for name, m in sorted(snapshot.items()):
+        lines.append(f'dash_callback_db_commands_sum{{callback="{_label(name)}"}} {m["db_commands"]}')
+        lines.append(f'dash_callback_db_commands_count{{callback="{_label(name)}"}} {m["sampled"]}')
+
+    family('ai_analysis_cache_requests_total', 'counter', 'AI analysis requests by outcome.')
+    analysis = get_analysis_cache_stats()
+    for outcome in ('hits', 'misses', 'coalesced'):
+        lines.append(f'ai_analysis_cache_requests_total{{outcome="{outcome}"}} {analysis[outcome]}')
+    family('ai_analysis_upstream_calls_total', 'counter', 'Calls made to the AI provider.')
+    lines.append(f'ai_analysis_upstream_calls_total {analysis["upstream_calls"]}')
+    family('ai_analysis_upstream_errors_total', 'counter', 'Provider calls that returned no analysis.')
+    lines.append(f'ai_analysis_upstream_errors_total {analysis["upstream_errors"]}')
+    family('ai_analysis_upstream_seconds_total', 'counter', 'Wall time spent in provider calls.')
+    lines.append(f'ai_analysis_upstream_seconds_total {analysis["upstream_ms"] / 1000:.6f}')
+    family('ai_analysis_saved_seconds_total', 'counter', 'Provider time avoided by cached or shared answers.')
+    lines.append(f'ai_analysis_saved_seconds_total {analysis["saved_ms"] / 1000:.6f}')
+
+    latest = get_latest_metrics_stats()
+    family('latest_metrics_cache_requests_total', 'counter', 'Latest-quarter metrics lookups by outcome.')
+    for outcome in ('hits', 'misses'):
+        lines.append(f'latest_metrics_cache_requests_total{{outcome="{outcome}"}} {latest[outcome]}')
+    family('latest_metrics_cache_invalidations_total', 'counter', 'Times the latest-metrics cache was cleared.')
+    lines.append(f'latest_metrics_cache_invalidations_total {latest["invalidations"]}')
+    family('latest_metrics_cache_entries', 'gauge', 'Companies held in the latest-metrics cache.')
+    lines.append(f'latest_metrics_cache_entries {latest["size"]}')
+
+    pools = sorted(DatabaseConnection.get_pool_stats().items())
+    family('mongodb_pool_open_connections', 'gauge', 'Open connections per pool.')
+    for address, pool in pools:
+        lines.append(f'mongodb_pool_open_connections{{address="{_label(address)}"}} {pool["open_connections"]}')
+    family('mongodb_pool_checked_out', 'gauge', 'Connections currently checked out per pool.')
+    for address, pool in pools:
+        lines.append(f'mongodb_pool_checked_out{{address="{_label(address)}"}} {pool["checked_out"]}')
+    family('mongodb_pool_checkouts_total', 'counter', 'Successful connection checkouts per pool.')
+    for address, pool in pools:
+        lines.append(f'mongodb_pool_checkouts_total{{address="{_label(address)}"}} {pool["checkouts"]}')
+    family('mongodb_pool_checkout_failures_total', 'counter', 'Failed connection checkouts per pool.')
+    for address, pool in pools:
+        lines.append(f'mongodb_pool_checkout_failures_total{{address="{_label(address)}"}} {pool["checkout_failures"]}')
+    family('mongodb_pool_checkout_wait_seconds_total', 'counter', 'Time spent waiting for a connection per pool.')
+    for address, pool in pools:
+        lines.append(f'mongodb_pool_checkout_wait_seconds_total{{address="{_label(address)}"}} {pool["total_wait_ms"] / 1000:.6f}')
+    family('mongodb_pool_checkout_wait_seconds_max', 'gauge', 'Longest wait for a connection per pool.')
+    for address, pool in pools:
+        lines.append(f'mongodb_pool_checkout_wait_seconds_max{{address="{_label(address)}"}} {pool["max_wait_ms"] / 1000:.6f}')
+
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view():
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def publish_query_report(scope, limit=10):
+    """
+    Shares one scope's query report through the disk cache. Background callbacks run in
+    the callback manager's processes, whose QueryMonitor the web workers can't see; each
+    publishes its latest run here and QUERY_REPORT_ROUTE lists it under 'background'.
+    """
+    try:
+        get_shared_cache().set(f"{SHARED_QUERY_REPORT_PREFIX}{scope}",
+                               DatabaseConnection.get_query_report(limit, scope),
+                               expire=SHARED_QUERY_REPORT_TTL)
+    except Exception as e:
+        logging.error(f"Error publishing query report for {scope}: {str(e)}")
+
+
+def shared_query_reports():
+    try:
+        cache = get_shared_cache()
+        return {key[len(SHARED_QUERY_REPORT_PREFIX):]: cache.get(key) for key in cache.iterkeys()
+                if isinstance(key, str) and key.startswith(SHARED_QUERY_REPORT_PREFIX)}
+    except Exception as e:
+        logging.error(f"Error reading shared query reports: {str(e)}")
+        return {}
+
+
+def query_report_view():
+    """
+    Top MongoDB offenders per callback / route, the slow-query log and suspected N+1 loops
+    for this process, plus the latest run of each background callback.
+    """
+    limit = request.args.get('limit', 10, type=int)
+    report = DatabaseConnection.get_query_report(limit)
+    report['background'] = {scope: entry for scope, entry in shared_query_reports().items() if entry}
+    return jsonify(report)
+
+
+def instrument_callbacks(app):
+    """
+    Makes app.callback instrument every callback registered from now on and serves
+    the results on METRICS_ROUTE (and MongoDB attribution on QUERY_REPORT_ROUTE). Call it before any register_*_callbacks(app).
+    """
+    register = app.callback
+
+    @functools.wraps(register)
+    def callback(*args, **kwargs):
+        decorator = register(*args, **kwargs)
+        if kwargs.get('background'):
+            # Background callbacks run in a manager worker process, out of reach of this registry
+            return decorator
+
+        def wrap(func):
+            return decorator(instrument(func))
+        return wrap
+
+    app.callback = callback
+    app.server.add_url_rule(METRICS_ROUTE, 'callback_metrics', metrics_view)
+    app.server.add_url_rule(QUERY_REPORT_ROUTE, 'query_report', query_report_view)
+    logging.info(f"Callback metrics on {METRICS_ROUTE} (sample rate {CALLBACK_METRICS_SAMPLE_RATE})")
@@ -1,8 +1,8 @@
 # util/charting.py
 import plotly.graph_objects as go
 import plotly.express as px
-import yfinance as yf
 from util.stock_utils import get_stock_symbol
+from util.price_store import get_price_history
 
 def create_market_summary_chart():
     indices = ['S&P 500', 'NASDAQ', 'DOW']
@@ -68,9 +68,9 @@ def create_stock_price_chart(company_name):
     if not symbol:
         return go.Figure()  # Return an empty figure if symbol is not found
 
-    stock = yf.Ticker(symbol)
-    hist = stock.history(period="1y")
-    
+    # Served from the local price store; only missing days go to yfinance
+    hist = get_price_history(symbol)
+
     if hist.empty:
         return go.Figure()  # Return an empty figure if no data is available
 
@@ -0,0 +1,87 @@
+# util/company_cache.py
+"""
+Per-company quarter documents for the stock details page.
+
+Reads go through two layers:
+- a request-scoped identity map on flask.g, so the layout, the price chart and the
+  metrics chart built for one page view share a single read;
+- a short-TTL process cache keyed on the detailed_financials data generation, so
+  switching quarters in the dropdown doesn't touch MongoDB at all.
+
+The returned lists are shared between callers and must be treated as read-only.
+"""
+
+import time
+import threading
+from flask import g, has_request_context
+from util.data_version import get_data_generation
+from util.quarterly_metrics import fetch_company_quarters
+
+COMPANY_CACHE_TTL = 60  # seconds before the data generation is re-checked
+COMPANY_CACHE_SIZE = 256
+
+_company_cache = {}  # company_name -> (generation, checked_at, quarters)
+_company_cache_lock = threading.Lock()
+
+
+def _request_documents():
+    if not has_request_context():
+        return None
+    if not hasattr(g, 'company_documents'):
+        g.company_documents = {}
+    return g.company_documents
+
+
+def _cached_quarters(company_name):
+    with _company_cache_lock:
+        entry = _company_cache.get(company_name)
+    if entry is None:
+        return None
+
+    generation, checked_at, quarters = entry
+    if time.monotonic() - checked_at < COMPANY_CACHE_TTL:
+        return quarters
+
+    # TTL lapsed: keep the entry if nothing was written since it was loaded
+    if get_data_generation(('detailed_financials',)) != generation:
+        return None
+    with _company_cache_lock:
+        _company_cache[company_name] = (generation, time.monotonic(), quarters)
+    return quarters
+
+
+def get_company_quarters(company_name):
+    """Returns a company's quarterly_metrics documents in chronological order."""
+    documents = _request_documents()
+    if documents is not None and company_name in documents:
+        return documents[company_name]
+
+    quarters = _cached_quarters(company_name)
+    if quarters is None:
+        generation = get_data_generation(('detailed_financials',))
+        quarters = fetch_company_quarters(company_name)
+        with _company_cache_lock:
+            if len(_company_cache) >= COMPANY_CACHE_SIZE:
+                # Drop the least recently checked company
+                oldest = min(_company_cache, key=lambda name: _company_cache[name][1])
+                _company_cache.pop(oldest)
+            _company_cache[company_name] = (generation, time.monotonic(), quarters)
+
+    if documents is not None:
+        documents[company_name] = quarters
+    return quarters
+
+
+def get_company_quarter(company_name, key):
+    for quarter in get_company_quarters(company_name):
+        if quarter.get('quarter_key') == key:
+            return quarter
+    return None
+
+
+def get_company_symbol(company_name):
+    quarters = get_company_quarters(company_name)
+    if not quarters:
+        return None
+    return quarters[-1].get('symbol')
+
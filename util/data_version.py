@@ -0,0 +1,35 @@
+# util/data_version.py
+"""
+Write-generation counters for the collections the cached views depend on.
+
+Every writer bumps the counter of the collection it touched; readers compare the
+current generation with the one their cache was built from and only rebuild when
+it moved. This works on a standalone mongod (no replica set needed for change streams).
+"""
+
+from util.database import DatabaseConnection
+
+TRACKED_COLLECTIONS = ('detailed_financials', 'ai_analysis', 'holdings')
+GENERATION_DOC_ID = 'data_generation'
+
+
+def get_version_collection():
+    return DatabaseConnection.get_collection('data_version')
+
+
+def bump_data_generation(*collections):
+    """Increments the generation of each written collection. Call after the write succeeds."""
+    increments = {name: 1 for name in collections if name in TRACKED_COLLECTIONS}
+    if not increments:
+        return
+    get_version_collection().update_one(
+        {'_id': GENERATION_DOC_ID},
+        {'$inc': increments},
+        upsert=True
+    )
+
+
+def get_data_generation(collections=TRACKED_COLLECTIONS):
+    """Returns the current generations as a tuple, in the order of collections."""
+    doc = get_version_collection().find_one({'_id': GENERATION_DOC_ID}) or {}
+    return tuple(doc.get(name, 0) for name in collections)
@@ -1,39 +1,409 @@
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
+from pymongo.monitoring import ConnectionPoolListener, CommandListener
+from contextlib import contextmanager
+from flask import has_request_context, request
 import os
+import re
+import time
+import threading
+from collections import deque, OrderedDict
 from functools import lru_cache
 import logging
 
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def get_client_options():
+    """Pool, timeout, write concern and read preference settings, overridable through the environment."""
+    write_concern = os.getenv('MONGODB_WRITE_CONCERN', '1')
+    return {
+        'maxPoolSize': _env_int('MONGODB_MAX_POOL_SIZE', 50),
+        'minPoolSize': _env_int('MONGODB_MIN_POOL_SIZE', 0),
+        'maxIdleTimeMS': _env_int('MONGODB_MAX_IDLE_TIME_MS', 300_000),
+        'waitQueueTimeoutMS': _env_int('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 10_000),
+        'connectTimeoutMS': _env_int('MONGODB_CONNECT_TIMEOUT_MS', 5_000),
+        'serverSelectionTimeoutMS': _env_int('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5_000),
+        'socketTimeoutMS': _env_int('MONGODB_SOCKET_TIMEOUT_MS', 30_000),
+        'w': int(write_concern) if write_concern.isdigit() else write_concern,
+        'readPreference': os.getenv('MONGODB_READ_PREFERENCE', 'primary'),
+    }
+
+
+class PoolStatsListener(ConnectionPoolListener):
+    """Tracks checked-out connections and checkout wait time per pool (server address)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pools = {}
+
+    def _pool(self, address):
+        key = f"{address[0]}:{address[1]}"
+        if key not in self._pools:
+            self._pools[key] = {
+                'open_connections': 0,
+                'checked_out': 0,
+                'checkouts': 0,
+                'checkout_failures': 0,
+                'total_wait_ms': 0.0,
+                'max_wait_ms': 0.0,
+            }
+        return self._pools[key]
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        # Checked-out connections are still checked in (and counted down) after a clear
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._pools.pop(f"{event.address[0]}:{event.address[1]}", None)
+
+    def connection_created(self, event):
+        with self._lock:
+            self._pool(event.address)['open_connections'] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._pool(event.address)['open_connections'] -= 1
+
+    def connection_check_out_started(self, event):
+        # Checkout runs on the requesting thread, so a thread-local start time is enough
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._pool(event.address)['checkout_failures'] += 1
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, 'started', None)
+        wait_ms = (time.perf_counter() - started) * 1000 if started else 0.0
+        with self._lock:
+            pool = self._pool(event.address)
+            pool['checked_out'] += 1
+            pool['checkouts'] += 1
+            pool['total_wait_ms'] += wait_ms
+            pool['max_wait_ms'] = max(pool['max_wait_ms'], wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._pool(event.address)['checked_out'] -= 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = {}
+            for address, pool in self._pools.items():
+                entry = dict(pool)
+                entry['avg_wait_ms'] = pool['total_wait_ms'] / pool['checkouts'] if pool['checkouts'] else 0.0
+                stats[address] = entry
+            return stats
+
+
+# Cursor continuations; the query that opened the cursor is already counted
+BUDGET_EXEMPT_COMMANDS = ('getMore',)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class CommandTracker(CommandListener):
+    """Records the commands issued on the current thread while a track_commands() block is open."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def push(self, commands):
+        self._stack().append(commands)
+
+    def pop(self):
+        self._stack().pop()
+
+    def started(self, event):
+        for commands in self._stack():
+            commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+SLOW_QUERY_MS = _env_int('MONGODB_SLOW_QUERY_MS', 100)
+# Same command on the same collection this many times in one scope looks like a per-row loop
+N_PLUS_ONE_THRESHOLD = _env_int('MONGODB_N_PLUS_ONE_THRESHOLD', 10)
+# Least recently used scopes are dropped past this many
+MAX_QUERY_SCOPES = _env_int('MONGODB_MAX_QUERY_SCOPES', 500)
+
+
+def _route_pattern(path):
+    """Keeps the first path segment only, so /stock/<name> pages share the scope route:/stock/*."""
+    head, _, rest = path.strip('/').partition('/')
+    return f"/{head}/*" if rest else f"/{head}"
+
+
+def _thread_pattern(name):
+    """Drops the numbers Python and executors append, e.g. Thread-12 (worker) -> Thread (worker)."""
+    return re.sub(r'[-_]?\d+', '', name)
+
+
+def _documents_returned(reply):
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+    if 'values' in reply:
+        return len(reply['values'])
+    return reply.get('n', 0) if isinstance(reply.get('n'), int) else 0
+
+
+class QueryMonitor(CommandListener):
+    """
+    Attributes every command to the scope that issued it: the innermost query_scope()
+    on the thread (a Dash callback, a scraper step), else the Flask route, else the thread.
+    Keeps per-scope totals, a slow-query log and the scopes that repeat one command per row.
+    """
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, slow_log_size=200, max_scopes=MAX_QUERY_SCOPES):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pending = {}
+        self._scopes = OrderedDict()
+        self.max_scopes = max_scopes
+        self._n_plus_one = {}
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = deque(maxlen=slow_log_size)
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current_scope(self):
+        stack = self._stack()
+        if stack:
+            return stack[-1]['label']
+        if has_request_context():
+            return f"route:{_route_pattern(request.path)}"
+        return f"thread:{_thread_pattern(threading.current_thread().name)}"
+
+    def enter(self, label):
+        self._stack().append({'label': label, 'commands': {}})
+
+    def exit(self):
+        frame = self._stack().pop()
+        repeated = [(key, count) for key, count in frame['commands'].items() if count >= N_PLUS_ONE_THRESHOLD]
+        if not repeated:
+            return
+        with self._lock:
+            for (command, collection), count in repeated:
+                entry = self._n_plus_one.setdefault((frame['label'], command, collection),
+                                                    {'occurrences': 0, 'max_per_call': 0})
+                entry['occurrences'] += 1
+                entry['max_per_call'] = max(entry['max_per_call'], count)
+        logging.warning(f"{frame['label']} issued {max(c for _, c in repeated)} repeated "
+                        f"{', '.join(f'{cmd} on {coll}' for (cmd, coll), _ in repeated)} commands")
+
+    def started(self, event):
+        if event.command_name == 'getMore':
+            # The command value is the cursor id; the collection has its own field
+            collection = event.command.get('collection')
+        else:
+            collection = event.command.get(event.command_name)
+        collection = collection if isinstance(collection, str) else None
+        scope = self.current_scope()
+        stack = self._stack()
+        # getMore batches of one large cursor aren't a per-row loop
+        if stack and event.command_name != 'getMore':
+            key = (event.command_name, collection)
+            stack[-1]['commands'][key] = stack[-1]['commands'].get(key, 0) + 1
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (scope, collection)
+
+    def _finish(self, event, documents, failed):
+        with self._lock:
+            scope, collection = self._pending.pop((event.connection_id, event.request_id), (self.current_scope(), None))
+            duration_ms = event.duration_micros / 1000
+            entry = self._scopes.setdefault(scope, {})
+            self._scopes.move_to_end(scope)
+            if len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+            stats = entry.setdefault(f"{event.command_name} {collection or '-'}", {
+                'count': 0, 'failures': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'documents': 0,
+            })
+            stats['count'] += 1
+            stats['failures'] += int(failed)
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['documents'] += documents
+            if duration_ms >= self.slow_query_ms:
+                self.slow_queries.append({
+                    'scope': scope, 'command': event.command_name, 'collection': collection,
+                    'duration_ms': round(duration_ms, 2), 'documents': documents, 'failed': failed,
+                    'at': time.time(),
+                })
+        if duration_ms >= self.slow_query_ms:
+            logging.warning(f"Slow MongoDB {event.command_name} on {collection} from {scope}: "
+                            f"{duration_ms:.1f} ms, {documents} documents")
+
+    def succeeded(self, event):
+        self._finish(event, _documents_returned(event.reply), failed=False)
+
+    def failed(self, event):
+        self._finish(event, 0, failed=True)
+
+    def report(self, limit=10, scope=None):
+        """
+        Scopes ranked by total command time, each with its top commands, plus the slow and
+        N+1 logs. Pass scope to report on that scope alone.
+        """
+        with self._lock:
+            scopes = []
+            for scope_label, commands in self._scopes.items():
+                if scope is not None and scope_label != scope:
+                    continue
+                ranked = sorted(commands.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+                scopes.append({
+                    'scope': scope_label,
+                    'commands': sum(stats['count'] for stats in commands.values()),
+                    'total_ms': round(sum(stats['total_ms'] for stats in commands.values()), 2),
+                    'documents': sum(stats['documents'] for stats in commands.values()),
+                    'top': [dict(stats, command=name, total_ms=round(stats['total_ms'], 2),
+                                 max_ms=round(stats['max_ms'], 2)) for name, stats in ranked[:limit]],
+                })
+            n_plus_one = [
+                {'scope': label, 'command': command, 'collection': collection, **entry}
+                for (label, command, collection), entry in self._n_plus_one.items()
+                if scope is None or label == scope
+            ]
+            slow = [entry for entry in self.slow_queries if scope is None or entry['scope'] == scope]
+        scopes.sort(key=lambda entry: entry['total_ms'], reverse=True)
+        n_plus_one.sort(key=lambda entry: entry['max_per_call'], reverse=True)
+        return {
+            'slow_query_ms': self.slow_query_ms,
+            'scopes': scopes,
+            'n_plus_one': n_plus_one,
+            'slow_queries': slow[::-1][:limit * 5],
+        }
+
+
 class DatabaseConnection:
+    """Process-wide pooled MongoDB client. Every module should go through this class."""
     _instance = None
     _db = None
-    
+    _pid = None
+    _pool_stats = None
+    _command_tracker = None
+    _query_monitor = QueryMonitor()
+    _lock = threading.Lock()
+
     @classmethod
     def get_instance(cls):
+        # MongoClient isn't fork-safe: a forked gunicorn worker builds its own pool
+        if cls._instance is not None and cls._pid != os.getpid():
+            cls._instance = None
+            cls._db = None
         if cls._instance is None:
-            try:
-                mongodb_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
-                cls._instance = MongoClient(mongodb_uri)
-                # Test connection
-                cls._instance.admin.command('ismaster')
-            except ConnectionFailure as e:
-                logging.error(f"Failed to connect to MongoDB: {e}")
-                raise
+            with cls._lock:
+                if cls._instance is None:
+                    try:
+                        mongodb_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
+                        cls._pool_stats = PoolStatsListener()
+                        cls._command_tracker = CommandTracker()
+                        client = MongoClient(
+                            mongodb_uri,
+                            event_listeners=[cls._pool_stats, cls._command_tracker, cls._query_monitor],
+                            **get_client_options()
+                        )
+                        # Test connection
+                        client.admin.command('ping')
+                        cls._instance = client
+                        cls._pid = os.getpid()
+                    except ConnectionFailure as e:
+                        logging.error(f"Failed to connect to MongoDB: {e}")
+                        raise
         return cls._instance
-    
+
     @classmethod
-    def get_db(cls, db_name='stock_data'):
-        if cls._db is None:
-            cls._db = cls.get_instance()[db_name]
+    def get_db(cls, db_name=None):
+        db_name = db_name or os.getenv('MONGODB_DB', 'stock_data')
+        client = cls.get_instance()
+        if cls._db is None or cls._db.name != db_name:
+            cls._db = client[db_name]
         return cls._db
-    
+
     @classmethod
     def get_collection(cls, collection_name):
         return cls.get_db()[collection_name]
-    
+
+    @classmethod
+    def get_pool_stats(cls):
+        return cls._pool_stats.snapshot() if cls._pool_stats else {}
+
+    @classmethod
+    @contextmanager
+    def track_commands(cls):
+        """Yields a list that collects the name of every command (round trip) issued inside the block."""
+        cls.get_instance()
+        commands = []
+        tracker = cls._command_tracker
+        tracker.push(commands)
+        try:
+            yield commands
+        finally:
+            tracker.pop()
+
+    @classmethod
+    @contextmanager
+    def query_scope(cls, label):
+        """Attributes the commands issued inside the block to label (e.g. 'callback:update_tables')."""
+        cls._query_monitor.enter(label)
+        try:
+            yield
+        finally:
+            cls._query_monitor.exit()
+
+    @classmethod
+    def get_query_report(cls, limit=10, scope=None):
+        return cls._query_monitor.report(limit, scope)
+
+    @classmethod
+    def check_query_budget(cls, label, commands, budget):
+        """
+        Flags a code path whose round trips exceed its budget. Logs in production and
+        raises QueryBudgetExceeded when ENFORCE_QUERY_BUDGETS is set (dev/CI).
+        getMore batches aren't counted: they grow with the result size, not with the
+        number of queries the code path issues.
+        """
+        counted = [command for command in commands if command not in BUDGET_EXEMPT_COMMANDS]
+        if len(counted) <= budget:
+            return
+        message = f"{label} issued {len(counted)} MongoDB commands (budget {budget}): {', '.join(counted)}"
+        if os.getenv('ENFORCE_QUERY_BUDGETS'):
+            raise QueryBudgetExceeded(message)
+        logging.error(message)
+
     @classmethod
     def close_connection(cls):
         if cls._instance:
             cls._instance.close()
             cls._instance = None
-            cls._db = None
\ No newline at end of file
+            cls._db = None
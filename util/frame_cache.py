@@ -0,0 +1,74 @@
+# util/frame_cache.py
+"""
+Disk-backed frame cache shared by every worker process.
+
+Frames are keyed by name, quarter and data generation, so a bumped generation
+simply stops matching the old entries; those age out via TTL and the size limit.
+A cross-process lock makes sure only one worker rebuilds a missing frame while the
+others wait for it and read the stored copy.
+"""
+
+import os
+import logging
+import diskcache
+
+FRAME_CACHE_DIR = os.getenv('FRAME_CACHE_DIR', './cache/frames')
+FRAME_CACHE_TTL = int(os.getenv('FRAME_CACHE_TTL', 6 * 60 * 60))
+FRAME_CACHE_SIZE_LIMIT = int(os.getenv('FRAME_CACHE_SIZE_LIMIT', 256 * 1024 * 1024))
+FRAME_BUILD_LOCK_EXPIRE = 120  # seconds; frees the lock if the building worker dies
+
+_shared_cache = None
+
+
+def get_shared_cache():
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = diskcache.Cache(
+            FRAME_CACHE_DIR,
+            size_limit=FRAME_CACHE_SIZE_LIMIT,
+            eviction_policy='least-recently-used'
+        )
+    return _shared_cache
+
+
+def frame_key(name, quarter_key, generation):
+    return f"{name}:{quarter_key or 'latest'}:{'-'.join(str(g) for g in generation)}"
+
+
+def get_or_build_frame(name, quarter_key, generation, build):
+    """
+    Returns the shared frame for (name, quarter_key, generation), calling build() on a miss.
+    Empty builds (fetch errors come back as empty frames) are returned but never stored, so
+    a failed build isn't served to every worker until the next write. Errors raised by
+    build() propagate; only a failing cache layer falls back to building locally.
+    """
+    try:
+        cache = get_shared_cache()
+        key = frame_key(name, quarter_key, generation)
+        df = cache.get(key)
+        if df is not None:
+            return df
+        lock = diskcache.Lock(cache, f"lock:{key}", expire=FRAME_BUILD_LOCK_EXPIRE)
+        lock.acquire()
+    except Exception as e:
+        logging.error(f"Shared frame cache unavailable, building locally: {str(e)}")
+        return build()
+
+    try:
+        # Another worker may have built it while we waited for the lock
+        df = cache.get(key)
+        if df is None:
+            df = build()
+            if df.empty:
+                logging.warning(f"Not storing empty frame {key}")
+            else:
+                cache.set(key, df, expire=FRAME_CACHE_TTL)
+                logging.info(f"Stored shared frame {key} ({len(df)} rows)")
+    finally:
+        lock.release()
+    return df
+
+
+def store_frame(name, quarter_key, generation, df):
+    """Publishes an already-built (e.g. patched) frame for generation."""
+    get_shared_cache().set(frame_key(name, quarter_key, generation), df, expire=FRAME_CACHE_TTL)
@@ -1,5 +1,4 @@
 
-import base64
 import pandas as pd
 import numpy as np
 import re
@@ -22,17 +21,7 @@ def parse_numeric_value(value, remove_chars='%'):
             return float(value) if value else np.nan
     except (ValueError, TypeError):
         return np.nan
-    
-    # Helper function to load SVG indicators
-def load_svg_indicator(filename):
-    try:
-        with open(f'assets/{filename}', 'r') as f:
-            svg_content = f.read()
-        return f'data:image/svg+xml;base64,{base64.b64encode(svg_content.encode()).decode()}'
-    except FileNotFoundError:
-        print(f"Error: SVG file '{filename}' not found")
-        return ''
-    
+
 
 # Function to parse all numeric values in a dictionary
 def parse_all_numeric_values(data, keys, remove_chars='%'):
@@ -62,4 +51,103 @@ def process_estimates(estimate_str):
         else:
             return None
     except ValueError:
-        return None
\ No newline at end of file
+        return None
+
+# Typed metrics: scraped strings are parsed once at write time and stored under
+# metric['typed'] so readers don't have to re-parse them on every page load.
+METRICS_SCHEMA_VERSION = 2
+
+NUMERIC_METRIC_FIELDS = [
+    'cmp', 'revenue', 'gross_profit', 'net_profit', 'market_cap', 'face_value',
+    'book_value', 'dividend_yield', 'ttm_eps', 'ttm_pe', 'pb_ratio', 'sector_pe',
+    'net_profit_growth', 'gross_profit_growth', 'revenue_growth',
+    'revenue_growth_3yr_cagr', 'net_profit_growth_3yr_cagr', 'operating_profit_growth_3yr_cagr'
+]
+INTEGER_METRIC_FIELDS = ['piotroski_score', 'strengths', 'weaknesses']
+TEXT_METRIC_FIELDS = ['quarter', 'report_type', 'technicals_trend', 'fundamental_insights']
+
+PLACEHOLDERS = ['--', 'NA', 'nan', 'N/A', '', 'NaN']
+NUMBER_PATTERN = re.compile(r'[-+]?\d[\d,]*\.?\d*|[-+]?\.\d+')
+
+
+def parse_number(value):
+    """Parses '12.5%', '1,234.50' or '₹ 5,000 Cr' to a float, or None."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return None if pd.isna(value) else float(value)
+    if not isinstance(value, str) or value.strip() in PLACEHOLDERS:
+        return None
+    match = NUMBER_PATTERN.search(value)
+    if not match:
+        return None
+    try:
+        return float(match.group(0).replace(',', ''))
+    except ValueError:
+        return None
+
+
+def parse_integer(value):
+    number = parse_number(value)
+    return None if number is None else int(number)
+
+
+def parse_iso_date(value):
+    if value is None or (isinstance(value, str) and value.strip() in PLACEHOLDERS):
+        return None
+    date = pd.to_datetime(value, errors='coerce')
+    return None if pd.isna(date) else date.strftime('%Y-%m-%d')
+
+
+def parse_estimate(value):
+    """Parses 'Beat: 4.2%' / 'Missed: -3.1%' into {'outcome': 'beat', 'surprise_pct': 4.2}."""
+    if not isinstance(value, str) or value.strip() in PLACEHOLDERS:
+        return None
+    if 'Beat' in value:
+        outcome = 'beat'
+    elif 'Missed' in value:
+        outcome = 'missed'
+    else:
+        return None
+    return {'outcome': outcome, 'surprise_pct': parse_number(value.split(':')[-1])}
+
+
+def parse_text(value):
+    if not isinstance(value, str) or value.strip() in PLACEHOLDERS:
+        return None
+    return value.strip()
+
+
+def build_typed_metrics(metric):
+    typed = {field: parse_number(metric.get(field)) for field in NUMERIC_METRIC_FIELDS}
+    typed.update({field: parse_integer(metric.get(field)) for field in INTEGER_METRIC_FIELDS})
+    typed.update({field: parse_text(metric.get(field)) for field in TEXT_METRIC_FIELDS})
+    typed['result_date'] = parse_iso_date(metric.get('result_date'))
+    typed['estimates'] = parse_estimate(metric.get('estimates'))
+    return typed
+
+
+def add_typed_metrics(metric):
+    """Attaches the typed fields and schema version to a scraped metric dict, in place."""
+    metric['typed'] = build_typed_metrics(metric)
+    metric['schema_version'] = METRICS_SCHEMA_VERSION
+    return metric
+
+
+def get_typed_metrics(metric):
+    """Returns the stored typed fields, parsing on the fly only for documents not yet migrated."""
+    if metric.get('schema_version') == METRICS_SCHEMA_VERSION and metric.get('typed'):
+        return metric['typed']
+    return build_typed_metrics(metric)
+
+
+def typed_value(typed, key, default=np.nan):
+    value = typed.get(key)
+    return default if value is None else value
+
+
+def estimate_surprise(typed):
+    estimate = typed.get('estimates')
+    if not estimate or estimate.get('surprise_pct') is None:
+        return None
+    return estimate['surprise_pct']
@@ -0,0 +1,170 @@
+# util/indexes.py
+"""
+Declares the indexes the dashboard relies on and keeps MongoDB in line with them.
+
+    python -m util.indexes ensure   # create missing indexes (idempotent)
+    python -m util.indexes report   # list missing and unused indexes
+    python -m util.indexes check    # fail if a registered query plans a COLLSCAN
+"""
+
+import sys
+import logging
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from util.database import DatabaseConnection
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_INDEXES = {
+    'detailed_financials': [
+        # Stock details, search and the scrapers' find_one
+        IndexModel([('company_name', ASCENDING)], name='company_name_1'),
+        # Symbol lookups and update_symbol
+        IndexModel([('symbol', ASCENDING)], name='symbol_1'),
+    ],
+    'quarterly_metrics': [
+        # Overview: every company for one quarter
+        IndexModel([('quarter_key', ASCENDING), ('company_name', ASCENDING)],
+                   name='quarter_key_1_company_name_1', unique=True),
+        # Stock details and charts: one company's quarters in order
+        IndexModel([('company_name', ASCENDING), ('quarter_key', DESCENDING)],
+                   name='company_name_1_quarter_key_-1'),
+        # fetch_latest_metrics: latest quarter per symbol
+        IndexModel([('symbol', ASCENDING), ('quarter_key', DESCENDING)],
+                   name='symbol_1_quarter_key_-1'),
+    ],
+    'ai_analysis': [
+        # get_previous_analyses and the latest analysis per symbol
+        IndexModel([('symbol', ASCENDING), ('timestamp', DESCENDING)], name='symbol_1_timestamp_-1'),
+    ],
+    'ai_analysis_cache': [
+        # Drops cached AI responses once their freshness window has passed
+        IndexModel([('expires_at', ASCENDING)], name='expires_at_1', expireAfterSeconds=0),
+    ],
+    'holdings': [
+        IndexModel([('Instrument', ASCENDING)], name='Instrument_1'),
+    ],
+    'notifications': [
+        IndexModel([('timestamp', DESCENDING)], name='timestamp_-1'),
+    ],
+}
+
+# Hot-path queries that must stay index-backed: (name, collection, filter, sort)
+REGISTERED_QUERIES = [
+    ('stock_by_company_name', 'detailed_financials', {'company_name': ''}, None),
+    ('stock_by_symbol', 'detailed_financials', {'symbol': ''}, None),
+    ('quarter_overview', 'quarterly_metrics', {'quarter_key': '0000-00'}, None),
+    ('company_quarters', 'quarterly_metrics', {'company_name': ''}, [('quarter_key', ASCENDING)]),
+    ('latest_quarter_by_symbol', 'quarterly_metrics', {'symbol': ''}, [('quarter_key', DESCENDING)]),
+    ('latest_analysis', 'ai_analysis', {'symbol': ''}, [('timestamp', DESCENDING)]),
+    ('holding_by_instrument', 'holdings', {'Instrument': ''}, None),
+    ('recent_notifications', 'notifications', {}, [('timestamp', DESCENDING)]),
+]
+
+
+class IndexPlanError(Exception):
+    pass
+
+
+def _index_keys(spec):
+    return tuple(spec.document['key'].items())
+
+
+def _existing_index_keys(collection):
+    return {tuple(info['key']): name for name, info in collection.index_information().items()}
+
+
+def ensure_indexes(collections=None):
+    """Creates any declared index that is missing. Safe to call on every startup."""
+    db = DatabaseConnection.get_db()
+    created = {}
+    for collection_name, specs in REQUIRED_INDEXES.items():
+        if collections and collection_name not in collections:
+            continue
+        collection = db[collection_name]
+        existing = _existing_index_keys(collection)
+        missing = [spec for spec in specs if _index_keys(spec) not in existing]
+        if missing:
+            created[collection_name] = collection.create_indexes(missing)
+            logger.info(f"Created indexes on {collection_name}: {', '.join(created[collection_name])}")
+    return created
+
+
+def report_indexes():
+    """Returns the declared indexes that are missing and the existing ones nothing uses."""
+    db = DatabaseConnection.get_db()
+    report = {}
+    for collection_name, specs in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        existing = _existing_index_keys(collection)
+        declared = {_index_keys(spec) for spec in specs}
+
+        missing = [spec.document['name'] for spec in specs if _index_keys(spec) not in existing]
+        undeclared = [name for keys, name in existing.items() if name != '_id_' and keys not in declared]
+        try:
+            idle = [
+                stat['name'] for stat in collection.aggregate([{'$indexStats': {}}])
+                if stat['name'] != '_id_' and stat['accesses']['ops'] == 0
+            ]
+        except Exception as e:
+            logger.warning(f"$indexStats unavailable for {collection_name}: {e}")
+            idle = []
+
+        report[collection_name] = {
+            'missing': missing,
+            'undeclared': undeclared,
+            'unused_since_restart': idle,
+        }
+    return report
+
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+def check_query_plans(raise_on_failure=True):
+    """Explains every registered query and flags those whose winning plan is a COLLSCAN."""
+    db = DatabaseConnection.get_db()
+    failures = []
+    for name, collection_name, query, sort in REGISTERED_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+        if 'COLLSCAN' in set(_plan_stages(winning_plan)):
+            failures.append(name)
+            logger.error(f"Registered query '{name}' on {collection_name} is a COLLSCAN")
+
+    if failures and raise_on_failure:
+        raise IndexPlanError(f"Queries not backed by an index: {', '.join(failures)}")
+    return failures
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    command = sys.argv[1] if len(sys.argv) > 1 else 'ensure'
+    if command == 'ensure':
+        ensure_indexes()
+    elif command == 'report':
+        for collection_name, entry in report_indexes().items():
+            print(f"{collection_name}: {entry}")
+    elif command == 'check':
+        try:
+            check_query_plans()
+        except IndexPlanError as e:
+            logger.error(str(e))
+            sys.exit(1)
+        print("All registered queries are index-backed.")
+    else:
+        logger.error("Usage: python -m util.indexes [ensure|report|check]")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,18 +3,16 @@ import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 from datetime import datetime
-from pymongo import MongoClient
 import logging
+from util.database import DatabaseConnection
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
-# MongoDB setup
-client = MongoClient('mongodb://localhost:27017/')
-db = client['stock_data']
-ipo_collection = db['ipo_data']
+def get_ipo_collection():
+    return DatabaseConnection.get_collection('ipo_data')
 
 
 def get_combined_ipo_data(from_db=True):
@@ -31,7 +29,7 @@ def get_combined_ipo_data(from_db=True):
 def get_ipo_data_from_db():
     logger.info("Attempting to get IPO data from database")
     try:
-        ipo_data = list(ipo_collection.find({}, {'_id': 0}))
+        ipo_data = list(get_ipo_collection().find({}, {'_id': 0}))
         logger.info(f"Retrieved {len(ipo_data)} records from database")
         if not ipo_data:
             logger.info("No data found in database, fetching fresh data")
@@ -70,6 +68,7 @@ def fetch_and_store_ipo_data():
         logger.info(f"Fetched total of {len(combined_df)} IPO records")
 
         # Store in database
+        ipo_collection = get_ipo_collection()
         ipo_collection.delete_many({})
         ipo_collection.insert_many(combined_df.to_dict('records'))
         logger.info(f"Stored {len(combined_df)} IPO records in database")
@@ -1,7 +1,6 @@
 # util/layout.py
 import dash_bootstrap_components as dbc
 from dash import dcc, html
-from util.stock_utils import fetch_stock_names
 
 # Modern Sidebar
 sidebar = dbc.Col(
@@ -21,7 +20,8 @@ sidebar = dbc.Col(
                 dbc.InputGroupText(html.I(className="fas fa-search")),
                 dcc.Dropdown(
                     id='stock-search-sidebar',
-                    options=[{'label': name, 'value': name} for name in fetch_stock_names()],
+                    # Options are filled per keystroke by the server-side search_value callback
+                    options=[],
                     placeholder="Search stocks...",
                     multi=False,
                     className="border-0",
@@ -59,6 +59,19 @@ sidebar = dbc.Col(
                         active="exact",
                         className="rounded-3 mb-2"
                     ),
+                    dbc.NavLink(
+                        [
+                            html.Div([
+                                html.I(className="fas fa-filter me-3"),
+                                html.Span("Screener", className="flex-grow-1"),
+                                html.I(className="fas fa-chevron-right ms-auto opacity-50 small")
+                            ], className="d-flex align-items-center")
+                        ],
+                        href="/screener",
+                        id="screener-link",
+                        active="exact",
+                        className="rounded-3 mb-2"
+                    ),
                     dbc.NavLink(
                         [
                             html.Div([
@@ -220,6 +233,8 @@ ai_recommendation_modal = dbc.Modal(
         dbc.ModalBody([
             dcc.Store(id='selected-stock-symbol'),
             dcc.Store(id='selected-stock-name'),
+            # {analysis id: text} for the open stock; history switches are resolved clientside
+            dcc.Store(id='analysis-history-store'),
             dbc.Row([
                 dbc.Col([
                     html.Label(
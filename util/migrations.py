@@ -0,0 +1,109 @@
+# util/migrations.py
+"""
+Data migrations. Run from the project root, e.g.
+
+    python -m util.migrations quarterly_metrics
+    python -m util.migrations typed_metrics
+    python -m util.migrations analysis_recommendations
+    python -m util.migrations recommendation_scores
+"""
+
+import sys
+import logging
+from pymongo import UpdateOne
+from util.database import DatabaseConnection
+from util.general_util import add_typed_metrics, METRICS_SCHEMA_VERSION
+from util.ai_recommendation import extract_recommendation, RECOMMENDATION_PARSER_VERSION
+from util.data_version import bump_data_generation
+from util.indexes import ensure_indexes
+from util.quarterly_metrics import sync_company_quarters, recompute_recommendations
+from util.recommendation import RECOMMENDATION_MODEL_VERSION
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def migrate_quarterly_metrics():
+    """Backfills quarterly_metrics from every detailed_financials document."""
+    ensure_indexes(['quarterly_metrics'])
+    collection = DatabaseConnection.get_collection('detailed_financials')
+    companies = 0
+    quarters = 0
+    for stock in collection.find({}, {'company_name': 1, 'symbol': 1, 'financial_metrics': 1}):
+        quarters += sync_company_quarters(stock)
+        companies += 1
+    logger.info(f"Synced {quarters} quarters for {companies} companies into quarterly_metrics")
+    bump_data_generation('detailed_financials')
+
+
+def migrate_typed_metrics(batch_size=500):
+    """Backfills typed fields and the schema version on every stored quarter."""
+    collection = DatabaseConnection.get_collection('detailed_financials')
+    query = {'financial_metrics': {'$elemMatch': {'schema_version': {'$ne': METRICS_SCHEMA_VERSION}}}}
+    ops = []
+    migrated = 0
+    for stock in collection.find(query, {'financial_metrics': 1}):
+        metrics = [
+            metric if metric.get('schema_version') == METRICS_SCHEMA_VERSION else add_typed_metrics(metric)
+            for metric in stock['financial_metrics']
+        ]
+        ops.append(UpdateOne({'_id': stock['_id']}, {'$set': {'financial_metrics': metrics}}))
+        if len(ops) >= batch_size:
+            migrated += collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        migrated += collection.bulk_write(ops, ordered=False).modified_count
+    logger.info(f"Added typed metrics (schema v{METRICS_SCHEMA_VERSION}) to {migrated} companies")
+
+    # The flattened store copies the typed fields from detailed_financials
+    migrate_quarterly_metrics()
+
+
+def migrate_analysis_recommendations(batch_size=500):
+    """Stores the extracted recommendation on every ai_analysis document parsed by an older parser."""
+    collection = DatabaseConnection.get_collection('ai_analysis')
+    query = {'recommendation_parser_version': {'$ne': RECOMMENDATION_PARSER_VERSION}}
+    ops = []
+    migrated = 0
+    for doc in collection.find(query, {'analysis': 1}):
+        ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {
+            'recommendation': extract_recommendation(doc.get('analysis') or ''),
+            'recommendation_parser_version': RECOMMENDATION_PARSER_VERSION,
+        }}))
+        if len(ops) >= batch_size:
+            migrated += collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        migrated += collection.bulk_write(ops, ordered=False).modified_count
+    logger.info(f"Stored recommendations (parser v{RECOMMENDATION_PARSER_VERSION}) on {migrated} analyses")
+    bump_data_generation('ai_analysis')
+
+
+def migrate_recommendation_scores():
+    """Stores the recommendation and score on every quarter scored by an older model version."""
+    ensure_indexes(['quarterly_metrics'])
+    updated = recompute_recommendations()
+    logger.info(f"Stored recommendations (model {RECOMMENDATION_MODEL_VERSION}) on {updated} quarters")
+    bump_data_generation('detailed_financials')
+
+
+MIGRATIONS = {
+    'quarterly_metrics': migrate_quarterly_metrics,
+    'typed_metrics': migrate_typed_metrics,
+    'analysis_recommendations': migrate_analysis_recommendations,
+    'recommendation_scores': migrate_recommendation_scores,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(MIGRATIONS)
+    for name in names:
+        if name not in MIGRATIONS:
+            logger.error(f"Unknown migration '{name}'. Choose from: {', '.join(MIGRATIONS)}")
+            sys.exit(1)
+        logger.info(f"Running migration: {name}")
+        MIGRATIONS[name]()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+# util/price_store.py
+"""
+Local daily OHLCV store behind the price charts.
+
+Prices live in SQLite keyed by (symbol, date). A chart render reads from disk; only the
+days from the last stored one on are fetched from yfinance (that bar again, in case it
+was stored mid-session), at most once per SYNC_INTERVAL per symbol and in a background
+thread when there is already data to show. Symbols yfinance can't resolve are
+remembered for NEGATIVE_CACHE_TTL.
+
+Bars are split- and dividend-adjusted, as the charts always were. When a sync sees a
+split or dividend, the symbol's stored history is re-downloaded so it stays on one basis.
+
+Set PRICE_FIXTURE_DIR to a directory of <symbol>.csv files (Date,Open,High,Low,Close,Volume)
+to run without network access, e.g. in tests or offline development.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+import datetime
+from contextlib import contextmanager
+import pandas as pd
+
+PRICE_DB_PATH = os.getenv('PRICE_DB_PATH', './cache/prices.sqlite3')
+PRICE_FIXTURE_DIR = os.getenv('PRICE_FIXTURE_DIR')
+SYNC_INTERVAL = 60 * 60  # seconds between yfinance checks for one symbol
+NEGATIVE_CACHE_TTL = 24 * 60 * 60
+HISTORY_DAYS = 365
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+CORPORATE_ACTION_COLUMNS = ['Dividends', 'Stock Splits']
+
+_schema_ready = False
+_syncing = set()
+_syncing_lock = threading.Lock()
+
+
+@contextmanager
+def _connect():
+    """Opens the store, commits on success and always closes the connection."""
+    global _schema_ready
+    directory = os.path.dirname(PRICE_DB_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(PRICE_DB_PATH, timeout=30)
+    if not _schema_ready:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS prices (
+                symbol TEXT NOT NULL,
+                date TEXT NOT NULL,
+                open REAL, high REAL, low REAL, close REAL, volume REAL,
+                PRIMARY KEY (symbol, date)
+            );
+            CREATE TABLE IF NOT EXISTS price_sync (
+                symbol TEXT PRIMARY KEY,
+                synced_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS unresolved_symbols (
+                symbol TEXT PRIMARY KEY,
+                failed_at REAL NOT NULL
+            );
+        """)
+        _schema_ready = True
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _download(symbol, start):
+    """Daily bars from start (a date) up to today, from the fixtures or yfinance."""
+    if PRICE_FIXTURE_DIR:
+        path = os.path.join(PRICE_FIXTURE_DIR, f"{symbol}.csv")
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=PRICE_COLUMNS)
+        hist = pd.read_csv(path, parse_dates=['Date'], index_col='Date')
+        return hist[hist.index.date >= start]
+
+    import yfinance as yf
+    return yf.Ticker(symbol).history(start=start.isoformat(), auto_adjust=True)
+
+
+def _price_rows(symbol, hist):
+    return [
+        (symbol, pd.Timestamp(date).date().isoformat(),
+         float(bar['Open']), float(bar['High']), float(bar['Low']), float(bar['Close']), float(bar['Volume']))
+        for date, bar in hist[PRICE_COLUMNS].dropna(subset=['Close']).iterrows()
+    ]
+
+
+def _insert_rows(conn, rows):
+    conn.executemany(
+        "INSERT OR REPLACE INTO prices (symbol, date, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+
+def _last_stored_date(conn, symbol):
+    row = conn.execute("SELECT MAX(date) FROM prices WHERE symbol = ?", (symbol,)).fetchone()
+    return datetime.date.fromisoformat(row[0]) if row and row[0] else None
+
+
+def _first_stored_date(conn, symbol):
+    row = conn.execute("SELECT MIN(date) FROM prices WHERE symbol = ?", (symbol,)).fetchone()
+    return datetime.date.fromisoformat(row[0]) if row and row[0] else None
+
+
+def _has_corporate_action(hist, since):
+    """Whether hist has a split or dividend after since, which changes every earlier adjusted bar."""
+    columns = [column for column in CORPORATE_ACTION_COLUMNS if column in hist.columns]
+    if not columns or hist.empty:
+        return False
+    actions = hist.loc[hist.index.date > since, columns]
+    return bool((actions.fillna(0) != 0).any().any())
+
+
+def is_unresolved(symbol):
+    with _connect() as conn:
+        row = conn.execute("SELECT failed_at FROM unresolved_symbols WHERE symbol = ?", (symbol,)).fetchone()
+    return bool(row) and time.time() - row[0] < NEGATIVE_CACHE_TTL
+
+
+def sync_prices(symbol):
+    """
+    Writes the bars from the last stored one (inclusive, so a bar stored mid-session gets its
+    final close) up to today. Returns the number of rows written.
+    """
+    today = datetime.date.today()
+    with _connect() as conn:
+        first_date = _first_stored_date(conn, symbol)
+        last_date = _last_stored_date(conn, symbol)
+    start = last_date or today - datetime.timedelta(days=HISTORY_DAYS)
+
+    hist = _download(symbol, start)
+    replace_history = last_date is not None and _has_corporate_action(hist, last_date)
+    if replace_history:
+        # The adjustment changed every earlier bar; reload what the store covers
+        logging.info(f"Corporate action for {symbol}; reloading its price history from {first_date}")
+        hist = _download(symbol, first_date)
+    rows = _price_rows(symbol, hist)
+
+    with _connect() as conn:
+        if rows:
+            if replace_history:
+                conn.execute("DELETE FROM prices WHERE symbol = ?", (symbol,))
+            _insert_rows(conn, rows)
+            conn.execute("DELETE FROM unresolved_symbols WHERE symbol = ?", (symbol,))
+        elif last_date is None:
+            # Nothing stored and nothing returned: yfinance doesn't know this symbol
+            conn.execute("INSERT OR REPLACE INTO unresolved_symbols (symbol, failed_at) VALUES (?, ?)", (symbol, time.time()))
+            logging.warning(f"No price history for {symbol}; skipping it for {NEGATIVE_CACHE_TTL // 3600}h")
+        conn.execute("INSERT OR REPLACE INTO price_sync (symbol, synced_at) VALUES (?, ?)", (symbol, time.time()))
+    return len(rows)
+
+
+def backfill_prices(symbol, start):
+    """
+    Loads the bars from start (a date) onwards that the store is missing: everything when it
+    doesn't reach back that far, otherwise the days since its last bar (see sync_prices).
+    """
+    with _connect() as conn:
+        first_date = _first_stored_date(conn, symbol)
+    if first_date is not None and first_date <= start:
+        return sync_prices(symbol)
+    rows = _price_rows(symbol, _download(symbol, start))
+    with _connect() as conn:
+        if rows:
+            _insert_rows(conn, rows)
+        conn.execute("INSERT OR REPLACE INTO price_sync (symbol, synced_at) VALUES (?, ?)", (symbol, time.time()))
+    return len(rows)
+
+
+def _sync_in_background(symbol):
+    with _syncing_lock:
+        if symbol in _syncing:
+            return
+        _syncing.add(symbol)
+
+    def run():
+        try:
+            sync_prices(symbol)
+        except Exception as e:
+            logging.error(f"Error syncing prices for {symbol}: {str(e)}")
+        finally:
+            with _syncing_lock:
+                _syncing.discard(symbol)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _needs_sync(conn, symbol):
+    row = conn.execute("SELECT synced_at FROM price_sync WHERE symbol = ?", (symbol,)).fetchone()
+    return not row or time.time() - row[0] >= SYNC_INTERVAL
+
+
+def _read_prices(conn, symbol, days):
+    since = (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+    hist = pd.read_sql_query(
+        "SELECT date, open, high, low, close, volume FROM prices WHERE symbol = ? AND date >= ? ORDER BY date",
+        conn, params=(symbol, since), parse_dates=['date']
+    )
+    hist.columns = ['Date'] + PRICE_COLUMNS
+    return hist.set_index('Date')
+
+
+def get_price_history(symbol, days=HISTORY_DAYS):
+    """Daily OHLCV bars for the last `days` days, served from the local store."""
+    if is_unresolved(symbol):
+        return pd.DataFrame(columns=PRICE_COLUMNS)
+
+    with _connect() as conn:
+        has_data = _last_stored_date(conn, symbol) is not None
+        needs_sync = _needs_sync(conn, symbol)
+
+    if needs_sync:
+        if has_data:
+            # Render what we have; the missing days land for the next view
+            _sync_in_background(symbol)
+        else:
+            try:
+                sync_prices(symbol)
+            except Exception as e:
+                logging.error(f"Error fetching prices for {symbol}: {str(e)}")
+                return pd.DataFrame(columns=PRICE_COLUMNS)
+
+    with _connect() as conn:
+        return _read_prices(conn, symbol, days)
+
+
+def get_close_matrix(symbols, start=None):
+    """
+    Daily (adjusted) closes for many symbols as one date x symbol frame, read from the store
+    as it is; nothing is synced. Gaps are forward-filled only between a symbol's first and last
+    stored bar, so dates past the end of its series stay NaN rather than repeating the last close.
+    """
+    symbols = sorted(set(symbols))
+    frames = []
+    with _connect() as conn:
+        # Stay under SQLite's bound-parameter limit
+        for i in range(0, len(symbols), 500):
+            chunk = symbols[i:i + 500]
+            query = f"SELECT symbol, date, close FROM prices WHERE symbol IN ({', '.join('?' * len(chunk))})"
+            params = list(chunk)
+            if start:
+                query += " AND date >= ?"
+                params.append(start.isoformat())
+            frames.append(pd.read_sql_query(query, conn, params=params, parse_dates=['date']))
+    prices = pd.concat(frames) if frames else pd.DataFrame(columns=['symbol', 'date', 'close'])
+    if prices.empty:
+        return pd.DataFrame()
+    closes = prices.pivot(index='date', columns='symbol', values='close').sort_index()
+    return closes.ffill().where(closes.bfill().notna())
@@ -0,0 +1,292 @@
+# util/quarterly_metrics.py
+
+import os
+import re
+import logging
+import threading
+import datetime
+import pandas as pd
+from pymongo import ASCENDING, UpdateOne
+from util.database import DatabaseConnection
+from util.data_version import bump_data_generation
+from util.frame_cache import get_shared_cache
+from util.indexes import ensure_indexes
+from util.general_util import get_typed_metrics, METRICS_SCHEMA_VERSION
+from util.recommendation import (
+    build_stored_recommendation, score_stock_recommendations, RECOMMENDATION_MODEL_VERSION
+)
+
+# One document per company-quarter, flattened out of detailed_financials.financial_metrics
+QUARTERLY_COLLECTION = 'quarterly_metrics'
+
+# Held by the one process rescoring stale recommendations; expires if that process dies
+RECOMPUTE_LOCK_KEY = 'lock:recommendation-recompute'
+RECOMPUTE_LOCK_EXPIRE = 60 * 60
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+
+# Indian fiscal quarters: Q1 = Apr-Jun, ..., Q4 = Jan-Mar of the fiscal year
+FY_QUARTER_END_MONTH = {1: 6, 2: 9, 3: 12, 4: 3}
+
+FY_QUARTER_PATTERN = re.compile(r'Q([1-4])\s*[\'\-]?\s*FY\s*[\'\-]?\s*(\d{2,4})', re.IGNORECASE)
+MONTH_YEAR_PATTERN = re.compile(r'([A-Za-z]{3,9})[\s\'\-,.]*(\d{4}|\d{2})\b')
+
+
+def _full_year(year):
+    year = int(year)
+    return year + 2000 if year < 100 else year
+
+
+def _quarter_end_month(month):
+    return ((month - 1) // 3 + 1) * 3
+
+
+def quarter_key(quarter, result_date=None):
+    """
+    Returns a sortable 'YYYY-MM' key for the closing month of a quarter label
+    such as 'Sep 2024', "Sep'24" or 'Q2FY25'. Falls back to the quarter that
+    closed before result_date when the label can't be parsed.
+    """
+    if isinstance(quarter, str) and quarter.strip():
+        match = FY_QUARTER_PATTERN.search(quarter)
+        if match:
+            fiscal_quarter = int(match.group(1))
+            fiscal_year = _full_year(match.group(2))
+            year = fiscal_year if fiscal_quarter == 4 else fiscal_year - 1
+            return f"{year:04d}-{FY_QUARTER_END_MONTH[fiscal_quarter]:02d}"
+
+        match = MONTH_YEAR_PATTERN.search(quarter)
+        if match and match.group(1)[:3].lower() in MONTHS:
+            month = _quarter_end_month(MONTHS[match.group(1)[:3].lower()])
+            return f"{_full_year(match.group(2)):04d}-{month:02d}"
+
+    if result_date:
+        date = pd.to_datetime(result_date, errors='coerce')
+        if not pd.isna(date):
+            # Results are announced after the quarter closes
+            month = _quarter_end_month(date.month) - 3
+            year = date.year
+            if month <= 0:
+                month += 12
+                year -= 1
+            return f"{year:04d}-{month:02d}"
+
+    return None
+
+
+def quarter_label(key):
+    """Formats a 'YYYY-MM' quarter key as 'Sep 2024'."""
+    try:
+        return datetime.datetime.strptime(key, '%Y-%m').strftime('%b %Y')
+    except (TypeError, ValueError):
+        return key or 'N/A'
+
+
+def get_quarterly_collection():
+    return DatabaseConnection.get_collection(QUARTERLY_COLLECTION)
+
+
+def build_quarter_document(company_name, symbol, metric):
+    key = quarter_key(metric.get('quarter'), metric.get('result_date'))
+    if key is None:
+        return None
+
+    document = {k: v for k, v in metric.items() if k != '_id'}
+    typed = get_typed_metrics(metric)
+    document.update({
+        'company_name': company_name,
+        'symbol': symbol,
+        'quarter_key': key,
+        'typed': typed,
+        'schema_version': METRICS_SCHEMA_VERSION,
+        # Scored once here; readers use it while its model_version is current
+        'recommendation': build_stored_recommendation(typed),
+        'updated_at': datetime.datetime.utcnow()
+    })
+    return document
+
+
+def quarter_upsert_op(company_name, symbol, metric):
+    document = build_quarter_document(company_name, symbol, metric)
+    if document is None:
+        logging.warning(f"Unable to derive a quarter key for {company_name} - {metric.get('quarter')}")
+        return None
+    return UpdateOne(
+        {'quarter_key': document['quarter_key'], 'company_name': company_name},
+        {'$set': document},
+        upsert=True
+    )
+
+
+def upsert_quarter_metric(company_name, symbol, metric):
+    op = quarter_upsert_op(company_name, symbol, metric)
+    if op is not None:
+        get_quarterly_collection().bulk_write([op])
+
+
+def quarter_fields_op(company_name, quarter, fields, result_date=None):
+    key = quarter_key(quarter, result_date)
+    if key is None:
+        return None
+    update = dict(fields, updated_at=datetime.datetime.utcnow())
+    return UpdateOne(
+        {'quarter_key': key, 'company_name': company_name},
+        {'$set': update}
+    )
+
+
+def update_quarter_fields(company_name, quarter, fields, result_date=None):
+    op = quarter_fields_op(company_name, quarter, fields, result_date)
+    if op is not None:
+        get_quarterly_collection().bulk_write([op])
+
+
+def load_known_quarters():
+    """
+    Returns {company_name: {'symbol': ..., 'quarters': set(...)}} for every company in
+    detailed_financials with one projected query, so scrapers don't need a find_one per card.
+    """
+    collection = DatabaseConnection.get_collection('detailed_financials')
+    known = {}
+    for stock in collection.find({}, {'company_name': 1, 'symbol': 1, 'financial_metrics.quarter': 1, '_id': 0}):
+        known[stock['company_name']] = {
+            'symbol': stock.get('symbol', 'NA'),
+            'quarters': {metric.get('quarter') for metric in stock.get('financial_metrics', [])}
+        }
+    return known
+
+
+def sync_company_quarters(stock):
+    """Upserts every quarter of a detailed_financials document into the flattened store."""
+    ops = [
+        op for op in (
+            quarter_upsert_op(stock['company_name'], stock.get('symbol', 'NA'), metric)
+            for metric in stock.get('financial_metrics', [])
+        ) if op is not None
+    ]
+    if ops:
+        get_quarterly_collection().bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def rebuild_quarterly_metrics():
+    """
+    Rebuilds the flattened store from detailed_financials from scratch, e.g. after that
+    collection was replaced wholesale by a restore. Returns the number of quarters written.
+    """
+    get_quarterly_collection().drop()
+    ensure_indexes([QUARTERLY_COLLECTION])
+    financials = DatabaseConnection.get_collection('detailed_financials')
+    quarters = 0
+    for stock in financials.find({}, {'company_name': 1, 'symbol': 1, 'financial_metrics': 1}):
+        quarters += sync_company_quarters(stock)
+    return quarters
+
+
+def fetch_available_quarters():
+    """Returns dropdown options for every quarter on record, newest first."""
+    keys = sorted((k for k in get_quarterly_collection().distinct('quarter_key') if k), reverse=True)
+    return [{'label': quarter_label(key), 'value': key} for key in keys]
+
+
+def fetch_quarter_metrics(key):
+    return list(get_quarterly_collection().find({'quarter_key': key}, {'_id': 0}))
+
+
+def fetch_latest_company_metrics():
+    """Latest quarter per company, walking the (company_name, quarter_key) index."""
+    pipeline = [
+        {'$sort': {'company_name': 1, 'quarter_key': -1}},
+        {'$group': {'_id': '$company_name', 'doc': {'$first': '$$ROOT'}}},
+        {'$replaceRoot': {'newRoot': '$doc'}},
+        {'$project': {'_id': 0}}
+    ]
+    return list(get_quarterly_collection().aggregate(pipeline))
+
+
+def fetch_company_quarters(company_name, start_key=None, end_key=None):
+    """Returns a company's quarters in chronological order, optionally bounded by quarter key."""
+    query = {'company_name': company_name}
+    key_range = {}
+    if start_key:
+        key_range['$gte'] = start_key
+    if end_key:
+        key_range['$lte'] = end_key
+    if key_range:
+        query['quarter_key'] = key_range
+    return list(get_quarterly_collection().find(query, {'_id': 0}).sort('quarter_key', ASCENDING))
+
+
+def fetch_company_quarter(company_name, key):
+    return get_quarterly_collection().find_one({'quarter_key': key, 'company_name': company_name}, {'_id': 0})
+
+
+def stale_recommendation_query():
+    return {'recommendation.model_version': {'$ne': RECOMMENDATION_MODEL_VERSION}}
+
+
+def _store_recommendations(collection, docs):
+    # object dtype keeps None apart from NaN, as the row scorer sees them
+    typed = pd.DataFrame([get_typed_metrics(doc) for doc in docs], dtype=object)
+    scores = score_stock_recommendations(typed)
+    ops = [
+        UpdateOne({'_id': doc['_id']}, {'$set': {'recommendation': {
+            'label': label,
+            'score': None if pd.isna(score) else float(score),
+            'model_version': RECOMMENDATION_MODEL_VERSION,
+        }}})
+        for doc, label, score in zip(docs, scores['recommendation'], scores['score'])
+    ]
+    return collection.bulk_write(ops, ordered=False).modified_count
+
+
+def recompute_recommendations(batch_size=1000):
+    """
+    Rescores every quarter whose stored recommendation is missing or from an older model,
+    a batch at a time with the columnar scorer. Returns the number of documents updated.
+    """
+    collection = get_quarterly_collection()
+    updated = 0
+    batch = []
+    for doc in collection.find(stale_recommendation_query()).batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            updated += _store_recommendations(collection, batch)
+            batch = []
+    if batch:
+        updated += _store_recommendations(collection, batch)
+    return updated
+
+
+def start_recommendation_recompute():
+    """
+    Rescores stale quarters in a background thread if the model version moved since they were
+    stored. Every web worker calls this at import; a shared-cache lock lets only one of them run it.
+    """
+    if get_quarterly_collection().find_one(stale_recommendation_query(), {'_id': 1}) is None:
+        return
+    try:
+        cache = get_shared_cache()
+        # add() only succeeds for the first process, so it doubles as a non-blocking lock
+        if not cache.add(RECOMPUTE_LOCK_KEY, os.getpid(), expire=RECOMPUTE_LOCK_EXPIRE):
+            logging.info("Stored recommendations are being recomputed by another process")
+            return
+    except Exception as e:
+        logging.error(f"Recommendation recompute lock unavailable, skipping: {str(e)}")
+        return
+
+    def run():
+        try:
+            updated = recompute_recommendations()
+            logging.info(f"Recomputed {updated} stored recommendations (model {RECOMMENDATION_MODEL_VERSION})")
+            if updated:
+                bump_data_generation('detailed_financials')
+        except Exception as e:
+            logging.error(f"Error recomputing stored recommendations: {str(e)}")
+        finally:
+            cache.delete(RECOMPUTE_LOCK_KEY)
+
+    threading.Thread(target=run, daemon=True, name='recommendation-recompute').start()
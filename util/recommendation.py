@@ -1,8 +1,42 @@
+import time
+import json
+import hashlib
 import numpy as np
 import pandas as pd
 from util.general_util import parse_numeric_value
 
 
+RECOMMENDATION_WEIGHTS = {
+    'ttm_pe': 1.5,
+    'pb_ratio': 1.0,
+    'net_profit_growth': 2.0,
+    'revenue_growth': 2.0,
+    'piotroski_score': 1.5,
+    'technicals_trend': 1.0,
+    'strengths_vs_weaknesses': 1.0,
+    'dividend_yield': 0.5,
+    'ttm_eps': 1.0,
+    'face_value': 0.5,
+    'book_value_vs_price': 1.0,
+    'fundamental_insights': 1.0
+}
+
+
+def _metric_input(data, names, default):
+    """
+    The first of names in data, parsed. Raw strings go through parse_numeric_value, where
+    '0.00' is a value; typed numbers are taken as they are, so 0.0 is a value too and only
+    None/NaN count as missing. Absent keys fall back to default as they always have.
+    """
+    for name in names:
+        if name in data:
+            value = data[name]
+            if value is None:
+                return np.nan
+            if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+                return float(value)
+            return parse_numeric_value(value)
+    return parse_numeric_value(default)
 
 
 def generate_stock_recommendation(data):
@@ -15,6 +49,15 @@ def generate_stock_recommendation(data):
     Returns:
     - str: Recommendation ("Strong Buy", "Buy", "Hold", "Sell", "Strong Sell", or "NR" for No Recommendation)
     """
+    return score_stock_recommendation(data)[0]
+
+
+def score_stock_recommendation(data, weights=None):
+    """
+    Like generate_stock_recommendation, but returns (recommendation, normalized score).
+    The score is between -1 and 1, or None when there is no recommendation.
+    weights overrides RECOMMENDATION_WEIGHTS (e.g. for backtests).
+    """
     default_values = {
         'ttm_pe': 25.0,
         'pb_ratio': 2.0,
@@ -43,29 +86,27 @@ def generate_stock_recommendation(data):
     missing_metrics = 0  # Counter for missing metrics
 
     if isinstance(data, pd.Series) or isinstance(data, dict):
-        ttm_pe = parse_numeric_value(data.get('ttm_pe', data.get('TTM P/E', default_values['ttm_pe'])))
+        ttm_pe = _metric_input(data, ['ttm_pe', 'TTM P/E'], default_values['ttm_pe'])
         if np.isnan(ttm_pe):
             ttm_pe = default_values['ttm_pe']
             missing_metrics += 1
 
-        pb_ratio = parse_numeric_value(data.get('pb_ratio', data.get('P/B Ratio', default_values['pb_ratio'])))
+        pb_ratio = _metric_input(data, ['pb_ratio', 'P/B Ratio'], default_values['pb_ratio'])
         if np.isnan(pb_ratio):
             pb_ratio = default_values['pb_ratio']
             missing_metrics += 1
 
-        net_profit_growth =  parse_numeric_value(data.get('Net Profit Growth %', data.get('net_profit_growth', default_values['net_profit_growth'])))
+        net_profit_growth = _metric_input(data, ['Net Profit Growth %', 'net_profit_growth'], default_values['net_profit_growth'])
         if np.isnan(net_profit_growth):
             net_profit_growth = default_values['net_profit_growth']
             missing_metrics += 1
 
-        revenue_growth = parse_numeric_value(
-            data.get('revenue_growth', data.get('Revenue Growth', default_values['revenue_growth'])), '%')
+        revenue_growth = _metric_input(data, ['revenue_growth', 'Revenue Growth'], default_values['revenue_growth'])
         if np.isnan(revenue_growth):
             revenue_growth = default_values['revenue_growth']
             missing_metrics += 1
 
-        piotroski_score = parse_numeric_value(
-            data.get('piotroski_score', data.get('Piotroski Score', default_values['piotroski_score'])))
+        piotroski_score = _metric_input(data, ['piotroski_score', 'Piotroski Score'], default_values['piotroski_score'])
         if np.isnan(piotroski_score):
             piotroski_score = default_values['piotroski_score']
             missing_metrics += 1
@@ -76,42 +117,37 @@ def generate_stock_recommendation(data):
             missing_metrics += 1
         technicals_trend = technicals_trend.upper()
 
-        strengths = parse_numeric_value(data.get('strengths', default_values['strengths']))
+        strengths = _metric_input(data, ['strengths'], default_values['strengths'])
         if np.isnan(strengths):
             strengths = default_values['strengths']
             missing_metrics += 1
 
-        weaknesses = parse_numeric_value(data.get('weaknesses', default_values['weaknesses']))
+        weaknesses = _metric_input(data, ['weaknesses'], default_values['weaknesses'])
         if np.isnan(weaknesses):
             weaknesses = default_values['weaknesses']
             missing_metrics += 1
 
-        dividend_yield = parse_numeric_value(
-            data.get('dividend_yield', data.get('Dividend Yield', default_values['dividend_yield'])))
+        dividend_yield = _metric_input(data, ['dividend_yield', 'Dividend Yield'], default_values['dividend_yield'])
         if np.isnan(dividend_yield):
             dividend_yield = default_values['dividend_yield']
             missing_metrics += 1
 
-        sector_pe = parse_numeric_value(
-            data.get('sector_pe', data.get('Sector P/E', default_values['sector_pe'])))
+        sector_pe = _metric_input(data, ['sector_pe', 'Sector P/E'], default_values['sector_pe'])
         if np.isnan(sector_pe):
             sector_pe = default_values['sector_pe']
             missing_metrics += 1
 
-        ttm_eps = parse_numeric_value(
-            data.get('ttm_eps', data.get('TTM EPS', default_values['ttm_eps'])))
+        ttm_eps = _metric_input(data, ['ttm_eps', 'TTM EPS'], default_values['ttm_eps'])
         if np.isnan(ttm_eps):
             ttm_eps = default_values['ttm_eps']
             missing_metrics += 1
 
-        face_value = parse_numeric_value(
-            data.get('face_value', data.get('Face Value', default_values['face_value'])))
+        face_value = _metric_input(data, ['face_value', 'Face Value'], default_values['face_value'])
         if np.isnan(face_value):
             face_value = default_values['face_value']
             missing_metrics += 1
 
-        book_value = parse_numeric_value(
-            data.get('book_value', data.get('Book Value', default_values['book_value'])))
+        book_value = _metric_input(data, ['book_value', 'Book Value'], default_values['book_value'])
         if np.isnan(book_value):
             book_value = default_values['book_value']
             missing_metrics += 1
@@ -121,7 +157,7 @@ def generate_stock_recommendation(data):
             fundamental_insights = default_values['fundamental_insights']
             missing_metrics += 1
     else:
-        return "Invalid data format"
+        return "Invalid data format", None
 
    
 
@@ -130,23 +166,10 @@ def generate_stock_recommendation(data):
     missing_threshold = total_metrics * 0.3  # Adjust threshold as needed (e.g., 30% missing data)
 
     if missing_metrics > missing_threshold:
-        return "NR"  # No Recommendation due to insufficient data
+        return "NR", None  # No Recommendation due to insufficient data
 
     # Define weights for each criterion
-    weights = {
-        'ttm_pe': 1.5,
-        'pb_ratio': 1.0,
-        'net_profit_growth': 2.0,
-        'revenue_growth': 2.0,
-        'piotroski_score': 1.5,
-        'technicals_trend': 1.0,
-        'strengths_vs_weaknesses': 1.0,
-        'dividend_yield': 0.5,
-        'ttm_eps': 1.0,
-        'face_value': 0.5,
-        'book_value_vs_price': 1.0,
-        'fundamental_insights': 1.0
-    }
+    weights = weights or RECOMMENDATION_WEIGHTS
 
     # Initialize total score and maximum possible score
     total_score = 0
@@ -219,7 +242,7 @@ def generate_stock_recommendation(data):
         current_price = default_values.get('current_price', 0.0)
         missing_metrics += 1  # Increment missing metrics if current price is missing
         if missing_metrics > missing_threshold:
-            return "NR"
+            return "NR", None
     if book_value > 0 and current_price > 0:
         bv_cp_ratio = (book_value - current_price) / current_price
         total_score += weights['book_value_vs_price'] * np.clip(bv_cp_ratio, -1, 1)
@@ -259,14 +282,293 @@ def generate_stock_recommendation(data):
 
     # Determine recommendation based on normalized score
     if normalized_score >= 0.5:
-        return "Strong Buy"
+        return "Strong Buy", normalized_score
     elif normalized_score >= 0.1:
-        return "Buy"
+        return "Buy", normalized_score
     elif normalized_score <= -0.5:
-        return "Strong Sell"
+        return "Strong Sell", normalized_score
     elif normalized_score <= -0.1:
-        return "Sell"
+        return "Sell", normalized_score
     else:
-        return "Hold"
+        return "Hold", normalized_score
+
+
+# Columnar version of generate_stock_recommendation for whole frames. Each metric is
+# (candidate columns in lookup order, default), matching the row version's data.get chains.
+NUMERIC_METRICS = {
+    'ttm_pe': (['ttm_pe', 'TTM P/E'], 25.0),
+    'pb_ratio': (['pb_ratio', 'P/B Ratio'], 2.0),
+    'net_profit_growth': (['Net Profit Growth %', 'net_profit_growth'], 0.0),
+    'revenue_growth': (['revenue_growth', 'Revenue Growth'], 0.0),
+    'piotroski_score': (['piotroski_score', 'Piotroski Score'], 3),
+    'strengths': (['strengths'], 0),
+    'weaknesses': (['weaknesses'], 0),
+    'dividend_yield': (['dividend_yield', 'Dividend Yield'], 0.0),
+    'sector_pe': (['sector_pe', 'Sector P/E'], 25.0),
+    'ttm_eps': (['ttm_eps', 'TTM EPS'], 0.0),
+    'face_value': (['face_value', 'Face Value'], 10.0),
+    'book_value': (['book_value', 'Book Value'], 0.0),
+}
+TEXT_METRICS = {
+    'technicals_trend': (['technicals_trend', 'Technicals Trend'], 'NEUTRAL'),
+    'fundamental_insights': (['fundamental_insights', 'Fundamental Insights'], ''),
+}
+PRICE_COLUMNS = ['LTP', 'cmp']
+MISSING_TEXT = ['--', 'NA', 'nan', 'N/A', '', 'NaN']
+MISSING_THRESHOLD = (len(NUMERIC_METRICS) + len(TEXT_METRICS)) * 0.3
+
+
+def _first_column(df, names):
+    return next((name for name in names if name in df.columns), None)
+
+
+def _map_values(values, func):
+    """func applied once per distinct value and broadcast back. None and NaN are kept apart."""
+    codes, uniques = pd.factorize(values)
+    mapped = np.array([func(value) for value in uniques] + [np.nan], dtype=float)
+    result = mapped[codes]  # code -1 (None/NaN) picks the trailing slot
+    if (codes == -1).any():
+        is_none = np.array([value is None for value in values[codes == -1]])
+        result[codes == -1] = np.where(is_none, func(None), func(np.nan))
+    return result
+
+
+def _numeric_column(df, names, default):
+    """_metric_input over a column: values, and which rows fell back to the default."""
+    column = _first_column(df, names)
+    if column is None:
+        parsed = parse_numeric_value(default)
+        values = np.full(len(df), parsed, dtype=float)
+    elif pd.api.types.is_numeric_dtype(df[column]):
+        # Typed numbers: 0.0 is a value, only NaN is missing (as in _metric_input)
+        values = df[column].to_numpy(dtype=float, copy=True)
+    else:
+        values = _map_values(df[column].to_numpy(dtype=object), _parse_object)
+    missing = np.isnan(values)
+    return np.where(missing, default, values).astype(float), missing
+
+
+def _parse_object(value):
+    """_metric_input for one value of an object column (typed dicts loaded into a frame keep None)."""
+    return _metric_input({'value': value}, ['value'], None)
+
+
+def _is_missing_text(value):
+    return float(not value or value in MISSING_TEXT)
+
+
+def _trend_score(value):
+    if _is_missing_text(value) or not isinstance(value, str):
+        return 0.0
+    value = value.upper()
+    if value in ['VERY BULLISH', 'BULLISH']:
+        return 1.0
+    if value in ['BEARISH', 'VERY BEARISH']:
+        return -1.0
+    return 0.0
+
+
+def _insights_score(value):
+    if _is_missing_text(value) or not isinstance(value, str):
+        return 0.0
+    value = value.lower()
+    if 'strong performer' in value:
+        return 1.0
+    if 'mid range performer' in value or 'mid-range performer' in value or 'neutral' in value:
+        return 0.0
+    return -1.0
+
+
+def _text_column(df, names, default, score):
+    """Per-row score for a text metric and which rows fell back to the default."""
+    column = _first_column(df, names)
+    values = (np.full(len(df), default, dtype=object) if column is None
+              else df[column].to_numpy(dtype=object))
+    return _map_values(values, score), _map_values(values, _is_missing_text).astype(bool)
+
+
+def generate_stock_recommendations(df, weights=None):
+    """
+    generate_stock_recommendation for every row of df at once, using NumPy masks over whole
+    columns. Returns a Series of labels aligned with df.index, identical to
+    df.apply(generate_stock_recommendation, axis=1) for well-formed rows.
+    """
+    return score_stock_recommendations(df, weights)['recommendation']
+
+
+def score_stock_recommendations(df, weights=None):
+    """Columnar score_stock_recommendation: a frame of 'recommendation' and 'score' (NaN for NR)."""
+    weights = weights or RECOMMENDATION_WEIGHTS
+    if df.empty:
+        return pd.DataFrame({'recommendation': pd.Series([], dtype=object), 'score': pd.Series([], dtype=float)},
+                            index=df.index)
+
+    metrics = {}
+    missing = np.zeros(len(df), dtype=int)
+    for name, (names, default) in NUMERIC_METRICS.items():
+        metrics[name], was_missing = _numeric_column(df, names, default)
+        missing += was_missing
+    trend, was_missing = _text_column(df, *TEXT_METRICS['technicals_trend'], _trend_score)
+    missing += was_missing
+    insights, was_missing = _text_column(df, *TEXT_METRICS['fundamental_insights'], _insights_score)
+    missing += was_missing
+
+    # A zero price counts as missing too (parse_numeric_value keeps a literal '0')
+    price, _ = _numeric_column(df, PRICE_COLUMNS, 0.0)
+    missing += price == 0
+
+    ttm_pe, sector_pe = metrics['ttm_pe'], metrics['sector_pe']
+    pb_ratio = metrics['pb_ratio']
+    strengths, weaknesses = metrics['strengths'], metrics['weaknesses']
+    book_value = metrics['book_value']
+
+    # Terms are added in the row version's order so the floating point sums match exactly
+    w = weights
+    total = np.zeros(len(df))
+    total += np.where((ttm_pe < sector_pe) & (ttm_pe > 0), w['ttm_pe'],
+                      np.where(ttm_pe > sector_pe, -w['ttm_pe'], 0.0))
+    total += np.where((pb_ratio < 1.5) & (pb_ratio > 0), w['pb_ratio'],
+                      np.where(pb_ratio > 3, -w['pb_ratio'], 0.0))
+    for name in ('net_profit_growth', 'revenue_growth'):
+        growth = metrics[name]
+        total += np.where(growth > 0, w[name] * np.clip(growth / 100, 0, 1),
+                          np.where(growth < 0, -(w[name] * np.clip(-growth / 100, 0, 1)), 0.0))
+    piotroski = metrics['piotroski_score']
+    total += np.where(piotroski >= 7, w['piotroski_score'],
+                      np.where(piotroski <= 3, -w['piotroski_score'], 0.0))
+    total += trend * w['technicals_trend']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sw_total = strengths + weaknesses
+        total += np.where(sw_total > 0, w['strengths_vs_weaknesses'] * ((strengths - weaknesses) / sw_total), 0.0)
+
+        dividend_yield = metrics['dividend_yield']
+        total += np.where(dividend_yield > 1, w['dividend_yield'],
+                          np.where(dividend_yield == 0, -w['dividend_yield'], 0.0))
+        total += np.where(metrics['ttm_eps'] > 0, w['ttm_eps'], -w['ttm_eps'])
+        total += np.where(metrics['face_value'] >= 10, w['face_value'], -w['face_value'])
+
+        bv_cp_ratio = (book_value - price) / price
+        total += np.where((book_value > 0) & (price > 0),
+                          w['book_value_vs_price'] * np.clip(bv_cp_ratio, -1, 1), 0.0)
+    total += insights * w['fundamental_insights']
+
+    normalized = total / sum(abs(weight) for weight in weights.values())
+    no_recommendation = missing > MISSING_THRESHOLD
+    labels = np.select(
+        [no_recommendation, normalized >= 0.5, normalized >= 0.1, normalized <= -0.5, normalized <= -0.1],
+        ['NR', 'Strong Buy', 'Buy', 'Strong Sell', 'Sell'],
+        default='Hold'
+    )
+    return pd.DataFrame({
+        'recommendation': pd.Series(labels, index=df.index, dtype=object),
+        'score': pd.Series(np.where(no_recommendation, np.nan, normalized), index=df.index),
+    })
+
+
+def _model_version():
+    """
+    RECOMMENDATION_LOGIC_VERSION plus a hash of the weights and threshold data, so editing
+    RECOMMENDATION_WEIGHTS or the missing-data rules changes the version on its own.
+    """
+    payload = json.dumps({
+        'weights': RECOMMENDATION_WEIGHTS,
+        'numeric_metrics': NUMERIC_METRICS,
+        'text_metrics': TEXT_METRICS,
+        'missing_text': MISSING_TEXT,
+        'missing_threshold': MISSING_THRESHOLD,
+    }, sort_keys=True)
+    return f"{RECOMMENDATION_LOGIC_VERSION}-{hashlib.sha1(payload.encode()).hexdigest()[:8]}"
+
+
+# Bump when the scoring code itself changes (its inline thresholds or how inputs are read)
+RECOMMENDATION_LOGIC_VERSION = 2
+
+# Scores stored with another version are ignored by readers and recomputed in the background
+RECOMMENDATION_MODEL_VERSION = _model_version()
+
+
+def build_stored_recommendation(typed):
+    """The recommendation subdocument stored on a quarterly_metrics document at ingestion."""
+    label, score = score_stock_recommendation(typed)
+    return {
+        'label': label,
+        'score': None if score is None or np.isnan(score) else float(score),
+        'model_version': RECOMMENDATION_MODEL_VERSION,
+    }
 
 
+def stored_recommendation(document):
+    """The label stored on a quarterly_metrics document, or None if missing or from an older model."""
+    stored = (document or {}).get('recommendation')
+    if isinstance(stored, dict) and stored.get('model_version') == RECOMMENDATION_MODEL_VERSION:
+        return stored.get('label')
+    return None
+
+
+def _synthetic_universe(rows, seed=0):
+    """Random metric rows mixing clean numbers, formatted strings, placeholders, zeros and gaps."""
+    rng = np.random.default_rng(seed)
+
+    def numeric(low, high):
+        values = rng.uniform(low, high, rows).round(2).astype(object)
+        kind = rng.random(rows)
+        values[kind < 0.1] = np.nan
+        values[(kind >= 0.1) & (kind < 0.15)] = 0
+        values[(kind >= 0.15) & (kind < 0.2)] = '--'
+        formatted = (kind >= 0.2) & (kind < 0.3)
+        values[formatted] = [f"{float(v):,.2f}%" for v in rng.uniform(low, high, formatted.sum())]
+        return values
+
+    def choice(options):
+        return np.array(options, dtype=object)[rng.integers(0, len(options), rows)]
+
+    return pd.DataFrame({
+        'company_name': [f"Company {i}" for i in range(rows)],
+        'ttm_pe': numeric(-20, 80),
+        'pb_ratio': numeric(-1, 6),
+        'net_profit_growth': numeric(-250, 250),
+        'revenue_growth': numeric(-150, 150),
+        'piotroski_score': choice([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, '--', np.nan]),
+        'strengths': choice([0, 1, 2, 3, 5, 8, np.nan]),
+        'weaknesses': choice([0, 1, 2, 4, 6, np.nan]),
+        'dividend_yield': numeric(0, 4),
+        'Sector P/E': numeric(5, 60),
+        'ttm_eps': numeric(-30, 120),
+        'book_value': numeric(-50, 900),
+        'cmp': numeric(1, 3000),
+        'technicals_trend': choice(['Bullish', 'VERY BULLISH', 'bearish', 'Very Bearish', 'Neutral', '--', 'NA', '']),
+        'fundamental_insights': choice(['Strong Performer', 'Mid-range Performer', 'mid range performer',
+                                        'Neutral', 'Weak Performer', 'NA', '', None, np.nan]),
+    })
+
+
+def check_compatibility(df):
+    """Rows where the columnar labels or scores differ from the row-by-row ones (empty when they match)."""
+    expected = df.apply(lambda row: score_stock_recommendation(row), axis=1, result_type='expand')
+    expected.columns = ['recommendation', 'score']
+    expected['score'] = expected['score'].astype(float)
+    actual = score_stock_recommendations(df)
+    differs = (expected['recommendation'] != actual['recommendation']) | ~(
+        (expected['score'] == actual['score']) | (expected['score'].isna() & actual['score'].isna()))
+    return df.assign(expected=expected['recommendation'], actual=actual['recommendation'],
+                     expected_score=expected['score'], actual_score=actual['score'])[differs]
+
+
+if __name__ == '__main__':
+    # Compatibility check and benchmark: python -m util.recommendation
+    for rows in (5_000, 50_000):
+        universe = _synthetic_universe(rows, seed=rows)
+        mismatches = check_compatibility(universe)
+        assert mismatches.empty, f"{len(mismatches)} labels differ:\n{mismatches.head()}"
+
+        started = time.perf_counter()
+        universe.apply(generate_stock_recommendation, axis=1)
+        row_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        score_stock_recommendations(universe)
+        column_seconds = time.perf_counter() - started
+
+        print(f"{rows:>6} rows: row-wise {row_seconds * 1000:8.1f} ms, columnar {column_seconds * 1000:6.1f} ms "
+              f"({row_seconds / column_seconds:.0f}x), labels and scores identical")
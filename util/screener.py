@@ -0,0 +1,457 @@
+# util/screener.py
+"""
+Stock screens written as filter expressions, e.g.
+
+    ttm_pe < sector_pe and piotroski_score >= 7 and net_profit_growth > 20
+    technicals_trend in ["Bullish", "Very Bullish"] and not dividend_yield < 1
+
+An expression is parsed with Python's ast module (nothing is evaluated) and compiled
+either into a MongoDB $match over the typed quarterly_metrics fields, or into a NumPy
+mask over the cached overview frame when every field it uses is a frame column and that
+frame is already in memory. Both treat a missing value as failing the comparison.
+"""
+
+import re
+import ast
+import time
+import datetime
+import numpy as np
+import pandas as pd
+from pymongo.errors import PyMongoError
+from util.database import DatabaseConnection
+from util.general_util import NUMERIC_METRIC_FIELDS, INTEGER_METRIC_FIELDS
+from util.quarterly_metrics import get_quarterly_collection
+
+SAVED_SCREENS_COLLECTION = 'saved_screens'
+SCREEN_PAGE_SIZE = 25
+MAX_EXPRESSION_LENGTH = 1000
+
+# Screen field -> document path in quarterly_metrics
+NUMERIC_FIELDS = {field: f'typed.{field}' for field in NUMERIC_METRIC_FIELDS + INTEGER_METRIC_FIELDS}
+NUMERIC_FIELDS.update({
+    'estimate_surprise': 'typed.estimates.surprise_pct',
+    'recommendation_score': 'recommendation.score',
+})
+TEXT_FIELDS = {
+    'company_name': 'company_name',
+    'symbol': 'symbol',
+    'technicals_trend': 'typed.technicals_trend',
+    'fundamental_insights': 'typed.fundamental_insights',
+    'recommendation': 'recommendation.label',
+}
+
+# Screen field -> overview frame column, for the columns that keep missing values as NaN
+# (process_stock_data fills e.g. net_profit_growth with 0.0, which would match `<= 0`)
+FRAME_COLUMNS = {
+    'company_name': 'company_name',
+    'symbol': 'symbol',
+    'ttm_pe': 'ttm_pe',
+    'pb_ratio': 'pb_ratio',
+    'sector_pe': 'sector_pe',
+    'ttm_eps': 'ttm_eps',
+    'dividend_yield': 'dividend_yield',
+    'book_value': 'book_value',
+    'face_value': 'face_value',
+    'estimate_surprise': 'processed_estimates',
+}
+
+# Always shown in the results, after the company; fields used by the screen are added
+RESULT_FIELDS = [
+    'cmp', 'ttm_pe', 'sector_pe', 'pb_ratio', 'piotroski_score',
+    'net_profit_growth', 'revenue_growth', 'dividend_yield', 'recommendation'
+]
+# Overview frame columns for the result fields it carries under another name
+FRAME_RESULT_COLUMNS = dict(FRAME_COLUMNS, recommendation='recommendation')
+
+COMPARISONS = {
+    ast.Lt: ('$lt', np.less),
+    ast.LtE: ('$lte', np.less_equal),
+    ast.Gt: ('$gt', np.greater),
+    ast.GtE: ('$gte', np.greater_equal),
+    ast.Eq: ('$eq', np.equal),
+    ast.NotEq: ('$ne', np.not_equal),
+}
+# `5 < ttm_pe` is `ttm_pe > 5`
+FLIPPED = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq, ast.NotEq: ast.NotEq}
+ARITHMETIC = {ast.Add: '$add', ast.Sub: '$subtract', ast.Mult: '$multiply', ast.Div: '$divide'}
+
+KEYWORD_PATTERN = re.compile(r'\b(AND|OR|NOT|IN)\b', re.IGNORECASE)
+SINGLE_EQUALS_PATTERN = re.compile(r'(?<![<>!=])=(?!=)')
+STRING_PATTERN = re.compile(r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')')
+
+
+class ScreenError(ValueError):
+    """The expression can't be parsed or uses something a screen doesn't support."""
+
+
+class Screen:
+    """A parsed, validated screen expression."""
+
+    def __init__(self, expression, tree, fields):
+        self.expression = expression
+        self.tree = tree
+        self.fields = fields
+
+    def to_match(self):
+        return _compile_match(self.tree)
+
+    def frame_mask(self, df):
+        return _frame_mask(self.tree, df)
+
+    def runs_on_frame(self, df):
+        return df is not None and all(FRAME_COLUMNS.get(field) in df.columns for field in self.fields)
+
+
+def _normalize(expression):
+    """Lets users write AND/OR/NOT and a single '=', leaving quoted strings alone."""
+    parts = STRING_PATTERN.split(expression)
+    for i in range(0, len(parts), 2):
+        part = KEYWORD_PATTERN.sub(lambda m: m.group(1).lower(), parts[i])
+        parts[i] = SINGLE_EQUALS_PATTERN.sub('==', part)
+    return ''.join(parts)
+
+
+def parse_screen(expression):
+    """Parses and type-checks an expression. Raises ScreenError with a user-facing message."""
+    expression = (expression or '').strip()
+    if not expression:
+        raise ScreenError("Enter a screen expression.")
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ScreenError(f"Expressions are limited to {MAX_EXPRESSION_LENGTH} characters.")
+    try:
+        tree = ast.parse(_normalize(expression), mode='eval').body
+    except SyntaxError as e:
+        raise ScreenError(f"Syntax error: {e.msg}.") from None
+
+    fields = set()
+    _check_condition(tree, fields)
+    return Screen(expression, tree, fields)
+
+
+def _check_condition(node, fields):
+    if isinstance(node, ast.BoolOp):
+        for value in node.values:
+            _check_condition(value, fields)
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        _check_condition(node.operand, fields)
+    elif isinstance(node, ast.Compare):
+        operands = [node.left] + node.comparators
+        for op, left, right in zip(node.ops, operands, operands[1:]):
+            if isinstance(op, (ast.In, ast.NotIn)):
+                _check_text(left, fields, allow_constant=False)
+                if not isinstance(right, (ast.List, ast.Tuple)) or not right.elts:
+                    raise ScreenError("'in' needs a list of values, e.g. technicals_trend in [\"Bullish\", \"Very Bullish\"].")
+                for element in right.elts:
+                    _check_text(element, fields, allow_field=False)
+            elif type(op) not in COMPARISONS:
+                raise ScreenError(f"Unsupported comparison '{ast.unparse(node)}'.")
+            elif _is_text(left) or _is_text(right):
+                if _is_text_field(left) == _is_text_field(right):
+                    raise ScreenError("Compare a text field with a quoted value, e.g. recommendation == \"Buy\".")
+                if not isinstance(op, (ast.Eq, ast.NotEq)):
+                    raise ScreenError("Text fields only support ==, != and in.")
+                _check_text(left, fields)
+                _check_text(right, fields)
+            else:
+                _check_number(left, fields)
+                _check_number(right, fields)
+    else:
+        raise ScreenError(f"'{ast.unparse(node)}' is not a condition. Use comparisons joined with and/or/not.")
+
+
+def _is_text_field(node):
+    return isinstance(node, ast.Name) and node.id in TEXT_FIELDS
+
+
+def _is_text(node):
+    return _is_text_field(node) or (isinstance(node, ast.Constant) and isinstance(node.value, str))
+
+
+def _check_text(node, fields, allow_field=True, allow_constant=True):
+    if allow_field and _is_text_field(node):
+        fields.add(node.id)
+    elif not (allow_constant and isinstance(node, ast.Constant) and isinstance(node.value, str)):
+        raise ScreenError(f"Expected a text field or a quoted value, got '{ast.unparse(node)}'.")
+
+
+def _check_number(node, fields):
+    if isinstance(node, ast.Name):
+        if node.id not in NUMERIC_FIELDS:
+            raise ScreenError(f"Unknown field '{node.id}'.")
+        fields.add(node.id)
+    elif isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ScreenError(f"Expected a number, got '{ast.unparse(node)}'.")
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        _check_number(node.operand, fields)
+    elif isinstance(node, ast.BinOp) and type(node.op) in ARITHMETIC:
+        _check_number(node.left, fields)
+        _check_number(node.right, fields)
+        # Folds constant terms now, so e.g. 1/0 is rejected here rather than when the screen runs
+        _constant_value(node)
+    else:
+        raise ScreenError(f"Unsupported expression '{ast.unparse(node)}'.")
+
+
+def _constant_value(node):
+    """The value of a numeric term without fields (e.g. -5 or 2 * 10), else None."""
+    if isinstance(node, ast.Constant):
+        return float(node.value)
+    if isinstance(node, ast.UnaryOp):
+        value = _constant_value(node.operand)
+        return None if value is None else (-value if isinstance(node.op, ast.USub) else value)
+    if isinstance(node, ast.BinOp):
+        left, right = _constant_value(node.left), _constant_value(node.right)
+        if left is None or right is None:
+            return None
+        if isinstance(node.op, ast.Div):
+            if right == 0:
+                raise ScreenError(f"Division by zero in '{ast.unparse(node)}'.")
+            return left / right
+        return {ast.Add: left + right, ast.Sub: left - right, ast.Mult: left * right}[type(node.op)]
+    return None
+
+
+def _text_pattern(value):
+    return re.compile(f"^{re.escape(value.strip())}$", re.IGNORECASE)
+
+
+# --- MongoDB ---
+
+def _aggregation_term(node):
+    if isinstance(node, ast.Name):
+        return f"${NUMERIC_FIELDS[node.id]}"
+    constant = _constant_value(node)
+    if constant is not None:
+        return constant
+    if isinstance(node, ast.UnaryOp):
+        term = _aggregation_term(node.operand)
+        return {'$multiply': [-1, term]} if isinstance(node.op, ast.USub) else term
+    left, right = _aggregation_term(node.left), _aggregation_term(node.right)
+    if isinstance(node.op, ast.Div):
+        # $divide fails the whole aggregation on zero; null makes the comparison fail instead
+        return {'$cond': [{'$eq': [right, 0]}, None, {'$divide': [left, right]}]}
+    return {ARITHMETIC[type(node.op)]: [left, right]}
+
+
+def _compile_comparison(op, left, right):
+    if isinstance(op, (ast.In, ast.NotIn)):
+        patterns = [_text_pattern(element.value) for element in right.elts]
+        if isinstance(op, ast.In):
+            return {TEXT_FIELDS[left.id]: {'$in': patterns}}
+        return {TEXT_FIELDS[left.id]: {'$type': 'string', '$nin': patterns}}
+
+    if _is_text(left) or _is_text(right):
+        field, value = (left, right) if _is_text_field(left) else (right, left)
+        if isinstance(op, ast.Eq):
+            return {TEXT_FIELDS[field.id]: _text_pattern(value.value)}
+        return {TEXT_FIELDS[field.id]: {'$type': 'string', '$not': _text_pattern(value.value)}}
+
+    left_value, right_value = _constant_value(left), _constant_value(right)
+    if left_value is not None and right_value is not None:
+        return {} if COMPARISONS[type(op)][1](left_value, right_value) else {'_id': {'$exists': False}}
+    if isinstance(left, ast.Name) and right_value is not None:
+        return _field_condition(NUMERIC_FIELDS[left.id], op, right_value)
+    if isinstance(right, ast.Name) and left_value is not None:
+        return _field_condition(NUMERIC_FIELDS[right.id], FLIPPED[type(op)](), left_value)
+
+    # Field against field or arithmetic: $expr, with both sides required to be numbers
+    # (aggregation orders null below every number, so `null < 5` would be true)
+    left_term, right_term = _aggregation_term(left), _aggregation_term(right)
+    conditions = [{'$gt': [term, None]} for term in (left_term, right_term) if not isinstance(term, float)]
+    conditions.append({COMPARISONS[type(op)][0]: [left_term, right_term]})
+    return {'$expr': {'$and': conditions}}
+
+
+def _field_condition(path, op, value):
+    if isinstance(op, ast.NotEq):
+        return {path: {'$nin': [value, None]}}
+    if isinstance(op, ast.Eq):
+        return {path: value}
+    # Query comparisons never match null or missing values
+    return {path: {COMPARISONS[type(op)][0]: value}}
+
+
+def _compile_match(node):
+    if isinstance(node, ast.BoolOp):
+        key = '$and' if isinstance(node.op, ast.And) else '$or'
+        return {key: [_compile_match(value) for value in node.values]}
+    if isinstance(node, ast.UnaryOp):
+        return {'$nor': [_compile_match(node.operand)]}
+    operands = [node.left] + node.comparators
+    conditions = [_compile_comparison(op, left, right) for op, left, right in zip(node.ops, operands, operands[1:])]
+    return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
+
+# --- Cached frame ---
+
+def _frame_term(node, df):
+    if isinstance(node, ast.Name):
+        return pd.to_numeric(df[FRAME_COLUMNS[node.id]], errors='coerce').to_numpy(dtype=float)
+    constant = _constant_value(node)
+    if constant is not None:
+        return constant
+    if isinstance(node, ast.UnaryOp):
+        term = _frame_term(node.operand, df)
+        return -term if isinstance(node.op, ast.USub) else term
+    left, right = _frame_term(node.left, df), _frame_term(node.right, df)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if isinstance(node.op, ast.Div):
+            return np.where(np.asarray(right) == 0, np.nan, np.divide(left, right))
+        return {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply}[type(node.op)](left, right)
+
+
+def _frame_text(df, field):
+    values = df[FRAME_COLUMNS[field]].to_numpy(dtype=object)
+    return np.array([value.strip().lower() if isinstance(value, str) else None for value in values], dtype=object)
+
+
+def _frame_comparison(op, left, right, df):
+    if isinstance(op, (ast.In, ast.NotIn)):
+        text = _frame_text(df, left.id)
+        matches = np.isin(text, [element.value.strip().lower() for element in right.elts])
+        return matches if isinstance(op, ast.In) else ~matches & (text != None)  # noqa: E711
+
+    if _is_text(left) or _is_text(right):
+        field, value = (left, right) if _is_text_field(left) else (right, left)
+        text = _frame_text(df, field.id)
+        equal = text == value.value.strip().lower()
+        return equal if isinstance(op, ast.Eq) else ~equal & (text != None)  # noqa: E711
+
+    left_term, right_term = _frame_term(left, df), _frame_term(right, df)
+    with np.errstate(invalid='ignore'):
+        result = COMPARISONS[type(op)][1](left_term, right_term)
+    # NaN != x is true in NumPy; a missing value fails every comparison here
+    present = ~np.isnan(left_term) & ~np.isnan(right_term)
+    return np.broadcast_to(result & present, (len(df),))
+
+
+def _frame_mask(node, df):
+    if isinstance(node, ast.BoolOp):
+        masks = [_frame_mask(value, df) for value in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return combine.reduce(masks)
+    if isinstance(node, ast.UnaryOp):
+        return ~_frame_mask(node.operand, df)
+    operands = [node.left] + node.comparators
+    masks = [_frame_comparison(op, left, right, df) for op, left, right in zip(node.ops, operands, operands[1:])]
+    return np.logical_and.reduce(masks)
+
+
+# --- Running screens ---
+
+def result_fields(screen):
+    return RESULT_FIELDS + sorted(screen.fields - set(RESULT_FIELDS) - {'company_name', 'symbol'})
+
+
+def _sort_spec(sort_by):
+    sort = (sort_by or [{'column_id': 'company_name', 'direction': 'asc'}])[0]
+    return sort['column_id'], sort['direction'] == 'asc'
+
+
+def _run_on_mongo(screen, quarter_key, fields, page_current, page_size, sort_by):
+    column, ascending = _sort_spec(sort_by)
+    sort_path = NUMERIC_FIELDS.get(column) or TEXT_FIELDS.get(column) or column
+    projection = {'_id': 0, 'company_name': 1, 'symbol': 1, 'quarter': 1}
+    projection.update({NUMERIC_FIELDS.get(field) or TEXT_FIELDS[field]: 1 for field in fields})
+    pipeline = [
+        # quarter_key leads the match so the (quarter_key, company_name) index narrows it first
+        {'$match': {'quarter_key': quarter_key, '$and': [screen.to_match()]}},
+        {'$facet': {
+            'rows': [
+                {'$sort': {sort_path: 1 if ascending else -1, 'company_name': 1}},
+                {'$skip': page_current * page_size},
+                {'$limit': page_size},
+                {'$project': projection},
+            ],
+            'total': [{'$count': 'matched'}],
+        }},
+    ]
+    result = next(get_quarterly_collection().aggregate(pipeline), {'rows': [], 'total': []})
+
+    rows = []
+    for doc in result['rows']:
+        row = {'company_name': doc.get('company_name'), 'symbol': doc.get('symbol'), 'quarter': doc.get('quarter')}
+        for field in fields:
+            value = doc
+            for key in (NUMERIC_FIELDS.get(field) or TEXT_FIELDS[field]).split('.'):
+                value = value.get(key) if isinstance(value, dict) else None
+            row[field] = value
+        rows.append(row)
+    matched = result['total'][0]['matched'] if result['total'] else 0
+    return rows, matched
+
+
+def _run_on_frame(screen, df, fields, page_current, page_size, sort_by):
+    matched = df[screen.frame_mask(df)]
+    column, ascending = _sort_spec(sort_by)
+    column = FRAME_RESULT_COLUMNS.get(column, column)
+    if column in matched.columns:
+        matched = matched.sort_values([column, 'company_name'], ascending=[ascending, True], na_position='last')
+    page = matched.iloc[page_current * page_size:(page_current + 1) * page_size]
+
+    columns = {field: FRAME_RESULT_COLUMNS.get(field, field) for field in fields}
+    rows = [
+        dict({'company_name': record['company_name'], 'symbol': record['symbol'], 'quarter': record.get('quarter')},
+             **{field: (None if pd.isna(record.get(column)) else record.get(column)) for field, column in columns.items()})
+        for record in page.to_dict('records')
+    ]
+    return rows, len(matched)
+
+
+def run_screen(screen, quarter_key, page_current=0, page_size=SCREEN_PAGE_SIZE, sort_by=None, frame=None):
+    """
+    Runs a parsed screen over one quarter. frame is the cached overview frame for that quarter
+    and the current data generation, if this process holds one; it is used when it carries
+    every field the screen needs. Returns {'rows', 'fields', 'matched', 'page_count', 'engine', 'elapsed_ms'}.
+    """
+    fields = result_fields(screen)
+    page_current = page_current or 0
+    started = time.perf_counter()
+    if screen.runs_on_frame(frame):
+        rows, matched = _run_on_frame(screen, frame, fields, page_current, page_size, sort_by)
+        engine = 'cached frame'
+    else:
+        rows, matched = _run_on_mongo(screen, quarter_key, fields, page_current, page_size, sort_by)
+        engine = 'MongoDB'
+    return {
+        'rows': rows,
+        'fields': fields,
+        'matched': matched,
+        'page_count': max(1, -(-matched // page_size)),
+        'engine': engine,
+        'elapsed_ms': (time.perf_counter() - started) * 1000,
+    }
+
+
+# --- Saved screens ---
+
+def get_saved_screens_collection():
+    return DatabaseConnection.get_collection(SAVED_SCREENS_COLLECTION)
+
+
+def list_saved_screens():
+    try:
+        return list(get_saved_screens_collection().find({}, {'expression': 1}).sort('_id', 1))
+    except PyMongoError as e:
+        print(f"Error loading saved screens: {str(e)}")
+        return []
+
+
+def save_screen(name, expression):
+    """Validates and stores a screen under name, replacing any screen with that name."""
+    name = (name or '').strip()
+    if not name:
+        raise ScreenError("Give the screen a name to save it.")
+    screen = parse_screen(expression)
+    now = datetime.datetime.utcnow()
+    get_saved_screens_collection().update_one(
+        {'_id': name},
+        {'$set': {'expression': screen.expression, 'updated_at': now}, '$setOnInsert': {'created_at': now}},
+        upsert=True
+    )
+    return screen
+
+
+def delete_screen(name):
+    get_saved_screens_collection().delete_one({'_id': name})
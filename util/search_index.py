@@ -0,0 +1,142 @@
+# util/search_index.py
+"""
+In-memory search over company names and symbols for the sidebar search box.
+
+Prefix matches come from a sorted token list (bisect), fuzzy matches from a trigram
+index, so a keystroke never touches MongoDB. The index is rebuilt when the
+detailed_financials data generation moves or when refresh_search_index() is called.
+"""
+
+import re
+import time
+import bisect
+import logging
+import threading
+from util.database import DatabaseConnection
+from util.data_version import get_data_generation
+
+SEARCH_RESULTS_LIMIT = 10
+GENERATION_CHECK_INTERVAL = 30  # seconds between data generation checks
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text):
+    return ' '.join(TOKEN_PATTERN.findall(str(text).lower()))
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StockSearchIndex:
+    def __init__(self, entries):
+        # entries: [(company_name, symbol)]
+        self.entries = []
+        self.by_name = {}
+        tokens = []
+        self.trigram_index = {}
+        for company_name, symbol in entries:
+            if not company_name or normalize(company_name) in self.by_name:
+                continue
+            idx = len(self.entries)
+            name_key = normalize(company_name)
+            symbol_key = normalize(symbol) if symbol and symbol != 'NA' else ''
+            self.entries.append((company_name, symbol_key.upper(), name_key, symbol_key))
+            self.by_name[name_key] = idx
+            for token in set(name_key.split() + symbol_key.split()):
+                tokens.append((token, idx))
+            for gram in trigrams(name_key) | trigrams(symbol_key):
+                self.trigram_index.setdefault(gram, set()).add(idx)
+        tokens.sort()
+        self.tokens = [token for token, _ in tokens]
+        self.token_ids = [idx for _, idx in tokens]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, company_name):
+        """Exact, case-insensitive name lookup. Returns the stored company name or None."""
+        idx = self.by_name.get(normalize(company_name))
+        return self.entries[idx][0] if idx is not None else None
+
+    def _prefix_ids(self, prefix):
+        start = bisect.bisect_left(self.tokens, prefix)
+        end = bisect.bisect_left(self.tokens, prefix + '\uffff')
+        return set(self.token_ids[start:end])
+
+    def search(self, query, limit=SEARCH_RESULTS_LIMIT):
+        query = normalize(query)
+        if not query:
+            return []
+
+        scores = {}
+        query_tokens = query.split()
+        # Every query word must prefix some word of the name or the symbol
+        prefix_ids = set.intersection(*(self._prefix_ids(token) for token in query_tokens))
+        for idx in prefix_ids:
+            _, _, name_key, symbol_key = self.entries[idx]
+            if query in (name_key, symbol_key):
+                scores[idx] = 3.0
+            elif name_key.startswith(query) or symbol_key.startswith(query):
+                scores[idx] = 2.0
+            else:
+                scores[idx] = 1.5
+
+        # Fuzzy fallback: share of the query's trigrams found in the name, for typos
+        query_grams = trigrams(query)
+        overlap = {}
+        for gram in query_grams:
+            for idx in self.trigram_index.get(gram, ()):
+                overlap[idx] = overlap.get(idx, 0) + 1
+        for idx, count in overlap.items():
+            similarity = count / len(query_grams)
+            if similarity >= 0.5:
+                scores[idx] = max(scores.get(idx, 0.0), similarity)
+
+        ranked = sorted(scores, key=lambda idx: (-scores[idx], len(self.entries[idx][2]), self.entries[idx][2]))
+        return [self.entries[idx][:2] for idx in ranked[:limit]]
+
+
+_index = None
+_index_generation = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def _load_entries():
+    collection = DatabaseConnection.get_collection('detailed_financials')
+    return [
+        (stock.get('company_name'), stock.get('symbol'))
+        for stock in collection.find({}, {'company_name': 1, 'symbol': 1, '_id': 0})
+    ]
+
+
+def refresh_search_index():
+    global _index, _index_generation, _index_checked_at
+    generation = get_data_generation(('detailed_financials',))
+    index = StockSearchIndex(_load_entries())
+    with _index_lock:
+        _index, _index_generation, _index_checked_at = index, generation, time.monotonic()
+    logging.info(f"Built stock search index over {len(index)} companies")
+    return index
+
+
+def get_search_index():
+    global _index_checked_at
+    if _index is None:
+        return refresh_search_index()
+    if time.monotonic() - _index_checked_at >= GENERATION_CHECK_INTERVAL:
+        _index_checked_at = time.monotonic()
+        if get_data_generation(('detailed_financials',)) != _index_generation:
+            return refresh_search_index()
+    return _index
+
+
+def search_stocks(query, limit=SEARCH_RESULTS_LIMIT):
+    """Returns dropdown options for the best matches, e.g. {'label': 'Infosys Ltd (INFY)', 'value': 'Infosys Ltd'}."""
+    return [
+        {'label': f"{name} ({symbol})" if symbol else name, 'value': name}
+        for name, symbol in get_search_index().search(query, limit)
+    ]
@@ -1,11 +1,18 @@
 # util/stock_utils.py
 
-import pandas as pd
 import dash_bootstrap_components as dbc
 from dash import html
 from typing import Any, Tuple, Optional
+import time
+import threading
 from functools import lru_cache
+from pymongo import DESCENDING
 from util.database import DatabaseConnection
+from util.data_version import get_data_generation
+from util.quarterly_metrics import get_quarterly_collection
+from util.general_util import get_typed_metrics, build_typed_metrics
+from util.recommendation import stored_recommendation
+from util.company_cache import get_company_symbol
 
 
 def get_value_attributes(value: Any, label: str) -> Tuple[str, str, str]:
@@ -61,65 +68,108 @@ def create_info_card(title, items, icon):
         ], className="py-2")
     ], className="stock-details-card h-100")
 
-@lru_cache(maxsize=1000)
+# Seconds a detailed_financials generation read is reused, i.e. the most a cache hit
+# can lag a scrape running in another process
+LATEST_METRICS_GENERATION_TTL = 5
+LATEST_METRIC_FIELDS = {
+    "net_profit_growth": "0",
+    "strengths": "0",
+    "weaknesses": "0",
+    "technicals_trend": "NA",
+    "fundamental_insights": "NA",
+    "piotroski_score": "0",
+    "market_cap": "NA",
+    "face_value": "NA",
+    "book_value": "NA",
+    "dividend_yield": "NA",
+    "ttm_pe": "NA",
+    "revenue": "NA",
+    "net_profit": "NA",
+    "cmp": "NA",
+    "report_type": "NA",
+    "result_date": "NA",
+    "gross_profit": "NA",
+    "gross_profit_growth": "NA",
+    "revenue_growth": "NA",
+    "ttm_eps": "NA",
+    "pb_ratio": "NA",
+    "sector_pe": "NA",
+    "estimates": "NA",
+}
+
+_latest_metrics_cache = {}  # symbol -> (generation, metrics)
+_latest_metrics_generation = [None, 0.0]  # last generation read, expires_at
+_latest_metrics_lock = threading.Lock()
+_latest_metrics_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def _financials_generation():
+    """detailed_financials' data generation, read at most every LATEST_METRICS_GENERATION_TTL seconds."""
+    now = time.monotonic()
+    with _latest_metrics_lock:
+        generation, expires_at = _latest_metrics_generation
+        if generation is not None and now < expires_at:
+            return generation
+
+    generation = get_data_generation(('detailed_financials',))
+    with _latest_metrics_lock:
+        _latest_metrics_generation[:] = [generation, now + LATEST_METRICS_GENERATION_TTL]
+    return generation
+
+
+def _load_latest_metrics(symbol):
+    # quarter_key is the precomputed latest-quarter pointer: one indexed read, no date parsing
+    latest_metric = get_quarterly_collection().find_one(
+        {"symbol": symbol}, {"_id": 0}, sort=[("quarter_key", DESCENDING)]
+    )
+
+    if not latest_metric:
+        metrics = dict(LATEST_METRIC_FIELDS)
+        metrics["typed"] = build_typed_metrics({})
+        metrics["recommendation"] = None
+        return metrics
+
+    metrics = {field: latest_metric.get(field, default) for field, default in LATEST_METRIC_FIELDS.items()}
+    metrics["typed"] = get_typed_metrics(latest_metric)
+    metrics["recommendation"] = stored_recommendation(latest_metric)
+    return metrics
+
+
 def fetch_latest_metrics(symbol):
-    collection = DatabaseConnection.get_collection('detailed_financials')
-    stock = collection.find_one({"symbol": symbol})
-    
-    if not stock or not stock.get('financial_metrics'):
-        return {
-            "net_profit_growth": "0",
-            "strengths": "0",
-            "weaknesses": "0",
-            "technicals_trend": "NA",
-            "fundamental_insights": "NA",
-            "piotroski_score": "0",
-            "market_cap": "NA",
-            "face_value": "NA",
-            "book_value": "NA",
-            "dividend_yield": "NA",
-            "ttm_pe": "NA",
-            "revenue": "NA",
-            "net_profit": "NA",
-            "cmp": "NA",
-            "report_type": "NA",
-            "result_date": "NA",
-            "gross_profit": "NA",
-            "gross_profit_growth": "NA",
-            "revenue_growth": "NA",
-            "ttm_eps": "NA",
-            "pb_ratio": "NA",
-            "sector_pe": "NA",
-            "estimates": "NA"
-        }
-
-    latest_metric = max(stock['financial_metrics'], key=lambda x: pd.to_datetime(x.get("result_date", "N/A")))
-
-    return {
-        "net_profit_growth": latest_metric.get("net_profit_growth", "0"),
-        "strengths": latest_metric.get("strengths", "0"),
-        "weaknesses": latest_metric.get("weaknesses", "0"),
-        "technicals_trend": latest_metric.get("technicals_trend", "NA"),
-        "fundamental_insights": latest_metric.get("fundamental_insights", "NA"),
-        "piotroski_score": latest_metric.get("piotroski_score", "0"),
-        "market_cap": latest_metric.get("market_cap", "NA"),
-        "face_value": latest_metric.get("face_value", "NA"),
-        "book_value": latest_metric.get("book_value", "NA"),
-        "dividend_yield": latest_metric.get("dividend_yield", "NA"),
-        "ttm_pe": latest_metric.get("ttm_pe", "NA"),
-        "revenue": latest_metric.get("revenue", "NA"),
-        "net_profit": latest_metric.get("net_profit", "NA"),
-        "cmp": latest_metric.get("cmp", "NA"),
-        "report_type": latest_metric.get("report_type", "NA"),
-        "result_date": latest_metric.get("result_date", "NA"),
-        "gross_profit": latest_metric.get("gross_profit", "NA"),
-        "gross_profit_growth": latest_metric.get("gross_profit_growth", "NA"),
-        "revenue_growth": latest_metric.get("revenue_growth", "NA"),
-        "ttm_eps": latest_metric.get("ttm_eps", "NA"),
-        "pb_ratio": latest_metric.get("pb_ratio", "NA"),
-        "sector_pe": latest_metric.get("sector_pe", "NA"),
-        "estimates": latest_metric.get("estimates", "NA")
-    }
+    """
+    Latest quarter's metrics for a symbol. Entries are served while detailed_financials'
+    data generation is unchanged, so a scrape in any process shows up within
+    LATEST_METRICS_GENERATION_TTL seconds.
+    """
+    generation = _financials_generation()
+    with _latest_metrics_lock:
+        entry = _latest_metrics_cache.get(symbol)
+        if entry and entry[0] == generation:
+            _latest_metrics_stats['hits'] += 1
+            return entry[1]
+
+    metrics = _load_latest_metrics(symbol)
+    with _latest_metrics_lock:
+        _latest_metrics_cache[symbol] = (generation, metrics)
+        _latest_metrics_stats['misses'] += 1
+    return metrics
+
+
+def invalidate_latest_metrics(symbol=None):
+    """Drops one symbol, or every symbol, from the fetch_latest_metrics cache. Call after ingestion."""
+    with _latest_metrics_lock:
+        # The next read re-checks the generation rather than trusting the last one
+        _latest_metrics_generation[:] = [None, 0.0]
+        if symbol is None:
+            _latest_metrics_cache.clear()
+        else:
+            _latest_metrics_cache.pop(symbol, None)
+        _latest_metrics_stats['invalidations'] += 1
+
+
+def get_latest_metrics_stats():
+    with _latest_metrics_lock:
+        return dict(_latest_metrics_stats, size=len(_latest_metrics_cache))
 
 # Optimize fetch_stock_names with error handling
 @lru_cache(maxsize=500)
@@ -132,7 +182,8 @@ def fetch_stock_names():
         return []
 
 def get_stock_symbol(company_name):
-    stock = DatabaseConnection.get_collection('detailed_financials').find_one({"company_name": company_name})
-    if stock and 'symbol' in stock:
-        return f"{stock['symbol']}.NS"
+    # Shares the stock details page's read of the company's quarters
+    symbol = get_company_symbol(company_name)
+    if symbol:
+        return f"{symbol}.NS"
     return None
\ No newline at end of file
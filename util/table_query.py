@@ -0,0 +1,145 @@
+# util/table_query.py
+"""
+Server-side paging, sorting and filtering for DataTables running with
+page_action/sort_action/filter_action='custom'. Translates the table's
+filter_query syntax (e.g. '{cmp} > 100 && {company_name} icontains tata', '{cmp} is blank')
+into pandas operations over an already-built frame.
+"""
+
+import re
+import math
+import pandas as pd
+
+FILTER_PART_PATTERN = re.compile(
+    r'^\{(?P<column>[^}]+)\}\s+(?P<case>[si]?)(?P<operator>>=|<=|!=|<|>|=|eq|ne|lt|le|gt|ge|contains|datestartswith)\s+(?P<value>.+)$',
+    re.IGNORECASE
+)
+
+UNARY_PART_PATTERN = re.compile(r'^\{(?P<column>[^}]+)\}\s+is\s+(?P<kind>\w+)$', re.IGNORECASE)
+
+OPERATOR_ALIASES = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}
+
+
+class FilterQueryError(ValueError):
+    """A filter_query part that can't be applied; the table shows the message instead of rows."""
+
+
+def _is_nil(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _is_num(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and not _is_nil(value)
+
+
+def _is_prime(value):
+    if not _is_num(value) or value != int(value) or value < 2:
+        return False
+    n = int(value)
+    return all(n % d for d in range(2, math.isqrt(n) + 1))
+
+
+# Dash's unary operators, e.g. '{cmp} is blank'
+UNARY_OPERATORS = {
+    'blank': lambda v: _is_nil(v) or (isinstance(v, str) and not v.strip()),
+    'nil': _is_nil,
+    'num': _is_num,
+    'str': lambda v: isinstance(v, str),
+    'bool': lambda v: isinstance(v, bool),
+    'object': lambda v: isinstance(v, (dict, list)),
+    'even': lambda v: _is_num(v) and v % 2 == 0,
+    'odd': lambda v: _is_num(v) and v % 2 == 1,
+    'prime': _is_prime,
+}
+
+
+def parse_filter_part(filter_part):
+    """Returns (column, operator, value, case_insensitive) or None for a part we can't parse."""
+    unary = UNARY_PART_PATTERN.match(filter_part.strip())
+    if unary and unary.group('kind').lower() in UNARY_OPERATORS:
+        return unary.group('column'), 'is', unary.group('kind').lower(), False
+
+    match = FILTER_PART_PATTERN.match(filter_part.strip())
+    if not match:
+        return None
+
+    operator = match.group('operator').lower()
+    operator = OPERATOR_ALIASES.get(operator, operator)
+    case_insensitive = match.group('case').lower() == 'i'
+
+    value = match.group('value').strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in ('"', "'", '`'):
+        value = value[1:-1].replace('\\' + value[0], value[0])
+    elif operator not in ('contains', 'datestartswith'):
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    return match.group('column'), operator, value, case_insensitive
+
+
+def _filter_mask(series, operator, value, case_insensitive):
+    if operator == 'is':
+        return series.map(UNARY_OPERATORS[value]).astype(bool)
+
+    if operator == 'datestartswith':
+        # Dash matches a date prefix against the ISO form, e.g. '2024-05' for May 2024
+        dates = pd.to_datetime(series, errors='coerce', format='mixed')
+        return dates.dt.strftime('%Y-%m-%d %H:%M:%S').str.startswith(str(value), na=False)
+
+    if operator == 'contains':
+        text = series.astype(str)
+        value = str(value)
+        if case_insensitive:
+            text, value = text.str.lower(), value.lower()
+        return text.str.contains(value, regex=False, na=False)
+
+    if isinstance(value, float) and pd.api.types.is_numeric_dtype(series):
+        column = series
+    else:
+        column, value = series.astype(str), str(value)
+        if case_insensitive:
+            column, value = column.str.lower(), value.lower()
+
+    comparisons = {
+        '=': column.__eq__, '!=': column.__ne__,
+        '<': column.__lt__, '<=': column.__le__,
+        '>': column.__gt__, '>=': column.__ge__,
+    }
+    return comparisons[operator](value).fillna(False)
+
+
+def filter_frame(df, filter_query):
+    """Rows matching every ' && '-joined part. Raises FilterQueryError rather than ignore a part."""
+    if not filter_query:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for part in filter_query.split(' && '):
+        parsed = parse_filter_part(part)
+        if parsed is None:
+            raise FilterQueryError(f"Unsupported filter: {part.strip()}")
+        column, operator, value, case_insensitive = parsed
+        if column not in df.columns:
+            raise FilterQueryError(f"Unknown column in filter: {column}")
+        mask &= _filter_mask(df[column], operator, value, case_insensitive)
+    return df[mask]
+
+
+def sort_frame(df, sort_by):
+    sort_by = [s for s in (sort_by or []) if s['column_id'] in df.columns]
+    if not sort_by:
+        return df
+    return df.sort_values(
+        [s['column_id'] for s in sort_by],
+        ascending=[s['direction'] == 'asc' for s in sort_by],
+        na_position='last'
+    )
+
+
+def query_frame(df, filter_query=None, sort_by=None, page_current=0, page_size=25):
+    """Filters, sorts and slices df for one table page. Returns (page_df, page_count)."""
+    result = sort_frame(filter_frame(df, filter_query), sort_by)
+    page_current = page_current or 0
+    page_count = max(1, math.ceil(len(result) / page_size))
+    start = page_current * page_size
+    return result.iloc[start:start + page_size], page_count
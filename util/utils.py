@@ -1,64 +1,53 @@
 import base64
-from functools import lru_cache
 import pandas as pd
 import numpy as np
 import re
 from datetime import datetime
-from util.database import DatabaseConnection
+from util.database import DatabaseConnection, QueryBudgetExceeded
 import logging
-from util.ai_recommendation import process_stock_batch
+from util.ai_recommendation import process_stock_batch, fetch_latest_analyses
+from util.quarterly_metrics import fetch_quarter_metrics, fetch_latest_company_metrics
 
 
+# Round trips allowed for one overview build: holdings distinct, the quarter query,
+# the latest-analysis aggregation, the AI settings lookup and some headroom. getMore
+# batches aren't counted (see check_query_budget), so it doesn't grow with the number of stocks.
+OVERVIEW_QUERY_BUDGET = 6
 
-# Optimize fetch_latest_quarter_data with bulk operations and caching
-@lru_cache(maxsize=100)
-def fetch_latest_quarter_data():
+
+# Bulk-fetch the overview rows; caching is done by the callers, keyed on the data generation
+def fetch_latest_quarter_data(quarter_key=None):
+    """
+    Builds the overview rows for one quarter (or each company's latest quarter
+    when quarter_key is None) from the flattened quarterly_metrics store.
+    """
     try:
-        collection = DatabaseConnection.get_collection('detailed_financials')
-        portfolio_collection = DatabaseConnection.get_collection('holdings')
-        
-        # Bulk fetch portfolio stocks
-        portfolio_stocks = set(portfolio_collection.distinct('Instrument'))
-        
-        # Bulk fetch all stocks with latest metrics
-        pipeline = [
-            {
-                '$project': {
-                    'company_name': 1,
-                    'symbol': 1,
-                    'financial_metrics': {'$slice': ['$financial_metrics', -1]},
-                }
-            }
-        ]
-        
-        stocks = list(collection.aggregate(pipeline))
-        
-        # Prefetch AI analyses in bulk
-        symbols = [stock['symbol'] for stock in stocks]
-        ai_analyses = {
-            doc['symbol']: doc 
-            for doc in DatabaseConnection.get_collection('ai_analysis').find(
-                {'symbol': {'$in': symbols}},
-                sort=[('timestamp', -1)]
-            )
-        }
-        
-        # Process stocks in batches
-        batch_size = 100
-        stock_data = []
-        
-        for i in range(0, len(stocks), batch_size):
-            batch = stocks[i:i + batch_size]
-            batch_data = process_stock_batch(
-                batch, 
-                portfolio_stocks, 
-                ai_analyses
-            )
-            stock_data.extend(batch_data)
-        
+        with DatabaseConnection.track_commands() as commands:
+            portfolio_collection = DatabaseConnection.get_collection('holdings')
+
+            # Bulk fetch portfolio stocks
+            portfolio_stocks = set(portfolio_collection.distinct('Instrument'))
+
+            # Index lookup on (quarter_key, company_name) instead of slicing every document
+            if quarter_key:
+                stocks = fetch_quarter_metrics(quarter_key)
+            else:
+                stocks = fetch_latest_company_metrics()
+
+            # Latest analysis per symbol in one $group/$first aggregation
+            ai_analyses = fetch_latest_analyses({stock['symbol'] for stock in stocks})
+
+            stock_data = process_stock_batch(stocks, portfolio_stocks, ai_analyses)
+
+        DatabaseConnection.check_query_budget('Overview build', commands, OVERVIEW_QUERY_BUDGET)
+
         df = pd.DataFrame(stock_data)
+        if df.empty:
+            return df
         return df.sort_values(by="result_date", ascending=False)
         
+    except QueryBudgetExceeded:
+        raise
     except Exception as e:
         logging.error(f"Error fetching latest quarter data: {str(e)}")
         return pd.DataFrame()